@@ -0,0 +1,43 @@
+"""Módulo 'machine' falso para ejecutar el firmware en Linux (ver bench/loadgen.py)."""
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 2
+
+    def __init__(self, name, mode=0, pull=None, value=None):
+        self.name = name
+        self._v = 1 if value is None else value
+
+    def value(self, v=None):
+        if v is None:
+            return self._v
+        self._v = v
+
+
+class ADC:
+    def __init__(self, name):
+        self.name = name
+
+    def read(self):
+        return 1300
+
+
+class WDT:
+    def __init__(self, timeout=0):
+        self.timeout = timeout
+
+    def feed(self):
+        pass
+
+
+class UART:
+    """No hay UART secundario: el coordinador recurre a stdout para la depuración."""
+
+    def __init__(self, *a, **k):
+        raise OSError("no UART")
+
+
+def reset():
+    raise SystemExit
@@ -0,0 +1,45 @@
+"""Módulo 'xbee' falso respaldado por la red simulada de bench/simnet.py."""
+import simnet
+
+ADDR_BROADCAST = b'\x00\x00\x00\x00\x00\x00\xff\xff'
+ADDR_COORDINATOR = b'\x00\x00\x00\x00\x00\x00\x00\x00'
+PIN_WAKE = 1
+RTC_WAKE = 2
+
+
+def receive():
+    return simnet.NET.coord_receive()
+
+
+def transmit(dest, payload, **kwargs):
+    return simnet.NET.coord_transmit(dest, payload, **kwargs)
+
+
+def atcmd(cmd, value=None):
+    return simnet.NET.atcmd(cmd, value)
+
+
+def receive_callback(cb):
+    simnet.NET.rx_callback = cb
+
+
+class _ModemStatus:
+    def callback(self, cb):
+        simnet.NET.modem_cb = cb
+
+    def receive(self):
+        return None
+
+
+modem_status = _ModemStatus()
+
+
+class XBee:
+    def atcmd(self, cmd, value=None):
+        return atcmd(cmd, value)
+
+    def sleep_now(self, ms, pin_wake=False):
+        simnet.CLOCK.sleep_ms(ms)
+
+    def wake_reason(self):
+        return RTC_WAKE
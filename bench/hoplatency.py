@@ -0,0 +1,192 @@
+"""
+Latencia de un comando telemando -> cámara con recepción por sondeo y por receive_callback.
+
+Dos fases sobre la red simulada de simnet (la radio "del coordinador" es la del nodo medido):
+  1. code/Camara/main.Camara.run() recibe TEL:ON/OFF de un telemando simulado; se mide
+     desde que la trama llega a su radio hasta que transmite "TEL:..:OK".
+  2. XBeeDevice.safe_send_and_wait_ack (el envío del telemando) contra una cámara simulada
+     que tarda en contestar lo medido en la fase 1; se mide la espera completa del telemando.
+
+Uso: python3 bench/hoplatency.py [--commands N] [--cpu-scale K] [--repo RUTA]
+Con --repo se mide el firmware de otro árbol (p. ej. un worktree del commit anterior).
+"""
+import argparse
+import builtins
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.join(HERE, '..')
+sys.path.insert(0, os.path.join(HERE, 'fakes'))
+sys.path.insert(0, HERE)
+import simnet  # noqa: E402
+
+FIRMWARE_MODULES = ('main', 'tools', 'metrics', 'at_cache', 'eventlog', 'battery', 'outbox', 'async_device')
+CLOCK_NAMES = ('ticks_ms', 'ticks_us', 'ticks_diff', 'ticks_add', 'sleep_ms', 'sleep')
+COORDINATOR_ADDR = b'\x00\x13\xA2\x00\x42\x3D\x8B\x99'
+STARTUP_MS = 8000                   # setup() espera 5 s y el HELLO necesita su ACK
+COMMAND_PERIOD_MS = 2000            # Un comando cada ~2 s, con fase aleatoria
+
+
+def load_firmware(repo, profile_dir):
+    """Importa tools (y el main.py del perfil si se indica) desde 'repo'."""
+    paths = [os.path.join(repo, 'code')]
+    if profile_dir:
+        paths.insert(0, os.path.join(repo, 'code', profile_dir))
+    for path in paths[::-1]:
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+    for mod in FIRMWARE_MODULES:
+        sys.modules.pop(mod, None)
+    import tools
+    if not profile_dir:
+        return tools
+    import main
+    return main
+
+
+def simulate(body, duration_ms, cpu_scale, **netkw):
+    """Ejecuta body(net) con el reloj virtual instalado en 'time' hasta duration_ms."""
+    real = {name: getattr(time, name, None) for name in CLOCK_NAMES}
+    clock = simnet.Clock(cpu_scale=cpu_scale)
+    net = simnet.Network(clock, **netkw)
+    simnet.NET = net
+    simnet.CLOCK = clock
+    for name in CLOCK_NAMES:
+        setattr(time, name, getattr(clock, name))
+    try:
+        clock.end_ms = duration_ms
+        try:
+            body(net)
+        except simnet.StopSimulation:
+            pass
+    finally:
+        for name, fn in real.items():
+            if fn is None:
+                delattr(time, name)
+            else:
+                setattr(time, name, fn)
+    return net
+
+
+def add_peer(net, name, address, responder):
+    """Nodo simulado con dirección fija que contesta con responder(payload) (None: no contesta)."""
+    node = net.add_node(name)
+    del net.nodes[node.addr]
+    node.addr = address
+    net.nodes[address] = node
+    node.reply = responder
+    return node
+
+
+def peer_responder(node, payload):
+    reply = getattr(node, 'reply', None)
+    return reply(payload) if reply else simnet.default_responder(node, payload)
+
+
+def camera_phase(repo, callback, commands, cpu_scale, seed):
+    """Latencias (ms) radio de la cámara -> "TEL:..:OK" transmitido."""
+    mod = load_firmware(repo, 'Camara')
+    mod.Camara.RX_CALLBACK = callback
+    arrivals = {}
+    latencies = []
+
+    def body(net):
+        net.responder = peer_responder
+        add_peer(net, 'XBEE_COOR', COORDINATOR_ADDR, lambda payload: b'OK')
+        remote = add_peer(net, 'TELEMANDO', simnet.addr(100), lambda payload: None)
+        arrive = net._arrive
+
+        def tracked_arrive(frame, node=None):
+            arrivals[frame['payload'].split(b'#')[-1]] = net.clock.now
+            arrive(frame, node)
+        net._arrive = tracked_arrive
+
+        transmit = net.coord_transmit
+
+        def tracked_transmit(dest, payload, **kwargs):
+            data = payload.encode() if isinstance(payload, str) else bytes(payload)
+            if data.endswith(b':OK') and data[:-3] in arrivals:
+                latencies.append(net.clock.now - arrivals.pop(data[:-3]))
+            return transmit(dest, payload, **kwargs)
+        net.coord_transmit = tracked_transmit
+
+        def send(i):
+            if i >= commands:
+                return
+            action = b'ON' if i % 2 == 0 else b'OFF'
+            net.air_to_coord(remote, b"%d#TEL:%s" % (i + 1, action))
+            net.schedule(COMMAND_PERIOD_MS + net.rng.uniform(0, 200), lambda: send(i + 1))
+        net.schedule(STARTUP_MS + net.rng.uniform(0, COMMAND_PERIOD_MS), lambda: send(0))
+        mod.Camara(xbee_instance=mod.xbee_device).run()
+
+    simulate(body, STARTUP_MS + (commands + 2) * (COMMAND_PERIOD_MS + 200), cpu_scale, seed=seed)
+    return latencies
+
+
+def sender_phase(repo, callback, service_ms, commands, cpu_scale, seed):
+    """Duración (ms) de safe_send_and_wait_ack hasta recibir "TEL:..:OK" de la cámara."""
+    tools = load_firmware(repo, None)
+    durations = []
+
+    class Sender(tools.XBeeDevice):
+        RX_CALLBACK = callback
+
+    def body(net):
+        camera = add_peer(net, 'XBEE_CAM', b'\x00\x13\xA2\x00\x42\x3D\x8A\xAC', None)
+
+        def respond(payload):
+            # La cámara contesta tras el tiempo de servicio medido en la fase 1
+            delay = service_ms[net.rng.randrange(len(service_ms))]
+            net.schedule(delay, lambda: net.air_to_coord(camera, bytes(payload) + b':OK'))
+        camera.reply = lambda payload: respond(payload) if payload.startswith(b'TEL:') else None
+        net.responder = peer_responder
+        device = Sender(device_id="XBEE_TELEMANDO")
+        if callback and hasattr(device, 'watch_receive'):
+            device.watch_receive()
+        for i in range(commands):
+            time.sleep_ms(COMMAND_PERIOD_MS // 2 + net.rng.randrange(COMMAND_PERIOD_MS // 2))
+            start = net.clock.now
+            if device.safe_send_and_wait_ack(camera.addr, "TEL:ON" if i % 2 == 0 else "TEL:OFF"):
+                durations.append(net.clock.now - start)
+
+    simulate(body, (commands + 2) * COMMAND_PERIOD_MS * 4, cpu_scale, seed=seed)
+    return durations
+
+
+def describe(values):
+    if not values:
+        return "sin muestras"
+    return "n={} media={:.1f} p50={:.1f} p95={:.1f} máx={:.1f}".format(
+        len(values), sum(values) / len(values), simnet.percentile(values, 50),
+        simnet.percentile(values, 95), max(values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--cpu-scale', type=float, default=20.0,
+                        help="ms simulados por ms de CPU del host (el XBee3 es mucho más lento que un PC)")
+    parser.add_argument('--repo', default=REPO, help="árbol cuyo firmware se mide")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    out = sys.stdout.write
+    real_print = builtins.print
+    builtins.print = lambda *a, **k: None
+    try:
+        for callback in (False, True):
+            label = "callback" if callback else "sondeo"
+            service = camera_phase(args.repo, callback, args.commands, args.cpu_scale, args.seed)
+            total = sender_phase(args.repo, callback, service or [0.0], args.commands, args.cpu_scale, args.seed)
+            out("{:8s} cámara: {}\n".format(label, describe(service)))
+            out("{:8s} telemando->cámara->ACK: {}\n".format(label, describe(total)))
+    finally:
+        builtins.print = real_print
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Generador de carga para Coordinator.run en Linux.
+
+Sustituye los módulos xbee y machine por los de bench/fakes, y sys.stdin/stdout por el
+UART simulado hacia el ESP32. Ejecuta code/COORD/main_dev.Coordinator contra cientos de
+sensores simulados con pérdidas y latencia, y un flujo de comandos del ESP32. Al final
+informa del caudal, la tasa de pérdida, los percentiles de latencia de ACK y la latencia
+de los comandos del ESP32.
+
+Uso: python3 bench/loadgen.py [--devices N] [--period-ms T] [--loss P] [--duration-s S] ...
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.join(HERE, '..')
+sys.path.insert(0, os.path.join(HERE, 'fakes'))
+sys.path.insert(0, HERE)
+import simnet  # noqa: E402
+
+FIRMWARE_MODULES = ('main_dev', 'tools', 'metrics', 'at_cache', 'ttl_frame', 'telemetry', 'battery', 'eventlog',
+                    'outbox', 'async_device')
+STARTUP_MS = 6000       # Coordinator.setup() espera 5 s antes de arrancar
+
+REAL_STDOUT = sys.stdout
+REAL_STDIN = sys.stdin
+
+
+def load_coordinator(net, clock, repo=REPO):
+    """Importa main_dev con el reloj y la red simulados (recargando el firmware de 'repo')."""
+    simnet.NET = net
+    simnet.CLOCK = clock
+    for name in ('ticks_ms', 'ticks_us', 'ticks_diff', 'ticks_add', 'sleep_ms', 'sleep'):
+        setattr(time, name, getattr(clock, name))
+    for path in (os.path.join(repo, 'code'), os.path.join(repo, 'code', 'COORD')):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+    for mod in FIRMWARE_MODULES:
+        sys.modules.pop(mod, None)
+    sys.stdout = simnet.FakeStdout(net)
+    sys.stdin = simnet.FakeStdin(net)
+    import main_dev
+    return main_dev
+
+
+def run(coord_factory=None, duration_ms=60000, setup=None, repo=REPO, **netkw):
+    """
+    Ejecuta el coordinador durante duration_ms de tiempo simulado.
+    setup(net, coord) añade nodos y programa eventos antes de arrancar.
+    Devuelve (net, coord, clock).
+    """
+    real = {name: getattr(time, name, None) for name in ('ticks_ms', 'ticks_us', 'ticks_diff', 'ticks_add', 'sleep_ms', 'sleep')}
+    clock = simnet.Clock(start_ticks=netkw.pop('start_ticks', 0), cpu_scale=netkw.pop('cpu_scale', 1.0))
+    net = simnet.Network(clock, **netkw)
+    try:
+        mod = load_coordinator(net, clock, repo)
+        coord = coord_factory(mod) if coord_factory else mod.Coordinator(mod.xbee_device)
+        if setup:
+            setup(net, coord)
+        clock.end_ms = clock.now + duration_ms
+        try:
+            coord.run()
+        except simnet.StopSimulation:
+            pass
+    finally:
+        sys.stdout = REAL_STDOUT
+        sys.stdin = REAL_STDIN
+        for name, fn in real.items():
+            if fn is None:
+                delattr(time, name)
+            else:
+                setattr(time, name, fn)
+    return net, coord, clock
+
+
+def schedule_esp32_stream(net, names, per_minute, start_ms=STARTUP_MS):
+    """Comandos REPORT:<nodo> y STATS:<nodo> a intervalos exponenciales de media 60/per_minute s."""
+    if per_minute <= 0 or not names:
+        return
+    mean_ms = 60000.0 / per_minute
+
+    def send():
+        name = net.rng.choice(names)
+        net.esp32_send(("REPORT:{}" if net.rng.random() < 0.5 else "STATS:{}").format(name))
+        net.schedule(net.rng.expovariate(1.0 / mean_ms), send)
+
+    net.schedule(start_ms + net.rng.expovariate(1.0 / mean_ms), send)
+
+
+def delivered_reports(net):
+    """Reportes distintos (nodo, secuencia) que llegaron al ESP32."""
+    seen = set()
+    for _, line in net.stdout_lines:
+        if line.startswith(b'REPORT:') and not line.startswith(b'REPORT_'):
+            seen.add((line.split(b':')[1], line.rsplit(b' ', 1)[-1]))
+        elif line.startswith(b'REPORTS:'):
+            for entry in line[8:].split(b'|'):
+                seen.add((entry.split(b':')[0], entry.rsplit(b' ', 1)[-1]))
+    return seen
+
+
+def summarize(net, duration_ms, devices):
+    seconds = duration_ms / 1000.0
+    stats = net.stats
+    delivered = len(delivered_reports(net))
+    generated = stats['generated']
+    return {
+        'devices': devices,
+        'duration_s': seconds,
+        'generated': generated,
+        'offered_per_s': round(generated / seconds, 2),
+        'delivered': delivered,
+        'delivered_per_s': round(delivered / seconds, 2),
+        'drop_rate': round(1.0 - delivered / generated, 4) if generated else 0.0,
+        'acked': stats['acked'],
+        'retries': stats['retries'],
+        'gave_up': stats['gave_up'],
+        'lost_air': stats['lost_air'],
+        'rx_overflow': stats['rx_overflow'],
+        'rx_queue_hwm': net.queue_hwm,
+        'coord_tx': stats['coord_tx'],
+        'uart_bytes_per_s': round(net.stdout_bytes / seconds, 1),
+        'ack_ms': {p: round(simnet.percentile(net.ack_latency, p), 1) for p in (50, 95, 99)},
+        'esp32_answered': len(net.esp32_latency),
+        'esp32_unanswered': len(net.esp32_pending),
+        'esp32_ms': {p: round(simnet.percentile(net.esp32_latency, p), 1) for p in (50, 95, 99)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--devices', type=int, default=100, help="sensores simulados")
+    parser.add_argument('--period-ms', type=int, default=10000, help="periodo de reporte de cada sensor")
+    parser.add_argument('--sleepy', type=float, default=0.0, help="fracción de sensores dormidos entre reportes")
+    parser.add_argument('--loss', type=float, default=0.0, help="probabilidad de pérdida de cada trama en el aire")
+    parser.add_argument('--latency-ms', type=float, nargs=2, default=(5, 20), metavar=('MIN', 'MAX'))
+    parser.add_argument('--ack-timeout-ms', type=int, default=3000)
+    parser.add_argument('--retries', type=int, default=3, help="intentos de cada sensor por reporte")
+    parser.add_argument('--rx-queue', type=int, default=8, help="tramas que caben en la cola de recepción de la radio")
+    parser.add_argument('--esp32-per-min', type=float, default=6.0, help="comandos del ESP32 por minuto")
+    parser.add_argument('--baud', type=int, default=9600, help="velocidad del UART hacia el ESP32")
+    parser.add_argument('--cpu-scale', type=float, default=1.0,
+                        help="ms simulados por ms de CPU del host (el XBee3 es mucho más lento que un PC)")
+    parser.add_argument('--duration-s', type=float, default=300.0, help="tiempo simulado")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="imprime el resumen en JSON")
+    parser.add_argument('--quiet', action='store_true', help="descarta los print() del firmware")
+    args = parser.parse_args()
+
+    names = ["SENSOR_{}".format(i) for i in range(args.devices)]
+
+    def setup(net, coord):
+        net.report_factory = simnet.sequenced_report
+        sleepy = int(args.devices * args.sleepy)
+        for i, name in enumerate(names):
+            net.add_node(name, period_ms=args.period_ms, sleepy=i < sleepy)
+        schedule_esp32_stream(net, names, args.esp32_per_min)
+
+    if args.quiet:
+        import builtins
+        builtins.print = lambda *a, **k: None
+
+    duration_ms = args.duration_s * 1000
+    net, coord, clock = run(None, duration_ms, setup, seed=args.seed, loss=args.loss,
+                            latency_ms=tuple(args.latency_ms), rx_queue=args.rx_queue,
+                            ack_timeout_ms=args.ack_timeout_ms, retries=args.retries,
+                            baud=args.baud, cpu_scale=args.cpu_scale)
+    summary = summarize(net, duration_ms, args.devices)
+    if args.json:
+        REAL_STDOUT.write(json.dumps(summary, indent=2) + "\n")
+        return 0
+    out = REAL_STDOUT.write
+    out("dispositivos={devices} duración={duration_s:.0f}s ofrecidos={offered_per_s}/s entregados={delivered_per_s}/s "
+        "pérdida={drop:.2%}\n".format(drop=summary['drop_rate'], **summary))
+    out("reintentos={retries} abandonados={gave_up} perdidas_aire={lost_air} desbordes_rx={rx_overflow} "
+        "cola_rx_max={rx_queue_hwm} tx_coord={coord_tx} uart={uart_bytes_per_s} B/s\n".format(**summary))
+    out("ACK ms: p50={0[50]} p95={0[95]} p99={0[99]}\n".format(summary['ack_ms']))
+    out("ESP32 ms: p50={0[50]} p95={0[95]} p99={0[99]} respondidos={1} sin_respuesta={2}\n".format(
+        summary['esp32_ms'], summary['esp32_answered'], summary['esp32_unanswered']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""
+Microbenchmarks de los caminos críticos del coordinador con 10, 100 y 1000 dispositivos.
+
+Mide ops/s y bytes reservados por operación de Coordinator.parse_payload (texto y binario),
+update_device_database, la resolución de nombres de handle_esp32_request (resolve_target
+y un STATS:<nodo> completo), send_report_to_esp32 y la codificación de mensajes salientes
+(build_report con número de secuencia y la respuesta a REQ_REPORT; objetivo: 0 B/op). Funciona en CPython y en el puerto
+unix de MicroPython (sin argparse ni os.path):
+  - MicroPython: bytes = incremento de gc.mem_alloc() con el GC desactivado (total reservado).
+  - CPython: bytes = pico de tracemalloc durante una operación (memoria temporal máxima).
+Los resultados se guardan en JSON y se comparan con una línea base de otro commit:
+
+  python3 bench/microbench.py --save bench/microbench_baseline.json
+  python3 bench/microbench.py --compare bench/microbench_baseline.json [--tolerance 0.3]
+  micropython bench/microbench.py --sizes 10,100
+
+Con --compare el código de salida es 1 si alguna operación pierde más de 'tolerance' de
+ops/s o reserva más memoria que en la línea base. Las ops/s dependen de la máquina:
+compare siempre resultados obtenidos en el mismo equipo e intérprete.
+"""
+import sys
+import time
+import gc
+
+try:
+    import json
+except ImportError:
+    import ujson as json
+
+HERE = __file__.rsplit('/', 1)[0] if '/' in __file__ else '.'
+sys.path.insert(0, HERE + '/fakes')
+sys.path.insert(0, HERE)
+sys.path.insert(0, HERE + '/../code')
+sys.path.insert(0, HERE + '/../code/COORD')
+
+if not hasattr(time, 'ticks_us'):       # CPython: API ticks_* de MicroPython sobre perf_counter
+    time.ticks_ms = lambda: int(time.perf_counter() * 1000)
+    time.ticks_us = lambda: time.process_time_ns() // 1000
+    time.ticks_diff = lambda a, b: a - b
+    time.ticks_add = lambda a, d: a + d
+    time.sleep_ms = lambda ms: None
+
+import simnet  # noqa: E402
+
+SIZES = (10, 100, 1000)
+MIN_TIME_US = 100000                    # Duración mínima de cada medida
+REPEATS = 5                             # Medidas por operación: se queda la mejor (menos ruido del sistema)
+ALLOC_SAMPLES = 200                     # Operaciones para medir la memoria (CPython)
+DEFAULT_TOLERANCE = 0.3
+
+
+class BenchRadio:
+    """Radio del coordinador sin red: responde a los AT y descarta las transmisiones."""
+
+    def __init__(self):
+        self.at = {'NI': 'XBEE_COOR', 'AV': 1, 'AI': 0, 'SL': b'\x42\x3d\x8b\x99'}
+        self.rx_callback = None
+        self.modem_cb = None
+        self.tx = 0
+
+    def atcmd(self, cmd, value=None):
+        if value is not None:
+            self.at[cmd] = value
+            return None
+        return self.at.get(cmd)
+
+    def coord_receive(self):
+        return None
+
+    def coord_transmit(self, dest, payload, **kwargs):
+        self.tx += 1
+
+
+class Sink:
+    """UART hacia el ESP32 que solo cuenta bytes."""
+
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        return len(data)
+
+
+def eui64(i):
+    return b'\x00\x13\xA2\x00' + bytes(((i >> 24) & 0xFF, (i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF))
+
+
+def make_coordinator(n):
+    """Coordinador con n dispositivos registrados (texto y handles binarios)."""
+    simnet.NET = BenchRadio()
+    for mod in ('main_dev', 'tools', 'metrics', 'at_cache', 'ttl_frame', 'telemetry', 'eventlog'):
+        if mod in sys.modules:
+            del sys.modules[mod]
+    import main_dev
+    import tools
+    sink = Sink()
+    main_dev.stdout = sink
+    coord = main_dev.Coordinator(main_dev.xbee_device)
+    coord.esp32_out = sink
+    coord.device_node_id = "XBEE_COOR"
+    coord.node_id_bytes = b"XBEE_COOR"
+    names = ["SENSOR_{}".format(i) for i in range(n)]
+    addrs = [eui64(i + 1) for i in range(n)]
+    for i in range(n):
+        coord.update_device_database(addrs[i], names[i], 12.3)
+        coord.node_handles[i] = names[i]
+    inputs = {
+        'names': names,
+        'addrs': addrs,
+        'text': [("{}:12.30:Reporte periodico.".format(name)).encode() for name in names],
+        'binary': [tools.encode_report_frame(tools.MSG_REPORT, i, 12300, 0, i, b'Reporte periodico.') for i in range(n)],
+        'parts': [['STATS', name] for name in names],
+        'stats': ["STATS:" + name for name in names],
+    }
+    return coord, inputs
+
+
+def operations(coord, inp):
+    """Operaciones medidas: nombre -> función(i) sobre el dispositivo i."""
+    names, addrs = inp['names'], inp['addrs']
+    text, binary, parts, stats = inp['text'], inp['binary'], inp['parts'], inp['stats']
+    return (
+        ('parse_text', lambda i: coord.parse_payload(text[i], addrs[i])),
+        ('parse_binary', lambda i: coord.parse_payload(binary[i], addrs[i])),
+        ('update_db', lambda i: coord.update_device_database(addrs[i], names[i], 12.3)),
+        ('resolve_name', lambda i: coord.resolve_target(parts[i])),
+        ('esp32_stats', lambda i: coord.handle_esp32_request(stats[i])),
+        ('send_report', lambda i: coord.send_report_to_esp32(names[i], 12.3, "Reporte periodico.")),
+        ('build_report', lambda i: coord.add_sequence(addrs[i], coord.build_report(b"Reporte periodico."))),
+        ('req_report', lambda i: coord.on_req_report(addrs[i], b'REQ_REPORT', b'')),
+    )
+
+
+def time_op(op, n):
+    """Mejor ops/s de REPEATS medidas de op(i) recorriendo los n dispositivos."""
+    count = 64
+    while True:                                     # Calibrar el número de operaciones
+        elapsed = time_loop(op, n, count)
+        if elapsed >= MIN_TIME_US:
+            break
+        count *= 2
+    best = elapsed
+    for _ in range(REPEATS - 1):
+        best = min(best, time_loop(op, n, count))
+    return count * 1000000 / best
+
+
+def time_loop(op, n, count):
+    """
+    Microsegundos que tardan 'count' llamadas a op(i). En CPython se detiene el recolector
+    de ciclos para que no caiga en unas medidas sí y en otras no; en MicroPython no se puede,
+    porque con el GC desactivado el heap se agota.
+    """
+    cpython = not hasattr(gc, 'mem_alloc')
+    gc.collect()
+    if cpython:
+        gc.disable()
+    try:
+        start = time.ticks_us()
+        i = 0
+        for _ in range(count):
+            op(i)
+            i += 1
+            if i == n:
+                i = 0
+        return time.ticks_diff(time.ticks_us(), start)
+    finally:
+        gc.enable()
+
+
+def alloc_op(op, n):
+    """Bytes reservados por operación (ver la cabecera para el significado en cada intérprete)."""
+    if hasattr(gc, 'mem_alloc'):
+        samples = min(n, ALLOC_SAMPLES)
+        gc.collect()
+        gc.disable()
+        try:
+            start = gc.mem_alloc()
+            for i in range(samples):
+                op(i)
+            return (gc.mem_alloc() - start) / samples
+        finally:
+            gc.enable()
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        total = 0
+        samples = ALLOC_SAMPLES
+        for k in range(samples):
+            i = k % n
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            op(i)
+            total += tracemalloc.get_traced_memory()[1] - base
+        return total / samples
+    finally:
+        tracemalloc.stop()
+
+
+def run(sizes):
+    results = {}
+    for n in sizes:
+        coord, inputs = make_coordinator(n)
+        for name, op in operations(coord, inputs):
+            op(0)                                   # Calentamiento (cadenas internas, cachés)
+            results["{}@{}".format(name, n)] = {
+                'ops_per_s': round(time_op(op, n), 1),
+                'alloc_bytes': round(alloc_op(op, n), 1),
+            }
+    return results
+
+
+def print_results(results, baseline=None):
+    print("{:18s} {:>12s} {:>9s}{}".format("operación@N", "ops/s", "B/op", "   vs. base" if baseline else ""))
+    for key in sorted(results, key=lambda k: (k.split('@')[0], int(k.split('@')[1]))):
+        cur = results[key]
+        line = "{:18s} {:12.0f} {:9.1f}".format(key, cur['ops_per_s'], cur['alloc_bytes'])
+        base = baseline.get(key) if baseline else None
+        if base:
+            line += "   x{:.2f} ops/s, {:+.1f} B".format(cur['ops_per_s'] / base['ops_per_s'],
+                                                       cur['alloc_bytes'] - base['alloc_bytes'])
+        elif baseline:
+            line += "   sin base (regenerar con --save)"
+        print(line)
+
+
+def regressions(results, baseline, tolerance):
+    """Claves que han perdido más de 'tolerance' de ops/s o reservan más memoria."""
+    bad = []
+    for key, cur in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        slower = cur['ops_per_s'] < base['ops_per_s'] * (1 - tolerance)
+        bigger = cur['alloc_bytes'] > base['alloc_bytes'] * (1 + tolerance) + 8
+        if slower or bigger:
+            bad.append(key)
+    return bad
+
+
+def parse_args(argv):
+    args = {'sizes': SIZES, 'save': None, 'compare': None, 'tolerance': DEFAULT_TOLERANCE}
+    i = 0
+    while i < len(argv):
+        opt = argv[i]
+        value = argv[i + 1] if i + 1 < len(argv) else None
+        if opt == '--sizes' and value:
+            args['sizes'] = tuple(int(v) for v in value.split(','))
+        elif opt in ('--save', '--compare') and value:
+            args[opt[2:]] = value
+        elif opt == '--tolerance' and value:
+            args['tolerance'] = float(value)
+        else:
+            print(__doc__)
+            sys.exit(2)
+        i += 2
+    return args
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    results = run(args['sizes'])
+    baseline = None
+    if args['compare']:
+        with open(args['compare']) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+    if args['save']:
+        doc = {'interpreter': sys.implementation.name, 'version': sys.version.split()[0], 'results': results}
+        try:
+            text = json.dumps(doc, indent=1, sort_keys=True)
+        except TypeError:                           # ujson no admite indent
+            text = json.dumps(doc)
+        with open(args['save'], 'w') as f:
+            f.write(text + "\n")
+    if baseline:
+        bad = regressions(results, baseline, args['tolerance'])
+        if bad:
+            print("Regresiones: " + ", ".join(sorted(bad)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,475 @@
+"""
+Reloj virtual, red Zigbee y enlace ESP32 simulados para ejecutar el coordinador en Linux.
+
+El reloj avanza con los sleep_ms() del firmware y con el tiempo de CPU real del host
+(multiplicado por cpu_scale), así que el coste de procesar cada trama también cuenta.
+Los eventos de la red (reportes, retransmisiones, entregas) se ejecutan al avanzar el reloj.
+"""
+import heapq
+import random
+import time as _time
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALF = TICKS_PERIOD // 2
+
+
+class StopSimulation(BaseException):
+    """Se lanza desde el reloj virtual para terminar Coordinator.run()."""
+
+
+class Clock:
+    """Reloj virtual en ms con la API ticks_* de MicroPython."""
+
+    def __init__(self, start_ticks=0, cpu_scale=1.0, end_ms=None):
+        self.now = 0.0
+        self.offset = start_ticks
+        self.cpu_scale = cpu_scale
+        self.end_ms = end_ms
+        self._real = _time.perf_counter()
+        self.on_advance = None
+        self.next_due = None      # () -> instante del próximo evento (None si no hay)
+
+    def _sync(self):
+        real = _time.perf_counter()
+        self.now += (real - self._real) * 1000.0 * self.cpu_scale
+        self._real = real
+        if self.on_advance:
+            self.on_advance()
+        if self.end_ms is not None and self.now >= self.end_ms:
+            raise StopSimulation()
+
+    def advance(self, ms):
+        """
+        Avanza ms. Los eventos que vencen por el camino se ejecutan en su instante, no al
+        final: lo que programan (respuestas, entregas) parte de la hora correcta.
+        """
+        end = self.now + ms
+        due = self.next_due() if self.next_due else None
+        while due is not None and due < end:
+            self.now = max(self.now, due)
+            self._sync()
+            due = self.next_due()
+        self.now = max(self.now, end)
+        self._sync()
+
+    # --- API tipo MicroPython ---
+    def ticks_ms(self):
+        self._sync()
+        return (int(self.now) + self.offset) & TICKS_MAX
+
+    def ticks_us(self):
+        self._sync()
+        return (int(self.now * 1000) + self.offset) & TICKS_MAX
+
+    @staticmethod
+    def ticks_diff(a, b):
+        return ((a - b + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
+
+    @staticmethod
+    def ticks_add(a, d):
+        return (a + d) & TICKS_MAX
+
+    def sleep_ms(self, ms):
+        self.advance(ms)
+
+    def sleep(self, s):
+        self.advance(s * 1000)
+
+
+CLOCK = None
+NET = None
+
+
+def addr(i):
+    return b'\x00\x13\xA2\x00' + i.to_bytes(4, 'big')
+
+
+class FixedPolicy:
+    """
+    Política de reintentos de un nodo simulado: plazo de ACK y espera entre intentos fijos,
+    como el firmware antes de RttEstimator. Otras políticas implementan los mismos métodos.
+    """
+
+    def __init__(self, ack_timeout_ms, retry_delay_ms=0):
+        self.ack_timeout_ms = ack_timeout_ms
+        self.retry_delay_ms = retry_delay_ms
+
+    def ack_timeout(self):
+        return self.ack_timeout_ms
+
+    def retry_delay(self, attempt):
+        return self.retry_delay_ms
+
+    def on_ack(self, rtt_ms, attempts):
+        pass
+
+    def on_timeout(self):
+        pass
+
+
+class Node:
+    """Nodo remoto simulado (sensor o cámara) que reporta, reintenta y responde comandos."""
+
+    def __init__(self, net, idx, name, period_ms=0, sleepy=False):
+        self.net = net
+        self.idx = idx
+        self.addr = addr(idx)
+        self.name = name
+        self.period_ms = period_ms
+        self.sleepy = sleepy
+        self.awake_until = 0
+        self.seq = 0
+        self.pending = None  # [payload, primer_envio, intentos]
+        self.received = []
+        self.latency_ms = None  # (min, max) propio; None = el de la red
+        self.last_tx = 0.0
+        self.acks_inflight = 0
+        self.policy = net.policy_factory(self) if net.policy_factory else FixedPolicy(net.ack_timeout_ms, net.retry_delay_ms)
+
+    # --- Tráfico generado ---
+    def make_report(self):
+        self.seq = self.seq % 65535 + 1
+        return self.net.report_factory(self)
+
+    def start(self):
+        if self.period_ms:
+            first = self.net.rng.uniform(0, self.period_ms)
+            self.net.schedule(first, self.send_report)
+
+    def send_report(self):
+        if self.period_ms:
+            jitter = self.net.rng.uniform(-0.1, 0.1) * self.period_ms
+            self.net.schedule(self.period_ms + jitter, self.send_report)
+        if self.pending is not None:
+            self.net.stats['superseded'] += 1
+        payload = self.make_report()
+        self.net.stats['generated'] += 1
+        self.pending = [payload, self.net.clock.now, 0]
+        if self.sleepy:
+            self.awake_until = self.net.clock.now + self.net.ack_timeout_ms * (self.net.retries + 1)
+        self._attempt()
+
+    def _attempt(self):
+        if self.pending is None:
+            return
+        payload, first, attempts = self.pending
+        if attempts >= self.net.retries:
+            self.net.stats['gave_up'] += 1
+            self.pending = None
+            return
+        self.pending[2] += 1
+        if attempts:
+            self.net.stats['retries'] += 1
+            if self.acks_inflight:
+                # El ACK de un intento anterior ya está en el aire: reintento prematuro
+                self.net.stats['premature'] += 1
+                self.net.stats['premature_bytes'] += len(payload)
+        self.last_tx = self.net.clock.now
+        self.net.air_to_coord(self, payload)
+        token = self.pending
+        self.net.schedule(self.policy.ack_timeout(), lambda: self._timeout(token))
+
+    def _timeout(self, token):
+        if self.pending is not token:
+            return
+        self.policy.on_timeout()
+        delay = self.policy.retry_delay(token[2])
+        if delay:
+            self.net.schedule(delay, lambda: self._retry(token))
+        else:
+            self._attempt()
+
+    def _retry(self, token):
+        if self.pending is token:
+            self._attempt()
+
+    def radio_ack(self, payload):
+        """ACK de radio (APS) de un envío "<seq>!": confirma el reporte sin respuesta del coordinador."""
+        if self.pending is None or self.pending[0] != payload:
+            return
+        self.net.ack_latency.append(self.net.clock.now - self.pending[1])
+        self.policy.on_ack(self.net.clock.now - self.last_tx, self.pending[2])
+        self.net.stats['acked'] += 1
+        self.pending = None
+
+    # --- Tráfico recibido del coordinador ---
+    def deliver(self, payload, ack=False):
+        if ack:
+            self.acks_inflight -= 1
+        if self.sleepy and self.net.clock.now > self.awake_until:
+            self.net.stats['asleep_drop'] += 1
+            return
+        sep = payload.find(b'#', 0, 6)
+        no_reply = sep <= 0 and payload.find(b'!', 0, 6) > 0
+        if no_reply:
+            sep = payload.find(b'!', 0, 6)
+        if sep > 0 and payload[:sep].isdigit():
+            payload = payload[sep + 1:]  # Sobre de secuencia "<seq>#" o "<seq>!"
+        self.received.append(payload)
+        if payload[:2] == b'OK' and self.pending is not None:
+            self.net.ack_latency.append(self.net.clock.now - self.pending[1])
+            self.policy.on_ack(self.net.clock.now - self.last_tx, self.pending[2])
+            self.net.stats['acked'] += 1
+            self.pending = None
+            if b'|' in payload:
+                for cmd in payload.split(b'|')[1:]:
+                    self.net.air_to_coord(self, cmd + b':OK')
+            return
+        if self.net.responder and not no_reply:
+            reply = self.net.responder(self, payload)
+            if reply is not None:
+                self.net.air_to_coord(self, reply)
+
+
+def default_report(node):
+    """Reporte de texto sin secuencia, como el firmware original."""
+    return "{}:{:.2f}:Reporte periodico.".format(node.name, 12.3).encode()
+
+
+def sequenced_report(node):
+    """Reporte con sobre de secuencia "<seq>#" y la secuencia repetida en los datos."""
+    return "{}#{}:{:.2f}:Reporte {}".format(node.seq, node.name, 12.3, node.seq).encode()
+
+
+def radio_report(node):
+    """Como sequenced_report, con sobre "<seq>!": el nodo se conforma con el ACK de radio."""
+    return "{}!{}:{:.2f}:Reporte {}".format(node.seq, node.name, 12.3, node.seq).encode()
+
+
+def numbered_report(node):
+    """Reporte sin sobre, con la secuencia en los datos (para contar duplicados)."""
+    return "{}:{:.2f}:Reporte {}".format(node.name, 12.3, node.seq).encode()
+
+
+def default_responder(node, payload):
+    """Respuesta de un nodo a los comandos del coordinador (None si no responde)."""
+    text = bytes(payload)
+    if text.startswith(b'TEL:') or text.startswith(b'SENSOR:'):
+        return text + b':OK'
+    if text == b'REQ_REPORT' or b'Solicitud de reporte' in text:
+        return (node.name + ": Estado: 2, Camara: OFF, Bateria: 12.30V, Manual: False").encode()
+    if text == b'METRICS':
+        return "METRICS:rx={},tx={}".format(len(node.received), node.seq).encode()
+    return None
+
+
+class Network:
+    """Radio del coordinador, nodos remotos y UART hacia el ESP32."""
+
+    def __init__(self, clock, seed=1, loss=0.0, latency_ms=(5, 20), rx_queue=8,
+                 ack_timeout_ms=3000, retries=3, baud=9600, uart_buffer=256,
+                 callback_mode=False, retry_delay_ms=0, policy_factory=None, tx_status=False):
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.loss = loss
+        self.latency_ms = latency_ms
+        self.rx_queue_cap = rx_queue
+        self.rx_queue = []
+        self.ack_timeout_ms = ack_timeout_ms
+        self.retry_delay_ms = retry_delay_ms
+        self.policy_factory = policy_factory   # node -> política de reintentos (FixedPolicy si None)
+        self.retries = retries
+        self.tx_status = tx_status             # True: xbee.transmit lanza OSError si la trama se pierde
+        self.events = []
+        self._eid = 0
+        self.nodes = {}
+        self.report_factory = default_report
+        self.responder = default_responder
+        self.rx_callback = None
+        self.modem_cb = None
+        self.at = {'NI': 'XBEE_COOR', 'AV': 1, 'AI': 0, 'SL': b'\x42\x3d\x8b\x99'}
+        self.at_calls = 0
+        self.stats = dict(generated=0, acked=0, retries=0, gave_up=0, rx_overflow=0,
+                          lost_air=0, superseded=0, asleep_drop=0, coord_tx=0, coord_tx_bytes=0,
+                          rx_bytes=0, rx_frames=0, premature=0, premature_bytes=0, radio_acks=0)
+        self.ack_latency = []
+        self.queue_hwm = 0
+        # UART coordinador -> ESP32
+        self.baud = baud
+        self.uart_buffer = uart_buffer
+        self.uart_busy_until = 0.0
+        self.stdout_bytes = 0
+        self.stdout_lines = []
+        self._line = bytearray()
+        self.stdin_data = bytearray()
+        self.esp32_pending = []  # (t_inyeccion, comando)
+        self.esp32_latency = []
+        clock.on_advance = self.pump
+        clock.next_due = lambda: self.events[0][0] if self.events else None
+
+    # --- Planificador de eventos ---
+    def schedule(self, delay, fn):
+        self._eid += 1
+        heapq.heappush(self.events, (self.clock.now + delay, self._eid, fn))
+
+    def pump(self):
+        now = self.clock.now
+        while self.events and self.events[0][0] <= now:
+            _, _, fn = heapq.heappop(self.events)
+            fn()
+
+    def add_node(self, name, period_ms=0, sleepy=False):
+        idx = len(self.nodes) + 1
+        node = Node(self, idx, name, period_ms, sleepy)
+        self.nodes[node.addr] = node
+        node.start()
+        return node
+
+    # --- Radio ---
+    def _latency(self, node=None):
+        lo, hi = node.latency_ms if node is not None and node.latency_ms else self.latency_ms
+        return self.rng.uniform(lo, hi)
+
+    def air_to_coord(self, node, payload):
+        self.stats['rx_bytes'] += len(payload)
+        self.stats['rx_frames'] += 1
+        if self.rng.random() < self.loss:
+            self.stats['lost_air'] += 1
+            return
+        frame = {'sender_eui64': node.addr, 'payload': bytes(payload), 'broadcast': False,
+                 'source_ep': 0xE8, 'dest_ep': 0xE8, 'cluster': 0x11, 'profile': 0xC105}
+        self.schedule(self._latency(node), lambda: self._arrive(frame, node))
+
+    def _arrive(self, frame, node=None):
+        payload = frame['payload']
+        if node is not None and payload.find(b'#', 0, 6) <= 0 and payload.find(b'!', 0, 6) > 0:
+            # La radio del coordinador confirma la trama (APS) al recibirla, antes de la cola
+            self.stats['radio_acks'] += 1
+            if self.rng.random() < self.loss:
+                self.stats['lost_air'] += 1
+            else:
+                self.schedule(self._latency(node), lambda: node.radio_ack(payload))
+        if len(self.rx_queue) >= self.rx_queue_cap:
+            self.stats['rx_overflow'] += 1
+            return
+        self.rx_queue.append(frame)
+        self.queue_hwm = max(self.queue_hwm, len(self.rx_queue))
+        if self.rx_callback:
+            self.rx_callback(self.rx_queue.pop(0))
+
+    def coord_receive(self):
+        self.clock._sync()
+        if self.rx_queue:
+            return self.rx_queue.pop(0)
+        return None
+
+    def coord_transmit(self, dest, payload, **kwargs):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        payload = bytes(payload)
+        self.stats['coord_tx'] += 1
+        self.stats['coord_tx_bytes'] += len(payload)
+        node = self.nodes.get(bytes(dest))
+        self.clock.advance(2)  # Tiempo de serializar la trama en la radio
+        if node is None:
+            raise OSError("ENOTCONN")
+        if self.rng.random() < self.loss:
+            self.stats['lost_air'] += 1
+            if self.tx_status and not kwargs.get('tx_options', 0) & 0x01:
+                raise OSError("ETIMEDOUT")
+            return
+        sep = payload.find(b'#', 0, 6)
+        ack = payload[sep + 1:sep + 3] == b'OK'
+        if ack:
+            node.acks_inflight += 1
+        self.schedule(self._latency(node), lambda: node.deliver(payload, ack))
+
+    def atcmd(self, cmd, value=None):
+        self.at_calls += 1
+        self.clock.advance(1)
+        if value is not None:
+            self.at[cmd] = value
+            return None
+        return self.at.get(cmd)
+
+    # --- ESP32 ---
+    def esp32_send(self, command):
+        self.esp32_pending.append((self.clock.now, command))
+        self.stdin_data += command.encode() + b'\n'
+
+    def uart_write(self, data):
+        """UART a 'baud' con un buffer de 'uart_buffer' bytes: si se llena, write() bloquea."""
+        if isinstance(data, str):
+            data = data.encode()
+        n = len(data)
+        byte_ms = 10000.0 / self.baud
+        start = max(self.clock.now, self.uart_busy_until)
+        self.uart_busy_until = start + n * byte_ms
+        backlog_ms = self.uart_busy_until - self.clock.now
+        limit_ms = self.uart_buffer * byte_ms
+        if backlog_ms > limit_ms:
+            self.clock.advance(backlog_ms - limit_ms)
+        self.stdout_bytes += n
+        for b in data:
+            if b == 10:
+                line = bytes(self._line)
+                self._line = bytearray()
+                self.stdout_lines.append((self.uart_busy_until, line))
+                self._on_line(line)
+            else:
+                self._line.append(b)
+        return n
+
+    def _on_line(self, line):
+        """Empareja la primera respuesta al ESP32 con el comando pendiente más antiguo."""
+        if self.esp32_pending and (b'_RESPONSE' in line or line.startswith(b'ERROR') or
+                                   line.startswith(b'STATS') or line.startswith(b'METRICS')):
+            t0, _ = self.esp32_pending.pop(0)
+            self.esp32_latency.append(self.uart_busy_until - t0)
+
+
+class FakeStdout:
+    """sys.stdout del coordinador: escribe en el UART simulado."""
+
+    def __init__(self, net):
+        self.net = net
+        self.buffer = self
+
+    def write(self, data):
+        return self.net.uart_write(data)
+
+    def flush(self):
+        pass
+
+
+class FakeStdin:
+    """sys.stdin del coordinador: lee los comandos inyectados con esp32_send()."""
+
+    def __init__(self, net):
+        self.net = net
+        self.buffer = _StdinBuffer(net)
+
+    def read(self, n=-1):
+        data = self.net.stdin_data
+        if not data:
+            return ''
+        if n < 0:
+            n = len(data)
+        out = bytes(data[:n])
+        del data[:n]
+        return out.decode()
+
+
+class _StdinBuffer:
+    def __init__(self, net):
+        self.net = net
+
+    def read(self, n=-1):
+        data = self.net.stdin_data
+        if not data:
+            return None
+        if n < 0:
+            n = len(data)
+        out = bytes(data[:n])
+        del data[:n]
+        return out
+
+
+def percentile(values, p):
+    """Percentil p (0-100) por el método del rango más cercano."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[k]
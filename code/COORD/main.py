@@ -1,15 +1,19 @@
 import xbee
 import time
+from at_cache import ATCache
+from battery import BatteryService, parse_battery_field
 from machine import Pin, WDT, ADC
 
 # --- Configuración ---
 # Timeout para el Watchdog en milisegundos. 60 segundos.
 # El dispositivo se reiniciará si no se alimenta al watchdog en este tiempo.
 WDT_TIMEOUT = 60000
+# Máximo de tramas procesadas seguidas antes de volver a dormir
+RX_BUDGET_FRAMES = 16
 
 adc_battery = ADC('D1')
-# ADC reference voltage
-AV_VALUES = {0: 1.25, 1: 2.5, 2: 3.3, None: 2.5}
+at = ATCache()  # AV cacheado: evita un atcmd por lectura de batería
+battery = BatteryService(adc_battery, at)
 
 # --- Variables Globales ---
 # Diccionario para almacenar el estado de los dispositivos remotos.
@@ -50,7 +54,7 @@ def parse_payload(payload_bytes):
             return None, None, None
 
         node_id = parts[0]
-        battery = float(parts[1])
+        battery = parse_battery_field(parts[1]) / 1000  # "<mV>/<%>" o voltios
         data = parts[2]
         return node_id, battery, data
     except ValueError:
@@ -61,27 +65,13 @@ def parse_payload(payload_bytes):
 
 def get_battery_status(as_string=True):
     """
-    Lee el voltaje de la batería.
+    Batería del coordinador medida por BatteryService (mediana, aritmética entera y caché).
     Si as_string es True, devuelve un texto formateado.
     Si as_string es False, devuelve solo el valor numérico del voltaje.
     """
-    try:
-        try:
-            av = xbee.atcmd("AV")
-        except KeyError:
-            av = None
-        reference_v = AV_VALUES[av]
-        adc_raw_value = adc_battery.read()
-        pin_voltage = (adc_raw_value / 4095.0) * reference_v
-        battery_voltage = pin_voltage * (12.0 / 3.3) * 2.9 # Factor de corrección para divisor 12k+3.3k
-        
-        if as_string:
-            return "Bateria: {:.2f}V".format(battery_voltage)
-        else:
-            return battery_voltage
-    except Exception as e:
-        print("Error al leer la bateria: {}".format(e))
-        return "Bateria: ERROR" if as_string else 0.0
+    if as_string:
+        return battery.describe()
+    return battery.read() / 1000
     
 def update_device_database(sender_eui64, node_id, battery):
     """
@@ -114,7 +104,7 @@ def update_device_database(sender_eui64, node_id, battery):
             eui_str, data['node_id'], data['battery'], data['movement_count'], data['last_report_time']))
     print("------------------------------------")
 
-    print("Nivel de batería del coordinador: {:.2f}%".format((get_battery_status(as_string=False))))
+    print("Nivel de batería del coordinador: {}".format(get_battery_status()))
 
     print("Número total de dispositivos en la base de datos: {}".format(len(device_database)))
     
@@ -143,11 +133,15 @@ def main_coordinator():
     while True:
         feed_watchdog()  # Previene el reinicio por inactividad
 
+        received_msg = None
         try:
-            # Espera a recibir un mensaje
-            received_msg = xbee.receive()
+            # Drena la cola de recepción antes de dormir
+            for _ in range(RX_BUDGET_FRAMES):
+                received_msg = xbee.receive()
+                if not received_msg:
+                    break
+                feed_watchdog()
 
-            if received_msg:
                 sender_eui64 = received_msg['sender_eui64']
                 payload = received_msg['payload']
                 sender_addr_str = ''.join('{:02x}'.format(b).upper() for b in sender_eui64)
@@ -173,8 +167,9 @@ def main_coordinator():
             # Espera un poco antes de continuar para no sobrecargar en caso de errores repetidos
             time.sleep_ms(1000)
 
-        # Pequeña pausa para no consumir el 100% de la CPU
-        time.sleep_ms(100)
+        # Pequeña pausa para no consumir el 100% de la CPU (solo si la cola quedó vacía)
+        if not received_msg:
+            time.sleep_ms(100)
 
 
 if __name__ == '__main__':
@@ -1,8 +1,15 @@
 import xbee
 import time
-from machine import Pin, WDT, ADC
+from machine import Pin
 from sys import stdin, stdout
-from tools import XBeeDevice  # Import base class
+from tools import XBeeDevice, TimerWheel, FRAME_MARKER, FRAME_HEADER_LEN, MSG_HELLO, decode_report_frame  # Import base class
+from tools import SEQ_MODULUS, COUNTER_MODULUS, split_sequence, wants_reply, declares_sleepy, DELIVERY_RADIO
+from tools import MSG_BATCH, parse_batch, decode_batch, is_reply
+from battery import parse_battery_field
+from telemetry import TelemetryRing
+import metrics
+import eventlog
+from ttl_frame import FrameParser, encode_frame, clip_payload, T_MSG, T_CMD, T_DEBUG, MODE_TEXT, MODE_FRAMED
 
 
 xbee_device = xbee.XBee()
@@ -14,201 +21,845 @@ class Coordinator(XBeeDevice):
     
     # Nuevos estados específicos del coordinador
     STATE_PROCESS_ESP32_REQUEST = 4  # Estado para procesar solicitudes del ESP32
+
+    # --- Presupuesto del bucle principal ---
+    RX_BUDGET_FRAMES = 16            # Máximo de tramas Zigbee procesadas por iteración
+    RX_BUDGET_MS = 50                # Tiempo máximo drenando la cola de recepción por iteración
+    ESP32_BUDGET_CHARS = 128         # Máximo de caracteres leídos del ESP32 por iteración
+    IDLE_SLEEP_MIN_MS = 1            # Pausa inicial cuando no hay tráfico
+    IDLE_SLEEP_MAX_MS = 20           # Pausa máxima tras varias iteraciones sin tráfico
+    RTT_DESTINATIONS = 64            # Destinos con RTT estimado (plazos de ACK de fanout y REPORT)
+
+    # TEL:ON/OFF a un nodo despierto se confirma con el estado de la radio; REPORT/STATS esperan datos
+    DELIVERY = dict(XBeeDevice.DELIVERY, COMMAND=DELIVERY_RADIO)
+
+    # --- Seguimiento de actividad de los dispositivos ---
+    LIVENESS_DEFAULT_MS = 600000     # Plazo hasta conocer la cadencia del dispositivo (10 min)
+    LIVENESS_MIN_MS = 30000          # Plazo mínimo de silencio antes de marcar OFFLINE
+    LIVENESS_FACTOR = 3              # Intervalos esperados sin reporte antes de marcar OFFLINE
+    LIVENESS_EWMA_SHIFT = 3          # Peso de la media móvil del intervalo: 1/8
+    LIVENESS_SLOT_MS = 1000          # Resolución de la rueda de temporizadores
+    LIVENESS_SLOTS = 256             # Ranuras de la rueda (una vuelta = 256 s)
+
+    # --- Telemetría por dispositivo ---
+    TELEMETRY_SAMPLES = 16           # Muestras por dispositivo (6 bytes cada una)
+
+    # --- Agrupación de reportes hacia el ESP32 ---
+    REPORT_BATCH_MAX = 8             # Registros máximos por trama REPORTS
+    REPORT_BATCH_LATENCY_MS = 20     # Tiempo máximo que un reporte espera en el buffer
+    REPORT_BATCH_MAX_BYTES = 200     # Tamaño máximo de una línea REPORTS (cabe en una trama TTL)
+
+    # --- Buzón para dispositivos dormidos ---
+    MAILBOX_MAX = 4                  # Comandos pendientes por dispositivo
+    MAILBOX_TTL_MS = 600000          # Caducidad de un comando no entregado (10 min)
+    MAILBOX_ACK_MAX_BYTES = 64       # Tamaño máximo del ACK con comandos adjuntos ("OK|cmd|cmd")
+
+    # --- Comandos ---
+    COMMANDS = {                     # Zigbee (telemando) -> manejador
+        b'REQ_REPORT': 'on_req_report',
+        b'METRICS': 'on_metrics',
+        b'LOGS': 'on_logs',
+    }
+    ESP32_COMMANDS = {               # ESP32 -> manejador(parts)
+        "MODE": 'esp32_mode',
+        "DEBUG": 'esp32_debug',
+        "REPORT": 'esp32_report',
+        "STATS": 'esp32_stats',
+        "CAMERA": 'esp32_camera',
+        "GROUP": 'esp32_group',
+        "METRICS": 'esp32_metrics',
+        "LOGS": 'esp32_logs',
+    }
+    UNKNOWN_COMMAND_REPLY = "UNKNOWN COMMAND"
+
+    # --- Enlace TTL en modo FRAMED ---
+    TTL_FRAME_TIMEOUT_MS = 100       # Silencio tras el que se abandona una trama incompleta
+
+    # --- Canal de depuración (separado del protocolo) ---
+    DEBUG_OFF = "OFF"                # Depuración descartada: todo el UART para el protocolo
+    DEBUG_TAGGED = "TAGGED"          # Líneas "#..." (TEXT) o tramas T_DEBUG (FRAMED) que el ESP32 ignora
+    DEBUG_UART = "UART"              # Segundo UART, si el firmware lo ofrece
+    DEBUG_UART_ID = 1
+    DEBUG_UART_BAUD = 115200
     
-    def __init__(self, xbee_instance):
+    def __init__(self, xbee_instance, telemetry_samples=TELEMETRY_SAMPLES, batch_reports=False, debug_mode=DEBUG_OFF):
         super().__init__(device_id="XBEE_COOR", wdt_timeout=WDT_TIMEOUT, battery_pin='D1', battery_scaling_factor=2.9, xbee_instance=xbee_instance)
         self.device_database = {}  # Base de datos de dispositivos remotos
         self.esp32_command_buffer = ""  # Buffer para comandos del ESP32
+        self.node_handles = {}  # handle de 16 bits -> NI (tramas binarias de remitentes sin entrada en la base de datos)
+        self.groups = {}        # Grupos explícitos: nombre -> [NI, ...] (los de prefijo, '@CAM*', no se guardan)
+        self.liveness = TimerWheel(self.LIVENESS_SLOT_MS, self.LIVENESS_SLOTS)  # Plazos de actividad por dispositivo
+        self.mailboxes = {}     # eui64 -> [[comando (bytes), clave de coalescencia, envíos], ...]
+        self.mailbox_expiry = TimerWheel(self.LIVENESS_SLOT_MS, self.LIVENESS_SLOTS)  # Claves (eui64, clave)
+        self.telemetry_samples = telemetry_samples
+        self.telemetry = {}  # eui64 -> TelemetryRing con el histórico de batería
+        
+        # Modo agrupado: varios reportes en una sola línea "REPORTS:rec|rec|..."
+        self.batch_reports = batch_reports
+        self.report_batch = []
+        self.report_batch_start = 0
+        self.report_batch_bytes = 0
+        self.batch_flushes = 0           # Tramas REPORTS enviadas
+        self.batch_records = 0           # Registros enviados en tramas REPORTS
+        self.batch_latency_total_ms = 0  # Suma de la espera del registro más antiguo de cada trama
+        self.batch_latency_max_ms = 0
+        
+        # Enlace TTL con el ESP32: texto por líneas o tramas con CRC (negociado con MODE:<modo>)
+        self.ttl_mode = MODE_TEXT
+        self.ttl_seq = 0
+        self.ttl_parser = FrameParser()
+        self.ttl_rx_chunk = bytearray(self.ESP32_BUDGET_CHARS)
+        self.ttl_last_rx = time.ticks_ms()
+        self.esp32_in = getattr(stdin, 'buffer', stdin)
+        self.esp32_out = getattr(stdout, 'buffer', stdout)
+
+        self.debug_uart = None
+        self.set_debug_mode(debug_mode)
+        self.esp32_handlers = self.bind_commands(self.ESP32_COMMANDS)
         self.pin_camera = Pin('D12', Pin.IN, Pin.PULL_UP)
     
-    def parse_payload(self, payload_bytes):
-        """Analiza el payload recibido de Zigbee."""
+    def parse_payload(self, payload_bytes, sender_eui64=None):
+        """
+        Analiza el payload recibido de Zigbee.
+        Acepta la trama binaria de reporte y el formato de texto "NODO:BAT:DATOS".
+        En un lote del outbox (MSG_BATCH o "NODO:BAT:BATCH:...") los datos son la tupla
+        (descartados, registros) de parse_batch/decode_batch en lugar de texto.
+        """
         try:
+            if payload_bytes and payload_bytes[0] & 0xF0 == FRAME_MARKER:
+                return self.parse_binary_payload(payload_bytes, sender_eui64)
             payload_str = payload_bytes.decode('utf-8')
-            parts = payload_str.split(':')
+            parts = payload_str.split(':', 2)
             if len(parts) != 3:
                 return None, None, None
             node_id = parts[0]
-            battery = float(parts[1])
+            battery = parse_battery_field(parts[1]) / 1000
             data = parts[2]
+            if data.startswith("BATCH:"):
+                data = parse_batch(data)
             return node_id, battery, data
-        except (ValueError, UnicodeDecodeError):
+        except UnicodeError:
+            self.metrics.inc(metrics.PARSE_ERRORS)
             return None, None, None
-    
+        except ValueError:
+            return None, None, None
+
+    def parse_binary_payload(self, payload_bytes, sender_eui64=None):
+        """
+        Decodifica una trama binaria. El NI se resuelve por el EUI64 del remitente en la base de
+        datos y, si no está, por el handle: son los 16 bits bajos de SL y dos nodos pueden compartirlo.
+        """
+        frame = decode_report_frame(payload_bytes)
+        if frame is None:
+            self.metrics.inc(metrics.PARSE_ERRORS)
+            return None, None, None
+        msg_type, handle, battery_mv, flags, counter, data, soc = frame
+        data = decode_batch(data) if msg_type == MSG_BATCH else data.decode('utf-8')
+        if msg_type == MSG_HELLO:
+            self.node_handles[handle] = data
+            return data, battery_mv / 1000, "HELLO"
+        entry = self.device_database.get(sender_eui64)
+        if entry:
+            node_id = entry['node_id']
+        else:
+            node_id = self.node_handles.get(handle) or "N{:04X}".format(handle)
+        return node_id, battery_mv / 1000, data
+
     def update_device_database(self, sender_eui64, node_id, battery):
         """Actualiza la base de datos con info del dispositivo."""
         current_time = time.ticks_ms()
         if sender_eui64 not in self.device_database:
-            self.device_database[sender_eui64] = {
+            db_entry = self.device_database[sender_eui64] = {
                 'node_id': node_id,
                 'battery': battery,
                 'last_report_time': current_time,
-                'movement_count': 1
+                'movement_count': 1,
+                'interval_ms': 0,
+                'online': True,
+                'sleepy': None          # Declarado en el último reporte (declares_sleepy); None: sin declarar
             }
-            print("Nuevo dispositivo registrado: {}".format(node_id))
+            self.log(eventlog.DEVICE_NEW, node_id)
         else:
             db_entry = self.device_database[sender_eui64]
+            # Media móvil exponencial del intervalo entre reportes
+            elapsed = time.ticks_diff(current_time, db_entry['last_report_time'])
+            interval = db_entry['interval_ms']
+            db_entry['interval_ms'] = elapsed if not interval else interval + ((elapsed - interval) >> self.LIVENESS_EWMA_SHIFT)
             db_entry.update({'node_id': node_id, 'battery': battery, 'last_report_time': current_time})
             db_entry['movement_count'] += 1
-            print("Dispositivo actualizado: {}".format(node_id))
+            self.log(eventlog.DEVICE_UPDATED, node_id)
+            if not db_entry['online']:
+                db_entry['online'] = True
+                self.esp32_write("ONLINE:{}".format(node_id))
+        self.liveness.schedule(sender_eui64, self.get_liveness_deadline(db_entry))
+        ring = self.telemetry.get(sender_eui64)
+        if ring is None:
+            ring = self.telemetry[sender_eui64] = TelemetryRing(self.telemetry_samples)
+        ring.add(int(battery * 1000), current_time)
         
-        # Imprimir base de datos
-        print("--- Base de Datos ---")
-        for eui, data in self.device_database.items():
-            eui_str = ''.join('{:02x}'.format(b) for b in eui)
-            print("  - {}: ID={}, Bat={}, Reportes={}".format(eui_str, data['node_id'], data['battery'], data['movement_count']))
-        print("Total dispositivos: {}".format(len(self.device_database)))
+        # Imprimir base de datos (solo con depuración activa: es O(N) por reporte)
+        if self.debug:
+            self.debug_write("--- Base de Datos ---")
+            for eui, data in self.device_database.items():
+                eui_str = ''.join('{:02x}'.format(b) for b in eui)
+                self.debug_write("  - {}: ID={}, Bat={}, Reportes={}".format(eui_str, data['node_id'], data['battery'], data['movement_count']))
+            self.debug_write("Total dispositivos: {}".format(len(self.device_database)))
     
+    def get_liveness_deadline(self, db_entry):
+        """Tiempo de silencio tolerado antes de considerar el dispositivo OFFLINE."""
+        if not db_entry['interval_ms']:
+            return self.LIVENESS_DEFAULT_MS
+        return max(self.LIVENESS_MIN_MS, db_entry['interval_ms'] * self.LIVENESS_FACTOR)
+
+    def check_liveness(self):
+        """Notifica al ESP32 los dispositivos cuyo plazo de actividad ha vencido."""
+        for eui in self.liveness.advance():
+            db_entry = self.device_database.get(eui)
+            if db_entry and db_entry['online']:
+                db_entry['online'] = False
+                self.esp32_write("OFFLINE:{}".format(db_entry['node_id']))
+
+    def esp32_write(self, line):
+        """
+        Escribe una línea de protocolo hacia el ESP32 en el modo TTL activo.
+        En modo FRAMED una línea que no cabe en una trama (un REPORT o un STATS largos) se
+        recorta: partirla en varias tramas las convertiría en líneas distintas para el ESP32.
+        """
+        if self.ttl_mode == MODE_FRAMED:
+            self.ttl_seq = (self.ttl_seq + 1) & 0xFF
+            self.esp32_out.write(encode_frame(T_MSG, self.ttl_seq, clip_payload(line)))
+        else:
+            stdout.write(line + "\n")
+
+    def debug_write(self, text):
+        """Depuración por un canal que no interfiere con el protocolo del ESP32."""
+        if self.debug_uart:
+            self.debug_uart.write(text + "\n")
+        elif self.ttl_mode == MODE_FRAMED:
+            self.ttl_seq = (self.ttl_seq + 1) & 0xFF
+            self.esp32_out.write(encode_frame(T_DEBUG, self.ttl_seq, clip_payload(text)))
+        else:
+            stdout.write("#" + text + "\n")
+
+    def set_debug_mode(self, mode):
+        """Selecciona el canal de depuración. Devuelve False si el modo no está disponible."""
+        if mode == self.DEBUG_UART:
+            try:
+                from machine import UART
+                self.debug_uart = UART(self.DEBUG_UART_ID, self.DEBUG_UART_BAUD)
+            except Exception:
+                return False
+        elif mode in (self.DEBUG_OFF, self.DEBUG_TAGGED):
+            self.debug_uart = None
+        else:
+            return False
+        self.debug_mode = mode
+        self.debug = mode != self.DEBUG_OFF
+        return True
+
+    def set_ttl_mode(self, mode):
+        """Cambia el modo del enlace TTL. La confirmación sale todavía en el modo anterior."""
+        if mode not in (MODE_TEXT, MODE_FRAMED):
+            self.esp32_write("ERROR:INVALID_MODE")
+            return
+        self.esp32_write("MODE:{}:OK".format(mode))
+        self.ttl_mode = mode
+        self.ttl_parser.reset()
+        self.esp32_command_buffer = ""
+
     def send_report_to_esp32(self, node_id, battery, data):
-        """Envía reporte a ESP32 via stdout."""
-        message = "REPORT:{}:{:.2f}:{}".format(node_id, battery, data)
-        stdout.write(message + "\n")
-        print("Enviado a ESP32: {}".format(message))
+        """Envía reporte a ESP32 via stdout (o lo acumula en modo agrupado)."""
+        record = "{}:{:.2f}:{}".format(node_id, battery, data)
+        if not self.batch_reports:
+            self.esp32_write("REPORT:" + record)
+            return
+        self.check_report_batch()
+        if self.report_batch_bytes + len(record) >= self.REPORT_BATCH_MAX_BYTES:
+            self.flush_reports()
+        if not self.report_batch:
+            self.report_batch_start = time.ticks_ms()
+        self.report_batch.append(record.replace('|', '/'))  # '|' separa registros
+        self.report_batch_bytes += len(record) + 1
+        if len(self.report_batch) >= self.REPORT_BATCH_MAX:
+            self.flush_reports()
+
+    def send_batch_to_esp32(self, node_id, battery, batch):
+        """
+        Lote del outbox de un nodo: un REPORT por registro con su batería y su antigüedad
+        ("<datos> (hace <s> s)"), precedido del número de registros descartados si los hubo.
+        """
+        dropped, records = batch
+        if dropped:
+            self.send_report_to_esp32(node_id, battery, "Reportes descartados en el nodo: {}".format(dropped))
+        for age_s, battery_mv, soc, flags, data in records:
+            self.send_report_to_esp32(node_id, battery_mv / 1000, "{} (hace {} s)".format(data, age_s))
+
+    def flush_reports(self):
+        """Envía los reportes acumulados en una única línea REPORTS."""
+        if not self.report_batch:
+            return
+        latency_ms = time.ticks_diff(time.ticks_ms(), self.report_batch_start)
+        self.metrics.high_water(metrics.BATCH_HWM, len(self.report_batch))
+        self.esp32_write("REPORTS:" + "|".join(self.report_batch))
+        self.batch_flushes += 1
+        self.batch_records += len(self.report_batch)
+        self.batch_latency_total_ms += latency_ms
+        self.batch_latency_max_ms = max(self.batch_latency_max_ms, latency_ms)
+        self.report_batch = []
+        self.report_batch_bytes = 0
+
+    def batch_time_left(self):
+        """Milisegundos hasta que vence el buffer de reportes (None si está vacío)."""
+        if not self.report_batch:
+            return None
+        return self.REPORT_BATCH_LATENCY_MS - time.ticks_diff(time.ticks_ms(), self.report_batch_start)
+
+    def check_report_batch(self):
+        """Vacía el buffer de reportes si se ha alcanzado la latencia máxima."""
+        time_left = self.batch_time_left()
+        if time_left is not None and time_left <= 0:
+            self.flush_reports()
     
     def handle_esp32_request(self, command):
-        """Procesa solicitud del ESP32."""
+        """Procesa solicitud del ESP32: una búsqueda en ESP32_COMMANDS por el texto antes del primer ':'."""
         try:
             parts = command.strip().split(':')
-            if len(parts) < 2:
-                stdout.write("ERROR:INVALID_COMMAND\n")
+            handler = self.esp32_handlers.get(parts[0].upper())
+            if handler is None:
+                self.esp32_write("ERROR:UNKNOWN_COMMAND")
                 return
-            
-            cmd_type = parts[0].upper()
-            target = parts[1]
-            
-            # Buscar dirección por nombre o usar directamente como dirección
-            target_addr = None
-            if len(target) == 16 and all(c in '0123456789ABCDEFabcdef' for c in target):    # Dirección EUI64
-                target_addr = bytes.fromhex(target)
-            else:                                                                           # Buscar por nombre
-                for eui, data in self.device_database.items():
-                    if data['node_id'] == target:
-                        target_addr = eui
-                        break
-            
-            if not target_addr:
-                stdout.write("ERROR:DEVICE_NOT_FOUND\n")
-                return
-            
-            if cmd_type == "REPORT":
-                # Solicitar reporte al dispositivo remoto
-                message = "{}:{:.2f}:Solicitud de reporte.".format(self.device_node_id, self.get_battery_status(as_string=False))
-                if self.safe_send_and_wait_ack(target_addr, message):
-                    # Esperar respuesta (simplificado; en práctica, manejar en bucle principal)
-                    stdout.write("REPORT_RESPONSE:OK\n")
-                else:
-                    stdout.write("REPORT_RESPONSE:NO_RESPONSE\n")
-            
-            elif cmd_type == "CAMERA" and len(parts) == 3:
-                action = parts[2].upper()
-                if action in ["ON", "OFF"]:
-                    message = "TEL:{}".format(action)
-                    if self.safe_send_and_wait_ack(target_addr, message):
-                        stdout.write("CAMERA_RESPONSE:OK\n")
+            handler(parts)
+        except Exception as e:
+            self.log(eventlog.ESP32_ERROR, e)
+            self.esp32_write("ERROR:PROCESSING_FAILED")
+
+    def resolve_target(self, parts):
+        """
+        Dirección del dispositivo indicado en parts[1] (NI o EUI64 en hexadecimal).
+        Si no se encuentra, responde el error al ESP32 y devuelve None.
+        """
+        if len(parts) < 2:
+            self.esp32_write("ERROR:INVALID_COMMAND")
+            return None
+        target = parts[1]
+        target_addr = None
+        if len(target) == 16 and all(c in '0123456789ABCDEFabcdef' for c in target):    # Dirección EUI64
+            target_addr = bytes.fromhex(target)
+        else:                                                                           # Buscar por nombre
+            for eui, data in self.device_database.items():
+                if data['node_id'] == target:
+                    target_addr = eui
+                    break
+        if not target_addr:
+            self.esp32_write("ERROR:DEVICE_NOT_FOUND")
+        return target_addr
+
+    def esp32_mode(self, parts):
+        """MODE:TEXT / MODE:FRAMED: negociación del modo del enlace TTL."""
+        self.set_ttl_mode(parts[1].upper() if len(parts) > 1 else "")
+
+    def esp32_debug(self, parts):
+        """DEBUG:OFF / DEBUG:TAGGED / DEBUG:UART: canal de depuración."""
+        mode = parts[1].upper() if len(parts) > 1 else ""
+        if self.set_debug_mode(mode):
+            self.esp32_write("DEBUG:{}:OK".format(mode))
+        else:
+            self.esp32_write("ERROR:INVALID_MODE")
+
+    def esp32_report(self, parts):
+        """
+        REPORT:<nodo> o REPORT:@grupo: envía REQ_REPORT al dispositivo (o a todo el grupo).
+        Solo lo confirma el estado "<NI>: ..." con que responde on_req_report.
+        """
+        if len(parts) > 1 and parts[1].startswith('@'):
+            self.group_command(parts[1], "REQ_REPORT", "REPORT_RESPONSE", b"REQ_REPORT", self.is_status_reply)
+            return
+        target_addr = self.resolve_target(parts)
+        if not target_addr:
+            return
+        accept = lambda payload: self.is_status_reply(target_addr, payload)  # noqa: E731
+        self.deliver(target_addr, b"REQ_REPORT",
+                     lambda: self.safe_send_and_wait_ack(target_addr, "REQ_REPORT", accept=accept),
+                     "REPORT_RESPONSE")
+
+    def esp32_stats(self, parts):
+        """STATS:<nodo>: resumen de telemetría almacenada en el coordinador."""
+        target_addr = self.resolve_target(parts)
+        if not target_addr:
+            return
+        ring = self.telemetry.get(target_addr)
+        if ring:
+            self.esp32_write("STATS:{}:{}".format(parts[1], ring.summary()))
+        else:
+            self.esp32_write("ERROR:NO_DATA")
+
+    def esp32_camera(self, parts):
+        """CAMERA:<nodo>:ON|OFF o CAMERA:@grupo:ON|OFF: enciende o apaga cámaras remotas."""
+        if len(parts) != 3:
+            self.esp32_write("ERROR:INVALID_COMMAND")
+            return
+        action = parts[2].upper()
+        if action not in ("ON", "OFF"):
+            self.esp32_write("ERROR:INVALID_ACTION")
+            return
+        if parts[1].startswith('@'):
+            self.group_command(parts[1], "TEL:{}".format(action), "CAMERA_RESPONSE", "TEL:{}".format(action).encode('utf-8'))
+            return
+        target_addr = self.resolve_target(parts)
+        if not target_addr:
+            return
+        command = "TEL:{}".format(action)
+        self.deliver(target_addr, command.encode('utf-8'), lambda: self.send_as('COMMAND', target_addr, command),
+                     "CAMERA_RESPONSE")
+
+    def esp32_group(self, parts):
+        """GROUP:<nombre>:NI1,NI2,...: define un grupo explícito. Sin lista, lo elimina."""
+        if len(parts) < 2 or not parts[1]:
+            self.esp32_write("ERROR:INVALID_COMMAND")
+            return
+        members = [ni for ni in parts[2].split(',') if ni] if len(parts) > 2 else []
+        if members:
+            self.groups[parts[1]] = members
+        else:
+            self.groups.pop(parts[1], None)
+        self.esp32_write("GROUP_RESPONSE:{}:{}".format(parts[1], len(members)))
+
+    def resolve_group(self, group):
+        """
+        Miembros de '@grupo' como lista de (NI, EUI64). '@CAM*' selecciona los NI que empiezan
+        por CAM; '@nombre' usa la lista explícita definida con GROUP. Los NI desconocidos se omiten.
+        """
+        name = group[1:]
+        if name.endswith('*'):
+            prefix = name[:-1]
+            return [(data['node_id'], eui) for eui, data in self.device_database.items()
+                    if data['node_id'].startswith(prefix)]
+        members = self.groups.get(name)
+        if not members:
+            return []
+        by_name = {data['node_id']: eui for eui, data in self.device_database.items()}
+        return [(ni, by_name[ni]) for ni in members if ni in by_name]
+
+    def fanout(self, targets, message, retries=3, accept=None):
+        """
+        Envía 'message' a todos los destinos seguidos y recoge las respuestas en una única
+        ventana por intento (el mayor plazo de ACK estimado de los pendientes), en lugar de
+        una espera bloqueante por destino.
+        Solo una respuesta confirma a un destino: la que acepte accept(eui, payload) o, sin él,
+        cualquiera (is_reply); el resto de tramas que llegan mientras tanto, también los
+        reportes de los propios destinos, se procesan con normalidad.
+        Devuelve (NI confirmados, NI sin respuesta).
+        """
+        pending = {}
+        messages = {}
+        for node_id, eui in targets:
+            pending[eui] = node_id
+            messages[eui] = self.add_sequence(eui, message)  # Misma secuencia en todos los intentos
+        acked = []
+        for attempt in range(retries):
+            if attempt:
+                self.metrics.inc(metrics.RETRIES, len(pending))
+            window_ms = 0
+            start = time.ticks_ms()
+            for eui in pending:
+                self.send_message(eui, messages[eui])
+                window_ms = max(window_ms, self.rtt.timeout(eui))
+            while pending and time.ticks_diff(time.ticks_ms(), start) < window_ms:
+                self.feed_watchdog()
+                try:
+                    received = self.radio_receive()
+                    if not received:
+                        self.wait_rx(self.IDLE_SLEEP_MIN_MS)
+                        continue
+                    sender = received['sender_eui64']
+                    payload = received['payload']
+                    if sender in pending and (accept(sender, payload) if accept else is_reply(payload)):
+                        node_id = pending.pop(sender)
+                    else:
+                        node_id = None
+                    if node_id is not None:
+                        rtt_ms = time.ticks_diff(time.ticks_ms(), start)
+                        self.metrics.observe_rtt(rtt_ms)
+                        if not attempt:
+                            self.rtt.sample(sender, rtt_ms)
+                        acked.append(node_id)
                     else:
-                        stdout.write("CAMERA_RESPONSE:NO_RESPONSE\n")
-                else:
-                    stdout.write("ERROR:INVALID_ACTION\n")
+                        self.process_zigbee_frame(received)
+                except Exception as e:
+                    # Una trama errónea de otro nodo no aborta el comando de grupo
+                    self.log(eventlog.RX_ERROR, e)
+            if not pending:
+                break
+            self.metrics.inc(metrics.ACK_TIMEOUTS, len(pending))
+            for eui in pending:
+                self.rtt.on_timeout(eui)
+            self.log(eventlog.FANOUT_PENDING, attempt + 1, len(pending))
+        return acked, list(pending.values())
+
+    def group_command(self, group, message, response_type, mailbox_command, accept=None):
+        """
+        Envía un comando a un grupo y responde al ESP32 con una única línea agregada.
+        Los miembros dormidos reciben 'mailbox_command' a través del buzón, igual que los que
+        no responden al envío directo sin haber declarado que están siempre despiertos.
+        'accept' es el filtro de respuestas de fanout().
+        """
+        targets = self.resolve_group(group)
+        if not targets:
+            self.esp32_write("ERROR:DEVICE_NOT_FOUND")
+            return
+        awake = []
+        queued = []
+        for node_id, eui in targets:
+            if self.is_sleepy(eui):
+                self.enqueue_command(eui, mailbox_command)
+                queued.append(node_id)
             else:
-                stdout.write("ERROR:UNKNOWN_COMMAND\n")
-        except Exception as e:
-            print("Error procesando comando ESP32: {}".format(e))
-            stdout.write("ERROR:PROCESSING_FAILED\n")
-    
-    def check_and_process_incoming_messages(self):
+                awake.append((node_id, eui))
+        acked, failed = self.fanout(awake, message, accept=accept) if awake else ([], [])
+        for node_id, eui in awake:
+            if node_id in failed and self.mailbox_fallback(eui):
+                failed.remove(node_id)
+                self.enqueue_command(eui, mailbox_command)
+                queued.append(node_id)
+        self.esp32_write("{}:{}:OK={}:FAIL={}:QUEUED={}".format(
+            response_type, group, ",".join(acked), ",".join(failed), ",".join(queued)))
+
+    def is_sleepy(self, eui):
         """
-        Revisa si hay mensajes entrantes y los procesa.
-        Devuelve True si se procesó un comando, False en caso contrario.
+        True si el dispositivo declaró que duerme (FLAG_SLEEPY o SLEEPY_MARK en sus reportes).
+        No se deduce del intervalo de reporte: un nodo siempre despierto (cámara, router)
+        también puede pasar mucho tiempo sin reportar.
         """
-        self.feed_watchdog()
-        sender, payload = self.check_received_messages()
-        if not payload:
-            return False
-        
-        payload = payload.strip()
-        print("Mensaje recibido de {}: '{}'".format(sender, payload))
-        
-        command = payload
-        response_message = "{}:OK".format(command)
-        
-        if command == "REPORT":
-            print("Comando REPORT recibido.")
-            battery_status = self.get_battery_status(as_string=True)
-            report = "Estado: {}, Camara: {}, {}, Manual: {}".format(self.device_state, "ON" if self.pin_camera.value() else "OFF", battery_status, self.manual_camera)
-            self.safe_send(sender, "{}: {}".format(self.device_node_id, report))
-            if sender == self.coordinator_addr:
-                self.contador_fallo_comunicacion = 0
-            self.device_state = self.STATE_IDLE
+        db_entry = self.device_database.get(eui)
+        return bool(db_entry) and db_entry['sleepy'] is True
+
+    def mailbox_fallback(self, eui):
+        """
+        True si un envío directo fallido debe guardarse en el buzón: el nodo no ha declarado estar
+        despierto (AWAKE_MARK o trama binaria sin FLAG_SLEEPY), p. ej. un firmware anterior.
+        """
+        db_entry = self.device_database.get(eui)
+        return bool(db_entry) and db_entry['sleepy'] is not False
+
+    def deliver(self, target_addr, command, send, response_type, sent="OK"):
+        """
+        Entrega 'command' a un dispositivo y responde al ESP32 "<response_type>:<estado>".
+        Los dormidos lo reciben por el buzón; al resto se le envía con send() y, si falla,
+        va al buzón salvo que el nodo haya declarado estar siempre despierto (NO_RESPONSE).
+        """
+        if not self.is_sleepy(target_addr):
+            if send():
+                self.esp32_write("{}:{}".format(response_type, sent))
+                return
+            if not self.mailbox_fallback(target_addr):
+                self.esp32_write("{}:NO_RESPONSE".format(response_type))
+                return
+        self.enqueue_command(target_addr, command)
+        self.esp32_write("{}:QUEUED".format(response_type))
+
+    def mailbox_event(self, eui, command, event):
+        """Notifica al ESP32 el estado de un comando del buzón: QUEUED, SENT, OK, EXPIRED o DROPPED."""
+        db_entry = self.device_database.get(eui)
+        node_id = db_entry['node_id'] if db_entry else ''.join('{:02x}'.format(b) for b in eui)
+        self.esp32_write("MAILBOX:{}:{}:{}".format(node_id, command.decode('utf-8'), event))
+
+    def enqueue_command(self, eui, command):
+        """
+        Guarda 'command' (bytes) para entregarlo en el próximo ACK al dispositivo.
+        Un comando con la misma clave (texto antes del primer ':', p. ej. TEL) sustituye al anterior,
+        así ON/OFF repetidos se reducen al último. Si el buzón está lleno se descarta el más antiguo.
+        """
+        sep = command.find(b':')
+        key = command if sep < 0 else command[:sep]
+        mailbox = self.mailboxes.setdefault(eui, [])
+        for entry in mailbox:
+            if entry[1] == key:
+                mailbox.remove(entry)
+                break
+        if len(mailbox) >= self.MAILBOX_MAX:
+            dropped = mailbox.pop(0)
+            self.mailbox_expiry.cancel((eui, dropped[1]))
+            self.mailbox_event(eui, dropped[0], "DROPPED")
+        mailbox.append([command, key, 0])
+        self.metrics.high_water(metrics.MAILBOX_HWM, len(mailbox))
+        self.mailbox_expiry.schedule((eui, key), self.MAILBOX_TTL_MS)
+        self.mailbox_event(eui, command, "QUEUED")
+
+    def build_ack(self, eui):
+        """ACK a un reporte: "OK" seguido de los comandos pendientes ("OK|TEL:ON|REQ_REPORT")."""
+        mailbox = self.mailboxes.get(eui)
+        if not mailbox:
+            return "OK"
+        ack = b"OK"
+        for entry in mailbox:
+            if len(ack) + 1 + len(entry[0]) > self.MAILBOX_ACK_MAX_BYTES:
+                break
+            ack += b"|" + entry[0]
+            if not entry[2]:
+                self.mailbox_event(eui, entry[0], "SENT")
+            entry[2] += 1
+        return ack
+
+    def confirm_mailbox(self, eui, payload):
+        """
+        Comprueba si 'payload' confirma un comando ya entregado: "<cmd>:OK" o, para REQ_REPORT,
+        el reporte de estado "<NI>: ...". Si es así lo retira del buzón y devuelve True.
+        """
+        mailbox = self.mailboxes[eui]
+        db_entry = self.device_database.get(eui)
+        for entry in mailbox:
+            command = entry[0]
+            if not entry[2]:
+                continue
+            if payload == command + b":OK":
+                status = "OK"
+            elif payload.startswith(command + b":"):
+                status = "OK:" + payload[len(command) + 1:].decode('utf-8')   # Respuesta con datos (METRICS)
+            elif command == b"REQ_REPORT" and self.is_status_reply(eui, payload):
+                status = "OK:" + payload[len(db_entry['node_id']) + 2:].decode('utf-8')
+            else:
+                continue
+            mailbox.remove(entry)
+            if not mailbox:
+                del self.mailboxes[eui]
+            self.mailbox_expiry.cancel((eui, entry[1]))
+            self.mailbox_event(eui, command, status)
             return True
+        return False
+
+    def is_status_reply(self, eui, payload):
+        """True si 'payload' es el estado "<NI>: ..." con que 'eui' responde a REQ_REPORT."""
+        db_entry = self.device_database.get(eui)
+        return bool(db_entry) and payload.startswith(db_entry['node_id'].encode('utf-8') + b": ")
+
+    def check_mailbox_expiry(self):
+        """Retira los comandos caducados y lo notifica al ESP32."""
+        for eui, key in self.mailbox_expiry.advance():
+            mailbox = self.mailboxes.get(eui, ())
+            for entry in mailbox:
+                if entry[1] == key:
+                    mailbox.remove(entry)
+                    self.mailbox_event(eui, entry[0], "EXPIRED")
+                    break
+            if eui in self.mailboxes and not mailbox:
+                del self.mailboxes[eui]
+
+    def esp32_metrics(self, parts):
+        """
+        METRICS: contadores del coordinador. METRICS:<nodo>: pide los del nodo remoto; la respuesta
+        llega de forma asíncrona como "METRICS:<nodo>:..." (o por el buzón si está dormido).
+        """
+        if len(parts) < 2 or not parts[1]:
+            self.esp32_write("METRICS:{}:{}".format(self.device_node_id, self.metrics.dump()))
+            return
+        target_addr = self.resolve_target(parts)
+        if not target_addr:
+            return
+        self.deliver(target_addr, b"METRICS", lambda: self.send_message(target_addr, self.add_sequence(target_addr, "METRICS")),
+                     "METRICS_RESPONSE", "SENT")
+
+    def on_metrics(self, sender, payload, args):
+        """Respuesta "METRICS:<volcado>" de un nodo remoto: se reenvía al ESP32 con su NI."""
+        if not args:
+            super().on_metrics(sender, payload, args)
+            return
+        db_entry = self.device_database.get(sender)
+        node_id = db_entry['node_id'] if db_entry else ''.join('{:02x}'.format(b) for b in sender)
+        self.esp32_write("METRICS:{}:{}".format(node_id, args.decode('utf-8')))
+
+    def esp32_logs(self, parts):
+        """
+        LOGS: registro de eventos del coordinador, una línea "LOGS:<nodo>:p<n>/<total>,<ticks>:..."
+        por trozo. LOGS:<nodo>: pide el del nodo remoto; sus trozos llegan de forma asíncrona
+        (o por el buzón si está dormido).
+        """
+        if len(parts) < 2 or not parts[1]:
+            for part in self.log_parts():
+                self.esp32_write("LOGS:{}:{}".format(self.device_node_id, part))
+            return
+        target_addr = self.resolve_target(parts)
+        if not target_addr:
+            return
+        self.deliver(target_addr, b"LOGS", lambda: self.send_message(target_addr, self.add_sequence(target_addr, "LOGS")),
+                     "LOGS_RESPONSE", "SENT")
 
+    def on_logs(self, sender, payload, args):
+        """Trozo "LOGS:p<n>/<total>,<ticks>:..." de un nodo remoto: se reenvía al ESP32 con su NI."""
+        if not args:
+            super().on_logs(sender, payload, args)
+            return
+        db_entry = self.device_database.get(sender)
+        node_id = db_entry['node_id'] if db_entry else ''.join('{:02x}'.format(b) for b in sender)
+        self.esp32_write("LOGS:{}:{}".format(node_id, args.decode('utf-8')))
+
+    def camera_is_on(self):
+        """En el coordinador la entrada de cámara (D12) es activa a nivel bajo."""
+        return self.pin_camera.value() == 0
+
+    def process_zigbee_frame(self, received_msg):
+        """Procesa una trama Zigbee: reporte de un dispositivo remoto o comando."""
+        sender_eui64 = received_msg['sender_eui64']
+        payload = received_msg['payload']
+        reply = wants_reply(payload)        # False: el remitente se conforma con el estado de la radio
+
+        # Número de secuencia: contador de la cabecera binaria o sobre de texto "<seq>#"
+        binary = bool(payload) and payload[0] & 0xF0 == FRAME_MARKER
+        if binary:
+            seq = payload[FRAME_HEADER_LEN - 1] if len(payload) >= FRAME_HEADER_LEN else None
+            modulus = COUNTER_MODULUS
         else:
-            response_message = "UNKNOWN COMMAND RECEIVED"
-            self.safe_send(sender, response_message)
-            
-        return False
-    
+            seq, payload = split_sequence(payload)
+            modulus = SEQ_MODULUS
+        if seq is not None and not self.dup_filter.accept(sender_eui64, seq, modulus):
+            if reply:
+                self.resend_reply(sender_eui64)                             # Re-ACK sin reprocesar
+            return
+
+        # Intentar parsear como reporte (node_id:battery:data)
+        node_id, battery, data = self.parse_payload(payload, sender_eui64)
+        if node_id and (data or binary):
+            # Es un reporte de dispositivo remoto (la trama binaria puede llevar datos vacíos)
+            self.update_device_database(sender_eui64, node_id, battery)     # Actualizar local DB
+            self.device_database[sender_eui64]['sleepy'] = declares_sleepy(payload)
+            if reply or self.mailboxes.get(sender_eui64):
+                self.reply_target = sender_eui64
+                self.send_message(sender_eui64, self.build_ack(sender_eui64))   # Feedback (y comandos del buzón)
+                self.reply_target = None
+            if isinstance(data, tuple):
+                self.send_batch_to_esp32(node_id, battery, data)            # Reportes atrasados del outbox
+            else:
+                self.send_report_to_esp32(node_id, battery, data)           # Enviar a ESP32
+        elif sender_eui64 in self.mailboxes and self.confirm_mailbox(sender_eui64, payload):
+            pass                                                            # Respuesta a un comando del buzón
+        else:
+            # No es un reporte, tratar como comando (e.g., "REQ_REPORT" del telemando)
+            self.dispatch_command(sender_eui64, payload, reply and seq is not None)
+
+    def queue_frame(self, frame):
+        """
+        Trama de otro remitente recibida mientras se espera un ACK: se procesa en el momento,
+        como en fanout. Los manejadores del coordinador no esperan ACK (no hay reentrada) y
+        una espera de varios segundos desbordaría cualquier cola acotada.
+        """
+        self.process_zigbee_frame(frame)
+
+    def drain_zigbee_queue(self):
+        """
+        Procesa tramas Zigbee hasta vaciar la cola de recepción o agotar el presupuesto.
+        Devuelve (tramas procesadas, True si queda trabajo pendiente).
+        """
+        start = time.ticks_ms()
+        processed = 0
+        while processed < self.RX_BUDGET_FRAMES:
+            self.check_report_batch()
+            try:
+                received_msg = self.receive_frame()
+                if not received_msg:
+                    self.metrics.high_water(metrics.RX_BURST_HWM, processed)
+                    return processed, False
+                processed += 1
+                self.process_zigbee_frame(received_msg)
+            except Exception as e:
+                self.log(eventlog.RX_ERROR, e)
+            self.feed_watchdog()
+            if time.ticks_diff(time.ticks_ms(), start) >= self.RX_BUDGET_MS:
+                break
+        self.metrics.high_water(metrics.RX_BURST_HWM, processed)
+        return processed, True
+
+    def on_esp32_frame(self, frame_type, seq, payload):
+        """Trama válida recibida del ESP32 en modo FRAMED."""
+        if frame_type == T_CMD:
+            self.flush_reports()
+            try:
+                command = payload.decode('utf-8')
+            except UnicodeError:                                # CRC correcto pero texto inválido
+                self.metrics.inc(metrics.PARSE_ERRORS)
+                self.esp32_write("ERROR:INVALID_COMMAND")
+                return
+            self.handle_esp32_request(command)
+
+    def poll_esp32_framed(self):
+        """Lee los bytes disponibles del ESP32 y los pasa al parser de tramas."""
+        chunk = self.ttl_rx_chunk
+        count = 0
+        while count < len(chunk):
+            try:
+                byte = self.esp32_in.read(1)
+            except Exception:
+                break
+            if not byte:
+                break
+            chunk[count] = byte[0]
+            count += 1
+        if count:
+            self.ttl_last_rx = time.ticks_ms()
+            self.ttl_parser.feed(memoryview(chunk)[:count], self.on_esp32_frame)
+        elif self.ttl_parser.count and time.ticks_diff(time.ticks_ms(), self.ttl_last_rx) > self.TTL_FRAME_TIMEOUT_MS:
+            # Trama incompleta que no termina de llegar: resincronizar con lo ya recibido
+            self.ttl_parser.resync(self.on_esp32_frame)
+
+    def poll_esp32(self):
+        """Lee los caracteres disponibles del ESP32 y ejecuta las líneas completas."""
+        if self.ttl_mode == MODE_FRAMED:
+            self.poll_esp32_framed()
+            return
+        for _ in range(self.ESP32_BUDGET_CHARS):
+            try:
+                char = stdin.read(1)  # Leer carácter a carácter
+            except Exception:
+                return  # Ignorar errores de lectura
+            if not char:
+                return
+            if char == '\n':
+                if self.esp32_command_buffer:
+                    self.flush_reports()  # No retener reportes durante la espera de ACKs
+                    command = self.esp32_command_buffer
+                    self.esp32_command_buffer = ""
+                    self.handle_esp32_request(command)
+                    if self.ttl_mode != MODE_TEXT:
+                        return  # El resto llega ya en modo FRAMED
+            else:
+                self.esp32_command_buffer += char
+
     def run(self):
         """Bucle principal del coordinador."""
         
         while(not self.setup()):
             time.sleep_ms(100)              # Esperar hasta inicializar
                     
-        print("--- Coordinador iniciado. Esperando mensajes Zigbee y ESP32... ---")
+        self.log(eventlog.COORD_STARTED)
+        self.esp32_write("MODES:{},{}".format(MODE_TEXT, MODE_FRAMED))  # Modos TTL disponibles
         
+        idle_sleep_ms = self.IDLE_SLEEP_MIN_MS
         while True:
             self.feed_watchdog()
             
-            # Procesar mensajes Zigbee
-            try:
-                received_msg = xbee.receive()
-                if received_msg:
-                    sender_eui64 = received_msg['sender_eui64']
-                    payload = received_msg['payload']
-                    
-                    # Intentar parsear como reporte (node_id:battery:data)
-                    node_id, battery, data = self.parse_payload(payload)
-                    if node_id and data:
-                        # Es un reporte de dispositivo remoto
-                        self.update_device_database(sender_eui64, node_id, battery)     # Actualizar local DB
-                        self.send_message(sender_eui64, "OK")                           # Feedback a dispositivo remoto
-                        self.send_report_to_esp32(node_id, battery, data)               # Enviar a ESP32
-                    else:
-                        # No es un reporte, tratar como comando (e.g., "REQ_REPORT" del telemando)
-                        try:
-                            command = payload.decode('utf-8').strip()
-                            if command == "REQ_REPORT":
-                                # Enviar reporte propio al telemando
-                                battery_status = self.get_battery_status(as_string=True)
-                                report = "Estado: {}, Camara: {}, {}, Manual: {}".format(
-                                    self.device_state, 
-                                    "ON" if self.pin_camera and self.pin_camera.value() == 0 else "OFF", 
-                                    battery_status, 
-                                    getattr(self, 'manual_camera', False)
-                                )
-                                self.safe_send(sender_eui64, "{}: {}".format(self.device_node_id, report))
-                                print("Reporte enviado al telemando: {}".format(report))
-                            else:
-                                # Comando desconocido
-                                self.send_message(sender_eui64, "UNKNOWN COMMAND")
-                        except UnicodeDecodeError:
-                            self.send_message(sender_eui64, "INVALID PAYLOAD")
-            except Exception as e:
-                print("Error en recepción Zigbee: {}".format(e))
+            # Procesar mensajes Zigbee hasta vaciar la cola (o agotar el presupuesto)
+            processed, backlog = self.drain_zigbee_queue()
             
             # Procesar comandos ESP32 (asíncrono)
-            try:
-                char = stdin.read(1)  # Leer carácter a carácter
-                if char:
-                    if char == '\n':
-                        if self.esp32_command_buffer:
-                            self.handle_esp32_request(self.esp32_command_buffer)
-                            self.esp32_command_buffer = ""
-                    else:
-                        self.esp32_command_buffer += char
-            except:
-                pass  # Ignorar errores de lectura
+            self.poll_esp32()
             
-            time.sleep_ms(10)  # Pausa para no sobrecargar CPU
+            # Dispositivos que han dejado de reportar
+            self.check_liveness()
+            self.check_mailbox_expiry()
+            
+            # Reportes agrupados que han alcanzado la latencia máxima
+            self.check_report_batch()
+            
+            # Pausa adaptativa: sin pausa con trabajo pendiente, creciente en reposo
+            if backlog:
+                continue
+            if processed:
+                idle_sleep_ms = self.IDLE_SLEEP_MIN_MS
+            else:
+                idle_sleep_ms = min(idle_sleep_ms * 2, self.IDLE_SLEEP_MAX_MS)
+            time_left = self.batch_time_left()
+            if time_left is not None:
+                time.sleep_ms(max(0, min(idle_sleep_ms, time_left)))
+            else:
+                time.sleep_ms(idle_sleep_ms)
 
 # --- Lógica Principal ---
 if __name__ == '__main__':
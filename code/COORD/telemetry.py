@@ -0,0 +1,68 @@
+import time
+from array import array
+
+
+class TelemetryRing:
+    """
+    Buffer circular preasignado con las últimas muestras de batería (mV) de un dispositivo
+    y el instante de cada reporte. Min, max, EWMA y pendiente se actualizan en O(1) por muestra.
+    Memoria fija: 6 bytes por muestra (array 'H' para mV + array 'l' para segundos).
+    """
+    EWMA_SHIFT = 3  # Peso de la media móvil: 1/8
+
+    def __init__(self, size=16):
+        self.size = size
+        self.battery_mv = array('H', [0] * size)
+        self.times_s = array('l', [0] * size)   # Segundos desde la primera muestra
+        self.head = 0                            # Próxima posición a escribir
+        self.count = 0
+        self.min_mv = 0
+        self.max_mv = 0
+        self.ewma_mv = 0
+        self.clock_ms = 0                        # Tiempo acumulado con ticks_diff (inmune al desbordamiento)
+        self.last_tick = 0
+
+    def add(self, battery_mv, now=None):
+        """Añade una muestra de batería (mV) tomada en 'now' (ticks_ms)."""
+        if now is None:
+            now = time.ticks_ms()
+        battery_mv = min(max(battery_mv, 0), 0xFFFF)
+        if self.count:
+            self.clock_ms += time.ticks_diff(now, self.last_tick)
+            self.min_mv = min(self.min_mv, battery_mv)
+            self.max_mv = max(self.max_mv, battery_mv)
+            self.ewma_mv += (battery_mv - self.ewma_mv) >> self.EWMA_SHIFT
+        else:
+            self.min_mv = self.max_mv = self.ewma_mv = battery_mv
+        self.last_tick = now
+        self.battery_mv[self.head] = battery_mv
+        self.times_s[self.head] = self.clock_ms // 1000
+        self.head = (self.head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def newest_index(self):
+        return (self.head - 1) % self.size
+
+    def oldest_index(self):
+        return (self.head - self.count) % self.size
+
+    def slope_mv_per_hour(self):
+        """Pendiente entre la muestra más antigua y la más reciente de la ventana (mV/h)."""
+        newest = self.newest_index()
+        oldest = self.oldest_index()
+        elapsed_s = self.times_s[newest] - self.times_s[oldest]
+        if elapsed_s <= 0:
+            return 0
+        return (self.battery_mv[newest] - self.battery_mv[oldest]) * 3600 // elapsed_s
+
+    def summary(self, now=None):
+        """Resumen compacto: muestras, última, min, max, EWMA (mV), pendiente (mV/h) y antigüedad (s)."""
+        if not self.count:
+            return "n=0"
+        if now is None:
+            now = time.ticks_ms()
+        age_s = time.ticks_diff(now, self.last_tick) // 1000
+        return "n={},last={},min={},max={},ewma={},slope={},age={}".format(
+            self.count, self.battery_mv[self.newest_index()], self.min_mv, self.max_mv,
+            self.ewma_mv, self.slope_mv_per_hour(), age_s)
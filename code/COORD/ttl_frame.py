@@ -0,0 +1,171 @@
+# Tramas del enlace TTL coordinador <-> ESP32 (modo FRAMED).
+# | SYNC (1) | LEN (1) | TIPO (1) | SEQ (1) | PAYLOAD (LEN) | CRC16 (2, big endian) |
+# El CRC16-CCITT (poly 0x1021, init 0xFFFF) cubre LEN, TIPO, SEQ y PAYLOAD.
+# No depende de xbee ni machine: se puede probar en Linux sobre un par pty.
+from array import array
+
+SYNC = 0xA5
+HEADER_LEN = 4
+CRC_LEN = 2
+MAX_PAYLOAD = 240
+
+# Tipos de trama
+T_MSG = 1       # Línea de protocolo coordinador -> ESP32 (REPORT, *_RESPONSE, ...)
+T_CMD = 2       # Comando ESP32 -> coordinador
+T_DEBUG = 3     # Depuración coordinador -> ESP32 (el ESP32 la descarta sin parsearla)
+
+MODE_TEXT = "TEXT"
+MODE_FRAMED = "FRAMED"
+
+
+def _make_crc_table():
+    table = array('H', [0] * 256)
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table[i] = crc & 0xFFFF
+    return table
+
+
+CRC_TABLE = _make_crc_table()
+
+
+def crc16(data, start=0, end=None, crc=0xFFFF):
+    """CRC16-CCITT de data[start:end] sin copiar el buffer."""
+    if end is None:
+        end = len(data)
+    table = CRC_TABLE
+    for i in range(start, end):
+        crc = ((crc << 8) & 0xFFFF) ^ table[((crc >> 8) ^ data[i]) & 0xFF]
+    return crc
+
+
+def clip_payload(payload, limit=MAX_PAYLOAD):
+    """
+    Payload en bytes recortado a 'limit' sin partir un carácter UTF-8 (las líneas de
+    protocolo pueden llevar tildes: recortar por caracteres no garantiza el tamaño).
+    """
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    if len(payload) <= limit:
+        return payload
+    end = limit
+    while end and payload[end] & 0xC0 == 0x80:      # Byte de continuación: retroceder
+        end -= 1
+    return payload[:end]
+
+
+def encode_frame(frame_type, seq, payload):
+    """Construye una trama completa lista para escribir en el UART."""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    length = len(payload)
+    if length > MAX_PAYLOAD:
+        raise ValueError("payload demasiado largo")
+    frame = bytearray(HEADER_LEN + length + CRC_LEN)
+    frame[0] = SYNC
+    frame[1] = length
+    frame[2] = frame_type
+    frame[3] = seq & 0xFF
+    frame[HEADER_LEN:HEADER_LEN + length] = payload
+    crc = crc16(frame, 1, HEADER_LEN + length)
+    frame[-2] = crc >> 8
+    frame[-1] = crc & 0xFF
+    return frame
+
+
+class FrameParser:
+    """
+    Parser incremental con buffer de recepción preasignado.
+    Ante un CRC erróneo o una longitud imposible vuelve a buscar SYNC en el byte siguiente
+    de lo ya recibido, de modo que se resincroniza en una sola pasada sin releer el UART.
+    """
+
+    def __init__(self, max_payload=MAX_PAYLOAD):
+        self.max_payload = max_payload
+        self.buf = bytearray(HEADER_LEN + max_payload + CRC_LEN)
+        self.mv = memoryview(self.buf)
+        self.count = 0           # Bytes válidos en el buffer
+        self.frames_ok = 0
+        self.crc_errors = 0
+        self.discarded = 0       # Bytes descartados buscando SYNC
+        self.reset_pending = False   # reset() llamado desde on_frame: _parse y feed paran ahí
+
+    def reset(self):
+        """
+        Vacía el buffer. Se puede llamar desde on_frame (p. ej. al cambiar de modo el enlace):
+        el resto de lo recibido en esa llamada a feed() se descarta en lugar de compactarse.
+        """
+        self.count = 0
+        self.reset_pending = True
+
+    def feed(self, data, on_frame):
+        """Procesa 'data' y llama on_frame(tipo, seq, payload) por cada trama válida."""
+        pos = 0
+        size = len(data)
+        capacity = len(self.buf)
+        self.reset_pending = False
+        while pos < size:
+            chunk = min(size - pos, capacity - self.count)
+            self.buf[self.count:self.count + chunk] = data[pos:pos + chunk]
+            self.count += chunk
+            pos += chunk
+            self._parse(on_frame)
+            if self.reset_pending:
+                self.discarded += size - pos
+                return
+
+    def resync(self, on_frame):
+        """
+        Descarta el SYNC de una trama incompleta que no termina de llegar (p. ej. basura
+        con 0xA5 y una longitud grande) y vuelve a buscar tramas en lo ya recibido.
+        """
+        if not self.count:
+            return
+        self.buf[0:self.count - 1] = self.buf[1:self.count]
+        self.count -= 1
+        self.discarded += 1
+        self.reset_pending = False
+        self._parse(on_frame)
+
+    def _parse(self, on_frame):
+        buf = self.buf
+        i = 0
+        n = self.count
+        while i < n:
+            if buf[i] != SYNC:
+                i += 1
+                self.discarded += 1
+                continue
+            if n - i < HEADER_LEN:
+                break
+            length = buf[i + 1]
+            if length > self.max_payload:
+                i += 1
+                self.discarded += 1
+                continue
+            end = i + HEADER_LEN + length + CRC_LEN
+            if end > n:
+                break
+            crc = (buf[end - 2] << 8) | buf[end - 1]
+            if crc16(buf, i + 1, end - CRC_LEN) != crc:
+                self.crc_errors += 1
+                i += 1
+                continue
+            self.frames_ok += 1
+            on_frame(buf[i + 2], buf[i + 3], bytes(self.mv[i + HEADER_LEN:end - CRC_LEN]))
+            if self.reset_pending:
+                return
+            i = end
+        # Compactar: conservar solo la trama incompleta pendiente
+        if i:
+            remaining = n - i
+            if remaining:
+                buf[0:remaining] = buf[i:n]
+            self.count = remaining
+        elif n == len(buf):
+            # Buffer lleno sin trama válida posible: descartar el primer byte
+            buf[0:n - 1] = buf[1:n]
+            self.count = n - 1
+            self.discarded += 1
@@ -5,6 +5,7 @@ import machine
 import time
 import xbee
 from tools import XBeeDevice  # Assuming tools.py is in the parent directory; adjust if needed
+import eventlog
 
 xbee_device = xbee.XBee()
 # --- Configuración ---
@@ -16,69 +17,53 @@ class Camara(XBeeDevice):
     # Sobrescribir constantes específicas de la cámara
     RETRY_DELAY_MS = 1000
     HEARING_INTERVAL_MS = 2000
-    STATE_SENSOR_TRIGGERED = 4  # Estado adicional para activación por sensor
+    RX_CALLBACK = True          # Espera en reposo sobre la cola de recepción en lugar de sondear sin pausa
+
+    # Comandos Zigbee -> manejadores
+    COMMANDS = {
+        b'TEL': 'on_tel',
+        b'SENSOR': 'on_sensor',
+        b'REQ_REPORT': 'on_req_report',
+        b'METRICS': 'on_metrics',
+        b'LOGS': 'on_logs',
+        b'BATCAL': 'on_battery_cal',
+    }
 
     def __init__(self, xbee_instance=None):
         super().__init__(device_id="XBEE_CAM", wdt_timeout=120000, battery_pin='D1', battery_scaling_factor=2.9, pin_camera='D12', xbee_instance=xbee_instance)
-        self.coordinator_addr = COORDINATOR_64BIT_ADDR 
-        self.old_state = 0       
+        self.coordinator_addr = COORDINATOR_64BIT_ADDR
 
-    def check_and_process_incoming_messages(self):
-        """
-        Revisa si hay mensajes entrantes y los procesa.
-        Devuelve True si se procesó un comando, False en caso contrario.
-        """
-        self.feed_watchdog()
-        sender, payload = self.check_received_messages()
-        if not payload:
-            return False
-        
-        payload = payload.strip()
-        print("Mensaje recibido de {}: '{}'".format(sender, payload))
-        
-        command = payload
-        response_message = "{}:OK".format(command)
-        
-        if command == "TEL:ON":
-            print("Comando ON recibido. Encendiendo cámara indefinidamente.")
+    def on_tel(self, sender, payload, args):
+        """TEL:ON enciende la cámara indefinidamente; TEL:OFF la apaga."""
+        if args == b'ON':
+            self.log(eventlog.COMMAND, "TEL:ON")
             self.turn_on_camera()
             self.manual_camera = True  # Anula el temporizador
-            self.device_state = self.STATE_IDLE
-            self.safe_send(sender, response_message)
-            return True
-        
-        elif command == "TEL:OFF":
-            print("Comando OFF recibido. Apagando cámara.")
+        elif args == b'OFF':
+            self.log(eventlog.COMMAND, "TEL:OFF")
             self.turn_off_camera()
             self.manual_camera = False
-            self.device_state = self.STATE_IDLE
-            self.safe_send(sender, response_message)
-            return True
-        
-        
-        elif command == "REQ_REPORT":
-            print("Comando REPORT recibido.")
-            battery_status = self.get_battery_status(as_string=True)
-            report = "Estado: {}, Camara: {}, {}, Manual: {}".format(self.device_state, "ON" if self.pin_camera.value() else "OFF", battery_status, self.manual_camera)
-            self.safe_send(sender, "{}: {}".format(self.device_node_id, report))
-            if sender == self.coordinator_addr:
-                self.contador_fallo_comunicacion = 0
-            self.device_state = self.STATE_IDLE
-            return True
-            
-        elif command == "SENSOR:ON":
-            print("Comando SENSOR:ON recibido. Encendiendo cámara por temporizador.")
-            self.turn_on_camera()
-            self.camera_on_time = time.ticks_ms()
-            self.device_state = self.STATE_IDLE
-            self.safe_send(sender, response_message)
-            return True
-        
         else:
-            response_message = "UNKNOWN COMMAND RECEIVED"
-            self.safe_send(sender, response_message)
-            
-        return False
+            self.on_unknown_command(sender, payload)
+            return
+        self.device_state = self.STATE_IDLE
+        self.reply_ok(sender, payload)
+
+    def on_sensor(self, sender, payload, args):
+        """SENSOR:ON enciende la cámara durante CAMERA_ON_DURATION_MS."""
+        if args != b'ON':
+            self.on_unknown_command(sender, payload)
+            return
+        self.log(eventlog.COMMAND, "SENSOR:ON")
+        self.turn_on_camera()
+        self.camera_on_time = time.ticks_ms()
+        self.device_state = self.STATE_IDLE
+        self.reply_ok(sender, payload)
+
+    def on_req_report(self, sender, payload, args):
+        self.log(eventlog.COMMAND, "REQ_REPORT")
+        super().on_req_report(sender, payload, args)
+        self.device_state = self.STATE_IDLE
 
     def check_sensor_pins(self):
         self.feed_watchdog()
@@ -88,77 +73,34 @@ class Camara(XBeeDevice):
     
     def turn_on_camera(self):
         self.pin_camera.value(1)
-        print("Cámara encendida.")
+        self.log(eventlog.CAMERA_ON)
 
     def turn_off_camera(self):
         self.pin_camera.value(0)
-        print("Cámara apagada.")
+        self.log(eventlog.CAMERA_OFF)
     
-    def run(self):
-        self.setup()
-        self.device_state = self.STATE_STARTUP
-        while True:
-            self.feed_watchdog()
-            
-            try:
-                # --- Procesar mensajes entrantes (tiene prioridad) ---
-                if self.check_and_process_incoming_messages():
-                    continue  # Si se procesó un comando, reiniciar el bucle
-                
-                # --- Máquina de Estados ---
-                if self.device_state == self.STATE_STARTUP:
-                    print("--- Estado: STARTUP ---")
-                    self.feed_watchdog()
-                    battery_voltage = self.get_battery_status(as_string=False)
-                    message = "{}:{:.2f}:Dispositivo iniciado".format(self.device_node_id, battery_voltage)
-                    if self.safe_send_and_wait_ack(self.coordinator_addr, message):
-                        self.device_state = self.STATE_IDLE
-                    else:
-                        self.device_state = self.STATE_ERROR
-                
-                elif self.device_state == self.STATE_IDLE:
-                    if (self.old_state != self.device_state):
-                        print("--- Estado: SLEEP ---")
-                    self.feed_watchdog()
-                    idle_start = time.ticks_ms()
-                    while time.ticks_diff(time.ticks_ms(), idle_start) < self.SLEEP_DURATION_MS:
-                        self.feed_watchdog()
-                        if self.check_and_process_incoming_messages():
-                            time.sleep_ms(100)
-                            break
-                        # if self.pin_camera.value() == 1 and not self.manual_camera:
-                            # print("Tiempo restante para apagado: {} segundos.".format((self.CAMERA_ON_DURATION_MS - time.ticks_diff(time.ticks_ms(), self.camera_on_time)) // 1000))
-                            
-                        # --- Gestión de la cámara (se apaga por temporizador solo si no es manual) ---
-                        if self.pin_camera.value() == 1 and not self.manual_camera and time.ticks_diff(time.ticks_ms(), self.camera_on_time) > self.CAMERA_ON_DURATION_MS:
-                            self.turn_off_camera()
-                            print("Cámara apagada por temporizador.")
-                            self.device_state = self.STATE_IDLE
-                            time.sleep_ms(50)
-                
-                # elif self.device_state == self.STATE_SENSOR_TRIGGERED:
-                #     print("--- Estado: SENSOR_TRIGGERED ---")
-                #     self.feed_watchdog()
-                #     self.turn_on_camera()
-                #     self.camera_on_time = time.ticks_ms()
-                #     self.device_state = self.STATE_IDLE
-                
-                elif self.device_state == self.STATE_ERROR:
-                    print("--- Estado: ERROR ---")
-                    self.feed_watchdog()
-                    print("Intentando reiniciar en {} segundos...".format(self.STATE_ERROR_SLEEP_MS / 1000))
-                    time.sleep_ms(self.STATE_ERROR_SLEEP_MS)
-                    self.device_state = self.STATE_STARTUP
+    # --- Estados (run_machine) ---
+    def state_startup(self):
+        # Los mensajes entrantes tienen prioridad también durante el arranque
+        if self.check_and_process_incoming_messages():
+            return None
+        return super().state_startup()
+
+    def state_idle(self):
+        """Una vuelta de SLEEP_DURATION_MS: mensajes primero y después el temporizador de la cámara."""
+        if self.check_and_process_incoming_messages():
+            self.wait_rx(100)
+            return None
+        # --- Gestión de la cámara (se apaga por temporizador solo si no es manual) ---
+        if self.pin_camera.value() == 1 and not self.manual_camera and time.ticks_diff(time.ticks_ms(), self.camera_on_time) > self.CAMERA_ON_DURATION_MS:
+            self.turn_off_camera()
+            self.log(eventlog.CAMERA_TIMER_OFF)
+            time.sleep_ms(50)
+        # Con receive_callback se duerme hasta la siguiente trama o el fin del intervalo
+        if self.rx_queue is not None:
+            self.wait_rx(self.SLEEP_DURATION_MS)
+        return None
 
-                self.old_state = self.device_state
-                self.check_coordinator_retry() # Background check for coordinator retries
-                
-            except Exception as e:
-                self.feed_watchdog()
-                print("Error inesperado en el bucle principal: {}".format(e))
-                self.device_state = self.STATE_ERROR
-                time.sleep(10)
-    
 # --- Lógica Principal ---
 if __name__ == '__main__':
     camara = Camara(xbee_instance=xbee_device)
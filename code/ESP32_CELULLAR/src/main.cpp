@@ -17,6 +17,11 @@ const char* MQTT_CLIENT_ID = "ESP32_Client";
 // MQTT Topics
 const char* TOPIC_REPORTS = "xbee/reports";  // Publish reports here
 const char* TOPIC_COMMANDS = "esp32/commands";  // Subscribe for commands (optional)
+const char* TOPIC_STATUS = "xbee/status";  // Device ONLINE/OFFLINE events
+const char* TOPIC_STATS = "xbee/stats";  // Answers to STATS:<node>
+const char* TOPIC_MAILBOX = "xbee/mailbox";  // Delivery status of commands queued for sleeping devices
+const char* TOPIC_METRICS = "xbee/metrics";  // Network/protocol counters: METRICS:<node>:<dump>
+const char* TOPIC_LOGS = "xbee/logs";        // Event log chunks: LOGS:<node>:p<n>/<total>,<ticks>:<records>
 
 // TLS Certificates (replace with your actual certificates)
 const char* CA_CERT = R"EOF(
@@ -43,6 +48,7 @@ const char* CLIENT_KEY = R"EOF(
 
 // Buffer for incoming serial data
 String serialBuffer = "";
+bool skipDebugLine = false;
 unsigned long lastCommandTime = 0;
 
 // MQTT and WiFi clients
@@ -149,12 +155,51 @@ void handleXBeeMessage(String message) {
         // TODO: Send to cellular network if needed
       }
     }
+  } else if (msgType == "REPORTS") {
+    // Batched reports ("node:bat:data|node:bat:data|..."): one MQTT publish per batch
+    if (!mqttClient.publish(TOPIC_REPORTS, message.c_str())) {
+      Serial.println("Failed to publish report batch");
+    }
+  } else if (msgType == "ONLINE" || msgType == "OFFLINE") {
+    // Device liveness change detected by the coordinator
+    if (!mqttClient.publish(TOPIC_STATUS, message.c_str())) {
+      Serial.println("Failed to publish status");
+    }
+  } else if (msgType == "STATS") {
+    // Battery telemetry summary kept by the coordinator
+    if (!mqttClient.publish(TOPIC_STATS, message.c_str())) {
+      Serial.println("Failed to publish stats");
+    }
+  } else if (msgType == "MAILBOX") {
+    // MAILBOX:<node>:<command>:QUEUED|SENT|OK|EXPIRED|DROPPED
+    if (!mqttClient.publish(TOPIC_MAILBOX, message.c_str())) {
+      Serial.println("Failed to publish mailbox status");
+    }
+  } else if (msgType == "METRICS") {
+    // METRICS:<node>:rx=..,tx=..,...,rtt=c0/../cN
+    if (!mqttClient.publish(TOPIC_METRICS, message.c_str())) {
+      Serial.println("Failed to publish metrics");
+    }
+  } else if (msgType == "LOGS") {
+    // LOGS:<node>:p<n>/<total>,<ticks>:<ticks>,<code>,<a>,<b>;...
+    if (!mqttClient.publish(TOPIC_LOGS, message.c_str())) {
+      Serial.println("Failed to publish logs");
+    }
+  } else if (msgType == "LOGS_RESPONSE") {
+    Serial.print("Logs Response: ");
+    Serial.println(payload);
+  } else if (msgType == "METRICS_RESPONSE") {
+    Serial.print("Metrics Response: ");
+    Serial.println(payload);
   } else if (msgType == "REPORT_RESPONSE") {
     Serial.print("Report Response: ");
     Serial.println(payload);
   } else if (msgType == "CAMERA_RESPONSE") {
     Serial.print("Camera Response: ");
     Serial.println(payload);
+  } else if (msgType == "GROUP_RESPONSE") {
+    Serial.print("Group Response: ");
+    Serial.println(payload);
   } else if (msgType.startsWith("ERROR")) {
     Serial.print("Error from XBee: ");
     Serial.println(payload);
@@ -182,11 +227,19 @@ void loop() {
   mqttClient.loop();
   
   // Read incoming serial data from XBee
+  // Lines starting with '#' are coordinator debug output: dropped without buffering
   while (Serial.available()) {
     char c = Serial.read();
     if (c == '\n') {
-      handleXBeeMessage(serialBuffer);
+      if (!skipDebugLine) {
+        handleXBeeMessage(serialBuffer);
+      }
       serialBuffer = "";
+      skipDebugLine = false;
+    } else if (skipDebugLine) {
+      continue;
+    } else if (c == '#' && serialBuffer.length() == 0) {
+      skipDebugLine = true;
     } else {
       serialBuffer += c;
     }
@@ -4,7 +4,10 @@ from machine import Pin
 import machine
 import time
 import xbee
-from tools import XBeeDevice  # Assuming tools.py is in the parent directory; adjust if needed
+from tools import XBeeDevice, DELIVERY_RADIO, DELIVERY_NOACK  # Assuming tools.py is in the parent directory; adjust if needed
+from async_device import AsyncXBeeDevice, create_task, sleep_ms
+import metrics
+import eventlog
 
 
 xbee_device = xbee.XBee()
@@ -16,12 +19,20 @@ COORDINATOR_64BIT_ADDR = b'\x00\x13\xA2\x00\x42\x3D\x8B\x99'
 CAMERA_DEVICE_NODE_ID = "XBEE_CAMERA"
 CAMERA_64BIT_ADDR = b'\x00\x13\xA2\x00\x42\x3D\x8A\xAC'
 
-class Router(XBeeDevice):
-    # Sobrescribir constantes específicas del dispositivo
-    STATE_REPORT_BATTERY = 4
-    STATE_SENSOR_ACTIVE = 5
-    STATE_SENSOR_TRIGGERED = 6
-    STATE_ERROR = 7
+class Router(AsyncXBeeDevice, XBeeDevice):
+    # Router siempre despierto: sin buzón que recoger en el ACK. Los reportes periódicos son
+    # idempotentes (el siguiente sustituye al perdido) y SENSOR:ON basta con la confirmación de radio.
+    DELIVERY = dict(XBeeDevice.DELIVERY, REPORT=DELIVERY_NOACK, COMMAND=DELIVERY_RADIO)
+    RX_CALLBACK = True          # Siempre despierto: las tramas despiertan el bucle de espera
+    SENSOR_POLL_MS = 20         # Periodo de sensor_task (run_async)
+
+    # Comandos Zigbee -> manejadores
+    COMMANDS = {
+        b'REQ_REPORT': 'on_req_report',
+        b'METRICS': 'on_metrics',
+        b'LOGS': 'on_logs',
+        b'BATCAL': 'on_battery_cal',
+    }
 
     def __init__(self, xbee_instance=None, camera_remote=True, local_camera=False):
         super().__init__(device_id="XBEE_X", wdt_timeout=60000, battery_pin='D1', battery_scaling_factor=2.9, pin_camera='D12', xbee_instance=xbee_instance)
@@ -29,9 +40,9 @@ class Router(XBeeDevice):
         self.remote_camera_addr = CAMERA_64BIT_ADDR
         # Variables específicas del sensor remoto
         self.camera_remote = camera_remote                  # Usar cámara remota
-        self.last_sensor_notification_time = 0              # Tiempo de la última notificación de sensor
         self.local_camera = local_camera
         self.pin_sensor_5 = Pin('D8', Pin.IN, Pin.PULL_UP)
+        self.notifying = False                              # Hay una notificación SENSOR:ON en curso (run_async)
 
     def check_pins_sensor(self):
         self.feed_watchdog()
@@ -42,139 +53,59 @@ class Router(XBeeDevice):
 
     def turn_on_camera(self):
         self.pin_camera.value(1)
-        print("Cámara encendida.")
+        self.log(eventlog.CAMERA_ON)
 
     def turn_off_camera(self):
         self.pin_camera.value(0)
-        print("Cámara apagada.")       
+        self.log(eventlog.CAMERA_OFF)
     
-    def check_and_process_incoming_messages(self):
+    def on_req_report(self, sender, payload, args):
+        self.log(eventlog.COMMAND, "REQ_REPORT")
+        super().on_req_report(sender, payload, args)
+        self.device_state = self.STATE_IDLE
+
+    # --- Runtime asíncrono (run_async) ---
+    def tasks(self):
+        return super().tasks() + [self.sensor_task()]
+
+    async def sensor_task(self):
         """
-        Revisa si hay mensajes entrantes y los procesa.
-        Devuelve True si se procesó un comando, False en caso contrario.
+        Lee el sensor cada SENSOR_POLL_MS, también mientras otra tarea espera una confirmación.
+        Mientras siga activo repite la lógica de STATE_SENSOR_TRIGGERED en cada lectura: SENSOR:ON
+        cada DEBOUNCE_SENSOR_TIME_MS (si no hay otra notificación en curso) y renovación de la cámara local.
         """
-        self.feed_watchdog()
-        sender, payload = self.check_received_messages()
-        if not payload:
-            return False
-        
-        payload = payload.strip()
-        print("Mensaje recibido de {}: '{}'".format(sender, payload))
-        
-        command = payload
-        response_message = "{}:OK".format(command)
-        
-        if command == "REQ_REPORT":
-            print("Comando REPORT recibido.")
-            battery_status = self.get_battery_status(as_string=True)
-            report = "Estado: {}, Camara: {}, {}, Manual: {}".format(self.device_state, "ON" if self.pin_camera.value() else "OFF", battery_status, self.manual_camera)
-            self.safe_send(sender, "{}: {}".format(self.device_node_id, report))
-            if sender == self.coordinator_addr:
-                self.contador_fallo_comunicacion = 0
-            self.device_state = self.STATE_IDLE
-            return True
-
-        else:
-            response_message = "UNKNOWN COMMAND RECEIVED"
-            self.safe_send(sender, response_message)
-            
-        return False
-         
-    def run(self):
-        self.setup()
-        
+        active = False
         while True:
-            self.feed_watchdog()
-            try:
-                
-                # --- Máquina de Estados ---
-                if self.device_state == self.STATE_STARTUP:
-                    print("--- Estado: STARTUP ---")
-                    self.feed_watchdog()
-                    battery_voltage = self.get_battery_status(as_string=False)
-                    message = "{}:{:.2f}:Dispositivo iniciado.".format(self.device_node_id, battery_voltage)
-                    if self.safe_send_and_wait_ack(self.coordinator_addr, message):
-
-                        self.device_state = self.STATE_IDLE
-                    else:
-                        print("No se pudo contactar al coordinador en el arranque.")
-                        self.device_state = self.STATE_ERROR
-                
-                elif self.device_state == self.STATE_IDLE:
-                    print("--- Estado: IDLE --- ")
-                    while True:
-                        self.feed_watchdog()
-                        self.check_pins_sensor()
-                        if self.pin_sensor_general:
-                            self.device_state = self.STATE_SENSOR_TRIGGERED
-                            break
-                        
-                        if self.check_and_process_incoming_messages():
-                            continue  # Si se procesó un comando, reiniciar el bucle
-
-                        time.sleep_ms(self.SLEEP_DURATION_MS)  # Pequeña pausa para no saturar CPU
-
-                elif self.device_state == self.STATE_REPORT_BATTERY:
-                    print("--- Estado: REPORT_BATTERY ---")
-                    self.feed_watchdog()
-                    battery_voltage = self.get_battery_status(as_string=False)
-                    message = "{}:{:.2f}:Reporte periodico.".format(self.device_node_id, battery_voltage)
-                    if not self.safe_send_and_wait_ack(self.coordinator_addr, message):
-                        self.contador_fallo_comunicacion += 1
-                    else:
-                        self.contador_fallo_comunicacion = 0
-                        self.device_state = self.STATE_IDLE
-
-                elif self.device_state == self.STATE_SENSOR_TRIGGERED:
-                    print("--- Estado: SENSOR_TRIGGERED ---")
-                    self.feed_watchdog()
-                    self.check_pins_sensor()
-                    if self.pin_sensor_general == 1:
-                        current_time = time.ticks_ms()
-                        # Comprobar si ha pasado suficiente tiempo desde la última notificación para no saturar la red a mensajes
-                        if self.camera_remote:
-                            if time.ticks_diff(current_time, self.last_sensor_notification_time) >= self.DEBOUNCE_SENSOR_TIME_MS:  
-                                command_to_send = "SENSOR:ON"
-                                print("Enviando notificación de sensor activado")
-                                if self.safe_send_and_wait_ack(self.remote_camera_addr, command_to_send):
-                                    self.last_sensor_notification_time = current_time
-                                else:
-                                    self.contador_fallo_comunicacion += 1
-                            else:
-                                print("Esperando para reenviar notificación de sensor: {} segundos restantes".format((self.DEBOUNCE_SENSOR_TIME_MS - time.ticks_diff(current_time, self.last_sensor_notification_time) )//1000))
-                                    
-                        if self.local_camera:
-                            if time.ticks_diff(current_time, self.camera_on_time) >= self.CAMERA_ON_DURATION_MS:
-                                self.turn_on_camera()  # Activar cámara localmente
-                                self.camera_on_time = current_time
-
-                        time.sleep_ms(self.CHECK_SENSOR_INTERVAL_MS)  # Esperar antes de verificar de nuevo
-                    else:
-                        if self.local_camera and self.pin_camera.value() == 1:
-                            self.turn_off_camera()
-                            
-                        # El sensor ya no está activado, volver a dormir
-                        print("Sensor ya no activado, volviendo a modo SLEEP/IDLE")
-                        self.device_state = self.STATE_IDLE
-                
-                elif self.device_state == self.STATE_ERROR:
-                    print("--- Estado: ERROR ---")
-                    self.feed_watchdog()
-                    print("Intentando reconectar en {} segundos...".format(self.STATE_ERROR_SLEEP_MS / 1000))
-                    time.sleep_ms(self.STATE_ERROR_SLEEP_MS)
-                    self.setup()
-                    self.feed_watchdog()
-                    self.device_state = self.STATE_STARTUP
-                    
-                self.check_coordinator_retry() # Background check for coordinator retries
-                
-            except Exception as e:
-                self.feed_watchdog()
-                print("Error inesperado en el bucle principal: {}".format(e))
-                self.device_state = self.STATE_ERROR
-                time.sleep_ms(self.STATE_ERROR_SLEEP_MS)
+            self.check_pins_sensor()
+            now = time.ticks_ms()
+            if self.pin_sensor_general:
+                if not active:
+                    self.metrics.inc(metrics.SENSOR_EDGES)
+                if (self.camera_remote and not self.notifying and
+                        time.ticks_diff(now, self.last_sensor_notification_time) >= self.DEBOUNCE_SENSOR_TIME_MS):
+                    self.log(eventlog.SENSOR_NOTIFY)
+                    self.notifying = True
+                    create_task(self.notify_camera_async(now))
+                if self.local_camera and time.ticks_diff(now, self.camera_on_time) >= self.CAMERA_ON_DURATION_MS:
+                    self.turn_on_camera()
+                    self.camera_on_time = now
+            elif active:
+                if self.local_camera and self.pin_camera.value() == 1:
+                    self.turn_off_camera()
+                self.log(eventlog.SENSOR_CLEARED)
+            active = self.pin_sensor_general
+            await sleep_ms(self.SENSOR_POLL_MS)
+
+    async def notify_camera_async(self, now):
+        try:
+            if await self.send_as_async('COMMAND', self.remote_camera_addr, "SENSOR:ON"):
+                self.last_sensor_notification_time = now
+            else:
+                self.contador_fallo_comunicacion += 1
+        finally:
+            self.notifying = False
 
 # --- Lógica Principal ---
 if __name__ == '__main__':
     end_device = Router(xbee_instance=xbee_device, camera_remote=True, local_camera=False)
-    end_device.run()
\ No newline at end of file
+    end_device.run_async()
\ No newline at end of file
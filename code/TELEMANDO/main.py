@@ -3,8 +3,8 @@ import sys
 from machine import Pin
 import machine
 import time
-import xbee
-from ..tools import XBeeDevice  # Assuming tools.py is in the parent directory; adjust if needed
+from ..tools import XBeeDevice, MSG_HELLO, DELIVERY_RADIO  # Assuming tools.py is in the parent directory; adjust if needed
+import eventlog
 
 # --- Configuración ---
 # Objetivo para reportes periódicos y de estado
@@ -16,7 +16,18 @@ CAMERA_DEVICE_NODE_ID = "XBEE_CAM"  # Reemplaza con el NI del dispositivo cámar
 CAMERA_DEVICE_64BIT_ADDR = b'\x00\x13\xA2\x00\x42\x3D\x8A\xAC'  # Reemplaza con la dirección del dispositivo cámara
 
 class Telemando(XBeeDevice):
-    STATE_SEND_COMMAND = 4  # Nuevo estado para enviar comandos
+    # TEL:ON/OFF solo necesita saber que la cámara recibió la trama; REPORT espera datos
+    DELIVERY = dict(XBeeDevice.DELIVERY, COMMAND=DELIVERY_RADIO)
+    RX_CALLBACK = True          # La respuesta a REPORT despierta la espera sin esperar al siguiente sondeo
+
+    # Comandos Zigbee -> manejadores
+    COMMANDS = {
+        b'REPORT': 'on_report',
+        b'METRICS': 'on_metrics',
+        b'LOGS': 'on_logs',
+        b'BATCAL': 'on_battery_cal',
+    }
+
     def __init__(self):
         super().__init__(device_id="XBEE_TELEMANDO", battery_pin='D1', battery_scaling_factor=2.9, wdt_timeout=60000, pin_camera='D12')
         self.coordinator_addr = COORDINATOR_64BIT_ADDR
@@ -33,28 +44,15 @@ class Telemando(XBeeDevice):
         self.command_to_send = ""
         self.last_command = 0
 
-    def check_and_process_incoming_messages(self):
-        """
-        Procesa los mensajes entrantes y responde cuando sea necesario.
-        """
-        self.feed_watchdog()
-        sender, payload = self.check_received_messages()
-        if not payload:
-            return False
-        
-        payload = payload.strip()
-        
-        print("Mensaje recibido: '{}' de {}".format(payload, [hex(b) for b in sender]))
-        
-        if payload == "REPORT":
-            print("Solicitud de reporte recibida, enviando respuesta...")
-            battery_voltage = self.get_battery_status(as_string=False)
-            status_data = "Contador={}".format(self.contador_fallo_comunicacion)
-            response = "{}:{:.2f}:{}".format(self.device_node_id, battery_voltage, status_data)
-            self.safe_send(sender, response)
-            return True
-        
-        return False
+    def on_report(self, sender, payload, args):
+        """REPORT: responde con un reporte propio (contador de fallos de comunicación)."""
+        self.log(eventlog.COMMAND, "REPORT")
+        if self.BINARY_REPORTS:
+            response = self.build_report("Contador={}".format(self.contador_fallo_comunicacion), writer=self.reply_writer)
+        else:
+            w = self.build_report(b"Contador=", writer=self.reply_writer)
+            response = w.put_int(self.contador_fallo_comunicacion).view()
+        self.safe_send(sender, response)
 
     def run(self):
         self.setup()
@@ -64,18 +62,17 @@ class Telemando(XBeeDevice):
             try:
                 # --- Máquina de Estados ---
                 if self.device_state == self.STATE_STARTUP:
-                    print("--- Estado: STARTUP ---")
+                    self.log(eventlog.STATE, self.STATE_NAMES[self.STATE_STARTUP])
                     self.feed_watchdog()
-                    battery_voltage = self.get_battery_status(as_string=False)
-                    message = "{}:{:.2f}:Dispositivo iniciado.".format(self.device_node_id, battery_voltage)
-                    if self.safe_send_and_wait_ack(self.coordinator_addr, message):
+                    message = self.build_report(b"Dispositivo iniciado.", MSG_HELLO)
+                    if self.send_as('HELLO', self.coordinator_addr, message):
                         self.device_state = self.STATE_IDLE
                     else:
-                        print("No se pudo contactar al coordinador en el arranque.")
+                        self.log(eventlog.STARTUP_FAILED)
                         self.device_state = self.STATE_ERROR
                 
                 elif self.device_state == self.STATE_IDLE:
-                    print("--- Estado: SLEEP ---")
+                    self.log(eventlog.STATE, self.STATE_NAMES[self.STATE_IDLE])
                     self.feed_watchdog()
                     while True:
                         self.feed_watchdog()
@@ -86,19 +83,19 @@ class Telemando(XBeeDevice):
                         # Comprobar si ha pasado el tiempo de debounce
                         if time.ticks_diff(current_time, self.last_press_time) > 1000:
                             if self.pin_cmd_on.value() == 0 and self.last_command != 1:
-                                print("Boton ON presionado.")
+                                self.log(eventlog.BUTTON, "ON")
                                 self.command_to_send = "TEL:ON"
                                 self.device_state = self.STATE_SEND_COMMAND
                                 self.last_command = 1
                                 break
                             elif self.pin_cmd_off.value() == 0 and self.last_command != 2:
-                                print("Boton OFF presionado.")
+                                self.log(eventlog.BUTTON, "OFF")
                                 self.command_to_send = "TEL:OFF"
                                 self.device_state = self.STATE_SEND_COMMAND
                                 self.last_command = 2
                                 break
                             elif self.pin_report_req.value() == 0 and self.last_command != 3:
-                                print("Boton REPORTE presionado.")
+                                self.log(eventlog.BUTTON, "REPORTE")
                                 self.command_to_send = "REPORT"
                                 self.device_state = self.STATE_SEND_COMMAND
                                 self.last_command = 3
@@ -107,25 +104,26 @@ class Telemando(XBeeDevice):
                         if self.check_and_process_incoming_messages():
                             continue  # Si se procesó un comando, reiniciar el bucle
                         
-                        time.sleep_ms(self.SLEEP_DURATION_MS)  # Pequeña pausa para no saturar CPU
+                        self.wait_rx(self.SLEEP_DURATION_MS)  # Pequeña pausa para no saturar CPU (vuelve antes si llega una trama)
                 
                 elif self.device_state == self.STATE_SEND_COMMAND:
-                    print("--- Estado: SEND_COMMAND ---")
+                    self.log(eventlog.STATE, self.STATE_NAMES[self.STATE_SEND_COMMAND])
                     self.feed_watchdog()
                     self.last_press_time = time.ticks_ms()
                     message = self.command_to_send
-                    if not self.safe_send_and_wait_ack(self.camera_addr, message):
+                    kind = 'REQUEST' if message == "REPORT" else 'COMMAND'
+                    if not self.send_as(kind, self.camera_addr, message):
                         self.contador_fallo_comunicacion += 1
-                        print("Fallo al notificar al dispositivo cámara. Contador de fallos: {}".format(self.contador_fallo_comunicacion))
+                        self.log(eventlog.CAMERA_NOTIFY_FAILED, self.contador_fallo_comunicacion)
                     else:
                         self.contador_fallo_comunicacion = 0
                     self.device_state = self.STATE_IDLE
                     self.command_to_send = ""
                 
                 elif self.device_state == self.STATE_ERROR:
-                    print("--- Estado: ERROR ---")
+                    self.log(eventlog.STATE, self.STATE_NAMES[self.STATE_ERROR])
                     self.feed_watchdog()
-                    print("Intentando reiniciar en {} segundos...".format(self.STATE_ERROR_SLEEP_MS / 1000))
+                    self.log(eventlog.RECONNECT, self.STATE_ERROR_SLEEP_MS)
                     time.sleep_ms(self.STATE_ERROR_SLEEP_MS)
                     self.device_state = self.STATE_STARTUP
                 
@@ -133,7 +131,7 @@ class Telemando(XBeeDevice):
                 
             except Exception as e:
                 self.feed_watchdog()
-                print("Error inesperado en el bucle principal: {}".format(e))
+                self.log(eventlog.LOOP_ERROR, e)
                 self.device_state = self.STATE_ERROR
                 time.sleep(10)
 
@@ -1,6 +1,8 @@
 from machine import Pin, WDT, ADC, I2C
 import time
 import xbee
+from at_cache import ATCache
+from battery import BatteryService, battery_field, format_mv
 # Import SSD1306 directly
 from ssd1306 import SSD1306_I2C
 from sys import stdin, stdout
@@ -31,9 +33,6 @@ bOK = Pin('D9', Pin.IN, Pin.PULL_UP)
 bDN = Pin('D7', Pin.IN, Pin.PULL_UP)
 bat = ADC('D0')
 
-# ADC reference voltage
-AV_VALUES = {0: 1.25, 1: 2.5, 2: 3.3, None: 2.5}
-
 # --- Estados ---
 S_INIT = 0
 S_IDLE = 1
@@ -49,40 +48,19 @@ cmd = ""
 msg = ""
 last_act = 0
 uart = None  # Para comandos seriales
+at = ATCache()  # AV/NI cacheados; AI se invalida con los eventos de modem status
+battery = BatteryService(bat, at)
 
 # --- Funciones ---
 def bat_st(as_string=True):
     """
-    Lee el voltaje de la batería.
+    Batería medida por BatteryService (mediana, aritmética entera y caché).
     Si as_string es True, devuelve un texto formateado.
     Si as_string es False, devuelve solo el valor numérico del voltaje.
     """
-    try:
-        
-        # Obtener el voltaje de referencia configurado en el módulo.
-        try:
-            av = xbee.atcmd("AV")
-        except KeyError:
-            av = None # Por defecto para algunos módulos como el Cellular.
-        reference_v = AV_VALUES[av]
-
-        # Leer el valor crudo del ADC (0-4095).
-        adc_raw_value = bat.read()
-        
-        # Calcular el voltaje en el pin.
-        pin_voltage = (adc_raw_value / 4095.0) * reference_v
-        
-        # Aplicar el factor de escala del divisor de voltaje (12V / 3.3V).
-        battery_voltage = pin_voltage * (12.0 / 3.3) * 2.9 # Factor de corrección para divisor 12k+3.3k
-        
-        if as_string:
-            # Formatear el resultado a dos decimales.
-            return "Bateria: {:.2f}V".format(battery_voltage)
-        else:
-            return battery_voltage
-    except Exception as e:
-        print("Error al leer la bateria: {}".format(e))
-        return "Bateria: ERROR" if as_string else 0.0
+    if as_string:
+        return "Bateria: {}V".format(format_mv(battery.read()))
+    return battery.read() / 1000
 
 def update_device(device_name):
     """Update current device and its address"""
@@ -92,7 +70,7 @@ def update_device(device_name):
 
 def net_ok():
     try:
-        ai = xbee.atcmd("AI")
+        ai = at.get("AI")
         return ai == 0
     except Exception as e:
         return False
@@ -167,7 +145,7 @@ def main():
         # Init HW
         w = WDT(timeout=T_WDT)
         w.feed()
-        did = xbee.atcmd('NI') or DID
+        did = at.get('NI') or DID
         
         # Initialize I2C with explicit pins and frequency
         i2c = I2C(1, freq=400000)  # Use 400kHz standard frequency
@@ -238,7 +216,7 @@ def main():
                     lcd.text("RED OK", 30, 16)
                     lcd.show()
                     time.sleep_ms(500)
-                    send(C_ADDR, did+":"+str(int(bat_st(False)))+":INICIO", False)
+                    send(C_ADDR, did+":"+battery_field(battery.read(), battery.soc)+":INICIO", False)
                 else:
                     lcd.fill(0)
                     lcd.text("RED ERROR", 30, 16)
@@ -319,7 +297,7 @@ def main():
                 
             elif state == S_REP:
                 w.feed()
-                message = "{}:{:.1f}:REPORTE".format(did, bat_st(False))
+                message = "{}:{}:REPORTE".format(did, battery_field(battery.read(), battery.soc))
                 
                 if menu_handler.mact:
                     menu_handler.msg = "REPORTE"
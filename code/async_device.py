@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+import time
+import xbee
+import metrics
+import eventlog
+from tools import MSG_HELLO, DELIVERY_APP, DELIVERY_RADIO, DELIVERY_NOACK, FRAME_MARKER, FRAME_HEADER_LEN, FLAG_NO_REPLY, TX_OPT_DISABLE_ACK, TEXT_MESSAGES, MessageWriter, is_reply
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    asyncio = None
+
+
+class _Sleep:
+    """Espera de sleep_ms() para el planificador mínimo: entrega los ms al bucle."""
+
+    def __init__(self, ms):
+        self.ms = ms
+
+    def __iter__(self):
+        yield self.ms
+
+    __await__ = __iter__
+
+
+class MiniLoop:
+    """
+    Planificador cooperativo mínimo para firmwares sin uasyncio (el XBee3 no lo incluye).
+    Solo implementa lo que usa AsyncXBeeDevice: create_task, sleep_ms y run. Cada tarea
+    cede el control con 'await sleep_ms(ms)'; la que antes vence es la siguiente en correr.
+    Una tarea que lanza una excepción se descarta (como en uasyncio) tras pasarla a on_error.
+    """
+
+    def __init__(self, on_error=None):
+        self.tasks = []              # [instante en ticks_ms, corrutina]
+        self.on_error = on_error     # on_error(excepción); sin él, la excepción se propaga
+
+    def create_task(self, coro):
+        self.tasks.append([time.ticks_ms(), coro])
+        return coro
+
+    def run(self, coro):
+        self.create_task(coro)
+        tasks = self.tasks
+        while tasks:
+            now = time.ticks_ms()
+            task = tasks[0]
+            for other in tasks:
+                if time.ticks_diff(other[0], task[0]) < 0:
+                    task = other
+            wait = time.ticks_diff(task[0], now)
+            if wait > 0:
+                time.sleep_ms(wait)
+            try:
+                ms = task[1].send(None)
+            except StopIteration:
+                tasks.remove(task)
+                continue
+            except Exception as e:
+                tasks.remove(task)
+                if self.on_error is None:
+                    raise
+                self.on_error(e)
+                continue
+            task[0] = time.ticks_add(time.ticks_ms(), ms or 0)
+
+
+_loop = None
+
+
+def sleep_ms(ms):
+    """asyncio.sleep_ms con uasyncio; si no, la espera del planificador mínimo."""
+    if asyncio:
+        return asyncio.sleep_ms(ms)
+    return _Sleep(ms)
+
+
+def create_task(coro):
+    if asyncio:
+        return asyncio.create_task(coro)
+    return _loop.create_task(coro)
+
+
+def run(coro, on_error=None):
+    """
+    Ejecuta 'coro' (y las tareas que cree) con uasyncio o con MiniLoop.
+    on_error(excepción) recibe los fallos de las tareas en lugar de imprimirlos.
+    """
+    global _loop
+    if asyncio:
+        if on_error:
+            asyncio.get_event_loop().set_exception_handler(lambda loop, context: on_error(context["exception"]))
+        return asyncio.run(coro)
+    _loop = MiniLoop(on_error)
+    return _loop.run(coro)
+
+
+class AsyncXBeeDevice:
+    """
+    Mixin con un runtime cooperativo para los perfiles: class Router(AsyncXBeeDevice, XBeeDevice).
+    run_async() sustituye al bucle bloqueante de run() por tareas independientes:
+      - rx_task: recibe todas las tramas; las respuestas esperadas van a quien las espera
+        y el resto se despacha por COMMANDS, también durante un envío pendiente.
+      - watchdog_task y coordinator_retry_task.
+      - las que añada el perfil en tasks() (sensores, temporizador de cámara...).
+    Los perfiles pueden adoptarlo poco a poco: run() sigue disponible y los manejadores de
+    COMMANDS son los mismos. Los envíos desde las tareas usan las versiones *_async.
+    """
+    ASYNC_POLL_MS = 10                                  # Periodo de rx_task y de las esperas de respuesta
+    WATCHDOG_FEED_MS = 1000                             # Periodo de watchdog_task
+    COORDINATOR_RETRY_CHECK_MS = 1000                   # Periodo de coordinator_retry_task (el backoff empieza en segundos)
+
+    def run_async(self):
+        """Punto de entrada alternativo a run()."""
+        run(self.main_async(), lambda e: self.log(eventlog.TASK_ERROR, e))
+
+    async def main_async(self):
+        self.setup()
+        self.reply_waiters = {}                      # destino -> trama de respuesta (None mientras se espera)
+        self.busy_targets = set()                    # Destinos con un send_as_async en curso
+        self.async_running = True
+        for coro in self.tasks():
+            create_task(coro)
+        while True:
+            if self.device_state != self.STATE_IDLE:
+                await self.startup_async()
+            await sleep_ms(self.STATE_ERROR_SLEEP_MS)
+
+    def tasks(self):
+        """Tareas del perfil. Las subclases añaden las suyas a esta lista."""
+        return [self.rx_task(), self.watchdog_task(), self.coordinator_retry_task()]
+
+    async def startup_async(self):
+        """HELLO al coordinador; sin respuesta queda en STATE_ERROR y se reintenta más tarde."""
+        message = self.build_report(b"Dispositivo iniciado.", MSG_HELLO)
+        if await self.send_as_async('HELLO', self.coordinator_addr, message):
+            self.device_state = self.STATE_IDLE
+        else:
+            self.log(eventlog.STARTUP_FAILED)
+            self.device_state = self.STATE_ERROR
+
+    # --- Tareas comunes ---
+    async def rx_task(self):
+        while True:
+            try:
+                frame = self.receive_frame()
+            except Exception as e:
+                self.log(eventlog.RX_ERROR, e)
+                frame = None
+            if frame is None:
+                await sleep_ms(self.ASYNC_POLL_MS)
+                continue
+            sender = frame['sender_eui64']
+            if sender in self.reply_waiters and self.reply_waiters[sender] is None and is_reply(frame['payload']):
+                self.reply_waiters[sender] = frame
+            else:
+                try:
+                    self.dispatch_command(sender, frame['payload'])
+                except Exception as e:
+                    self.log(eventlog.COMMAND_ERROR, e)
+            await sleep_ms(0)
+
+    async def watchdog_task(self):
+        while True:
+            self.feed_watchdog()
+            await sleep_ms(self.WATCHDOG_FEED_MS)
+
+    async def coordinator_retry_task(self):
+        """Versión cooperativa de check_coordinator_retry."""
+        while True:
+            await sleep_ms(self.COORDINATOR_RETRY_CHECK_MS)
+            if not self.coordinator_retry_active:
+                continue
+            now = time.ticks_ms()
+            if time.ticks_diff(now, self.last_coordinator_retry_time) < self.coordinator_retry_delay_ms:
+                continue
+            self.log(eventlog.COORD_RETRY)
+            if len(self.outbox):
+                delivered = await self.flush_outbox_async()
+            else:
+                message = self.build_report(b"Reporte de reintento.")
+                delivered = await self.send_as_async('BATCH', self.coordinator_addr, message)
+            if not delivered and self.coordinator_retry_active:
+                self.schedule_coordinator_retry()
+                self.log(eventlog.COORD_RETRY_FAILED, self.coordinator_retry_delay_ms)
+
+    async def flush_outbox_async(self):
+        """Versión cooperativa de flush_outbox."""
+        if self.outbox_flushing or not len(self.outbox):
+            return not len(self.outbox)
+        self.outbox_flushing = True
+        try:
+            while len(self.outbox):
+                message, count = self.build_batch()
+                if not await self.send_as_async('BATCH', self.coordinator_addr, message):
+                    return False
+                self.outbox.remove(count)
+                self.log(eventlog.OUTBOX_FLUSHED, count, len(self.outbox))
+            return True
+        finally:
+            self.outbox_flushing = False
+
+    # --- Envío ---
+    def safe_send(self, target_addr, message, retries=3):
+        """
+        Con run_async, los envíos sin ACK (respuestas de los manejadores de COMMANDS) se hacen
+        en una tarea: sus reintentos no detienen la recepción ni la vigilancia de sensores.
+        Devuelve True en cuanto el envío queda en marcha.
+        """
+        if not getattr(self, 'async_running', False):
+            return super().safe_send(target_addr, message, retries)
+        if target_addr == self.reply_target:
+            self.dup_filter.set_reply(target_addr, message)
+        if isinstance(message, memoryview):
+            message = bytes(message)    # La tarea transmite más tarde: reply_writer ya se habrá reutilizado
+        create_task(self.safe_send_async(target_addr, message, retries))
+        return True
+
+    async def safe_send_async(self, target_addr, message, retries=3):
+        for attempt in range(retries):
+            try:
+                self.metrics.inc(metrics.TX_FRAMES)
+                xbee.transmit(target_addr, message)
+                return True
+            except Exception as e:
+                self.metrics.inc(metrics.TX_ERRORS)
+                self.log(eventlog.TX_ERROR, e)
+                if attempt < retries - 1:
+                    await sleep_ms(self.retry_delay(attempt + 1))
+        return False
+
+    async def wait_reply(self, target_addr, timeout_ms):
+        """Espera hasta timeout_ms la siguiente trama de 'target_addr' (la entrega rx_task)."""
+        waiters = self.reply_waiters
+        waiters[target_addr] = None
+        start = time.ticks_ms()
+        try:
+            while waiters[target_addr] is None and time.ticks_diff(time.ticks_ms(), start) < timeout_ms:
+                await sleep_ms(self.ASYNC_POLL_MS)
+            return waiters[target_addr]
+        finally:
+            waiters.pop(target_addr, None)
+
+    async def send_as_async(self, kind, target_addr, message):
+        """
+        Como send_as, sin bloquear las demás tareas mientras se espera.
+        Los envíos a un mismo destino van de uno en uno (HELLO y un reintento al coordinador,
+        p. ej.): wait_reply tiene un único hueco por destino. El mensaje se copia antes de
+        ceder el control, porque otra tarea puede reescribir tx_writer mientras tanto.
+        """
+        mode = self.DELIVERY.get(kind, DELIVERY_APP)
+        if isinstance(message, MessageWriter):
+            message = bytes(self.add_sequence(target_addr, message, mode == DELIVERY_APP))
+        elif isinstance(message, memoryview):
+            message = bytes(message)
+        busy = self.busy_targets
+        while target_addr in busy:
+            await sleep_ms(self.ASYNC_POLL_MS)
+        busy.add(target_addr)
+        try:
+            if mode == DELIVERY_APP:
+                delivered = await self.send_and_wait_ack_async(target_addr, message)
+            else:
+                delivered = await self.send_confirmed_async(target_addr, message, mode == DELIVERY_RADIO)
+        finally:
+            busy.discard(target_addr)
+        if delivered and mode != DELIVERY_NOACK and target_addr == self.coordinator_addr:
+            self.coordinator_reachable()
+            await self.flush_outbox_async()
+        return delivered
+
+    async def send_and_wait_ack_async(self, target_addr, message, retries=3):
+        """Versión cooperativa de safe_send_and_wait_ack (mismos plazos, backoff y métricas)."""
+        if isinstance(message, TEXT_MESSAGES):
+            message = self.add_sequence(target_addr, message)
+        for attempt in range(retries):
+            try:
+                if attempt:
+                    self.metrics.inc(metrics.RETRIES)
+                self.metrics.inc(metrics.TX_FRAMES)
+                self.log(eventlog.TX_ACK, attempt + 1, len(message))
+                xbee.transmit(target_addr, message)
+                start_wait = time.ticks_ms()
+                frame = await self.wait_reply(target_addr, self.rtt.timeout(target_addr))
+                if not frame:
+                    self.metrics.inc(metrics.ACK_TIMEOUTS)
+                    self.rtt.on_timeout(target_addr)
+                    if attempt < retries - 1:
+                        frame = await self.wait_reply(target_addr, self.retry_delay(attempt + 1))
+                if frame:
+                    rtt_ms = time.ticks_diff(time.ticks_ms(), start_wait)
+                    self.metrics.observe_rtt(rtt_ms)
+                    if not attempt:
+                        self.rtt.sample(target_addr, rtt_ms)
+                    payload = frame['payload']
+                    if payload[:3] == b'OK|':
+                        for command in payload[3:].split(b'|'):
+                            self.dispatch_command(target_addr, command)
+                    return True
+            except Exception as e:
+                self.metrics.inc(metrics.TX_ERRORS)
+                self.log(eventlog.TX_ERROR, e)
+                if attempt < retries - 1:
+                    await sleep_ms(self.retry_delay(attempt + 1))
+        self.on_send_failed(target_addr)
+        return False
+
+    async def send_confirmed_async(self, target_addr, message, acked=True, retries=3):
+        """
+        Versión cooperativa de send_confirmed. xbee.transmit sigue bloqueando hasta el estado
+        de la radio, pero las esperas entre reintentos ceden el control a las demás tareas.
+        """
+        if isinstance(message, TEXT_MESSAGES):
+            message = self.add_sequence(target_addr, message, reply=False)
+        elif message and message[0] & 0xF0 == FRAME_MARKER and len(message) >= FRAME_HEADER_LEN:
+            if not isinstance(message, memoryview):
+                message = bytearray(message)
+            message[6] |= FLAG_NO_REPLY
+        options = 0 if acked else TX_OPT_DISABLE_ACK
+        attempts = retries if acked else 1
+        for attempt in range(attempts):
+            try:
+                if attempt:
+                    self.metrics.inc(metrics.RETRIES)
+                self.metrics.inc(metrics.TX_FRAMES)
+                xbee.transmit(target_addr, message, tx_options=options)
+                return True
+            except Exception as e:
+                self.metrics.inc(metrics.TX_ERRORS)
+                self.log(eventlog.RADIO_NACK, e)
+                if attempt < attempts - 1:
+                    await sleep_ms(self.retry_delay(attempt + 1))
+        self.on_send_failed(target_addr)
+        return False
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import time
+import xbee
+
+TTL_FOREVER = -1            # Válido hasta que se cambie con set() o se invalide
+TTL_NONE = 0                # Sin caché: siempre se consulta al módulo
+
+# El firmware solo guarda un callback de modem status: se registra una vez para todas las cachés
+_watchers = []              # Cachés que invalidan AI con cada evento
+_watching = None            # None: sin registrar todavía; False: el registro falló
+
+
+def _on_modem_status(status):
+    for cache in _watchers:
+        cache.on_modem_status(status)
+
+
+def _watch(cache):
+    """Añade 'cache' al callback compartido (lo registra la primera vez). False si no es posible."""
+    global _watching
+    if _watching is None:
+        try:
+            xbee.modem_status.callback(_on_modem_status)
+            _watching = True
+        except Exception:
+            _watching = False
+    if _watching and cache not in _watchers:
+        _watchers.append(cache)
+    return _watching
+
+
+class ATCache:
+    """
+    Acceso cacheado a los comandos AT. Cada atcmd() pasa por el firmware de la radio
+    y es mucho más lento que leer un diccionario, así que cada parámetro se guarda con
+    su propio TTL y se invalida explícitamente cuando cambia.
+    - AV, NI y las direcciones no cambian salvo que se escriban con set().
+    - AI se invalida con cada evento de modem status; si no se puede registrar el
+      callback, caduca tras AI_FALLBACK_TTL_MS.
+    Los comandos que el módulo no soporta (KeyError, p. ej. AV en Cellular) se cachean como None.
+    """
+    AI_FALLBACK_TTL_MS = 5000
+    DEFAULT_TTLS = {
+        'AV': TTL_FOREVER,
+        'NI': TTL_FOREVER,
+        'SH': TTL_FOREVER,
+        'SL': TTL_FOREVER,
+        'AI': TTL_FOREVER,
+    }
+
+    def __init__(self, radio=None, ttls=None, watch_modem_status=True):
+        self.radio = radio or xbee
+        self.ttls = dict(self.DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.values = {}     # comando -> valor
+        self.stamps = {}     # comando -> ticks_ms de la lectura
+        self.hits = 0
+        self.misses = 0
+        if watch_modem_status and not self.watch_modem_status():
+            self.ttls['AI'] = self.AI_FALLBACK_TTL_MS
+
+    def watch_modem_status(self):
+        """Recibe los eventos de modem status en on_modem_status. Devuelve False si no es posible."""
+        return _watch(self)
+
+    def on_modem_status(self, status):
+        """Cualquier cambio de estado de la red (asociación, pérdida de coordinador...) invalida AI."""
+        self.invalidate('AI')
+
+    def get(self, cmd):
+        """Valor del parámetro 'cmd', desde la caché si sigue vigente."""
+        ttl = self.ttls.get(cmd, TTL_NONE)
+        if cmd in self.values and (ttl == TTL_FOREVER or
+                                   (ttl and time.ticks_diff(time.ticks_ms(), self.stamps[cmd]) < ttl)):
+            self.hits += 1
+            return self.values[cmd]
+        self.misses += 1
+        try:
+            value = self.radio.atcmd(cmd)
+        except KeyError:
+            value = None
+        if ttl != TTL_NONE:
+            self.values[cmd] = value
+            self.stamps[cmd] = time.ticks_ms()
+        return value
+
+    def set(self, cmd, value):
+        """Escribe el parámetro en el módulo y actualiza la caché."""
+        self.radio.atcmd(cmd, value)
+        self.invalidate(cmd)
+        if self.ttls.get(cmd, TTL_NONE) != TTL_NONE:
+            self.values[cmd] = value
+            self.stamps[cmd] = time.ticks_ms()
+
+    def invalidate(self, cmd=None):
+        """Descarta un parámetro (o toda la caché si cmd es None)."""
+        if cmd is None:
+            self.values.clear()
+            self.stamps.clear()
+        else:
+            self.values.pop(cmd, None)
+            self.stamps.pop(cmd, None)
+
+    def stats(self):
+        return "hits={},misses={}".format(self.hits, self.misses)
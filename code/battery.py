@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import time
+from array import array
+
+# Referencia del ADC en mV según el parámetro AV (None: módulos sin AV, como el Cellular)
+AV_REFERENCE_MV = {0: 1250, 1: 2500, 2: 3300, None: 2500}
+ADC_FULL_SCALE = 4095
+DIVIDER_RATIO = 12.0 / 3.3                  # Divisor de tensión 12k + 3.3k
+GAIN_SCALE = 1000                           # La ganancia se guarda en milésimas (10545 = x10.545)
+GAIN_MAX = 30000                            # Tope para que pin_dmv * ganancia quepa en un entero pequeño
+CAL_FILE = 'battery.cal'                    # Calibración del nodo en flash: "ganancia offset_mv"
+
+# Curva de descarga de una batería de plomo 12 V en reposo: (mV, %) de mayor a menor tensión
+SOC_CURVE = ((12730, 100), (12620, 90), (12500, 80), (12370, 70), (12240, 60), (12100, 50),
+             (11960, 40), (11810, 30), (11660, 20), (11510, 10), (10500, 0))
+SOC_UNKNOWN = 0xFF                          # Estado de carga desconocido (batería sin leer)
+
+
+def soc_from_mv(mv, curve=SOC_CURVE):
+    """Estado de carga (0..100 %) interpolando linealmente en la curva de descarga."""
+    if mv >= curve[0][0]:
+        return curve[0][1]
+    for i in range(1, len(curve)):
+        low_mv, low_pct = curve[i]
+        if mv >= low_mv:
+            high_mv, high_pct = curve[i - 1]
+            return low_pct + (mv - low_mv) * (high_pct - low_pct) // (high_mv - low_mv)
+    return curve[-1][1]
+
+
+def format_mv(mv):
+    """Milivoltios como "12.30" sin pasar por float."""
+    return "{}.{:02d}".format(mv // 1000, mv % 1000 // 10)
+
+
+def battery_field(mv, soc):
+    """Campo de batería de los reportes de texto: "<mV>/<%>" (p. ej. "12300/87")."""
+    return "{}/{}".format(mv, soc)
+
+
+def parse_battery_field(text):
+    """
+    mV del campo de batería de un reporte de texto. Acepta "<mV>/<%>" (con "/S" si el nodo
+    duerme o "/A" si está siempre despierto) y el formato anterior en voltios ("12.30").
+    ValueError si no es ninguno de los dos.
+    """
+    if '/' in text:
+        return int(text.split('/', 1)[0])
+    return int(float(text) * 1000)
+
+
+class BatteryService:
+    """
+    Medida de la batería compartida por todos los perfiles.
+    - Sobremuestrea el ADC y se queda con la mediana (descarta picos del ADC y de la carga).
+    - Aritmética entera: décimas de mV en el pin y ganancia en milésimas.
+    - Ganancia y offset por nodo, calibrados contra un polímetro y guardados en flash.
+    - Resultado cacheado REFRESH_MS: los reportes y REQ_REPORT no repiten la medida.
+    """
+    OVERSAMPLE = 9                          # Lecturas por medida (impar: la mediana es un valor leído)
+    REFRESH_MS = 10000                      # Validez de la última medida
+
+    def __init__(self, adc, at, scaling_factor=2.9, cal_path=CAL_FILE):
+        self.adc = adc
+        self.at = at
+        self.cal_path = cal_path
+        self.samples = array('H', [0] * self.OVERSAMPLE)
+        self.default_gain = int(DIVIDER_RATIO * scaling_factor * GAIN_SCALE + 0.5)
+        self.gain = self.default_gain
+        self.offset_mv = 0
+        self.mv = None                      # Última medida (None: todavía sin leer)
+        self.soc = SOC_UNKNOWN
+        self.stamp = 0
+        self.expired = True                 # Medida pendiente aunque no haya pasado REFRESH_MS
+        self.load_calibration()
+
+    # --- Calibración ---
+    def load_calibration(self):
+        try:
+            with open(self.cal_path) as f:
+                gain, offset = f.read().split()
+            self.gain = min(max(int(gain), 1), GAIN_MAX)
+            self.offset_mv = int(offset)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def calibrate(self, actual_mv):
+        """Ajusta la ganancia para que la medida actual valga actual_mv y la guarda en flash."""
+        pin_dmv = self.read_pin_dmv()
+        if not pin_dmv:
+            return False
+        self.gain = min(max((actual_mv - self.offset_mv) * 10000 // pin_dmv, 1), GAIN_MAX)
+        self.invalidate()
+        try:
+            with open(self.cal_path, 'w') as f:
+                f.write("{} {}".format(self.gain, self.offset_mv))
+        except OSError:
+            return False
+        return True
+
+    # --- Medida ---
+    def read_raw(self):
+        """Mediana de OVERSAMPLE lecturas del ADC (ordenación por inserción sobre el array preasignado)."""
+        samples = self.samples
+        n = len(samples)
+        for i in range(n):
+            value = self.adc.read()
+            j = i
+            while j and samples[j - 1] > value:
+                samples[j] = samples[j - 1]
+                j -= 1
+            samples[j] = value
+        return samples[n // 2]
+
+    def read_pin_dmv(self):
+        """Tensión en el pin del ADC en décimas de mV."""
+        reference_mv = AV_REFERENCE_MV.get(self.at.get('AV'), 2500)
+        return self.read_raw() * reference_mv * 10 // ADC_FULL_SCALE
+
+    def measure(self):
+        """Nueva medida (mV) y su estado de carga. Si el ADC falla se conserva la anterior."""
+        try:
+            mv = self.read_pin_dmv() * self.gain // 10000 + self.offset_mv
+        except Exception:
+            return self.mv
+        self.mv = max(mv, 0)
+        self.soc = soc_from_mv(self.mv)
+        self.stamp = time.ticks_ms()
+        self.expired = False
+        return self.mv
+
+    def read(self):
+        """mV de la batería, desde la caché si la medida tiene menos de REFRESH_MS."""
+        if self.expired or time.ticks_diff(time.ticks_ms(), self.stamp) >= self.REFRESH_MS:
+            self.measure()
+        return self.mv or 0
+
+    def percent(self):
+        """Estado de carga (%) de la última medida vigente; SOC_UNKNOWN si no se pudo leer."""
+        self.read()
+        return self.soc
+
+    def invalidate(self):
+        """Fuerza una medida nueva en la siguiente lectura (p. ej. al despertar de deep sleep)."""
+        self.expired = True
+
+    def describe(self):
+        """Texto para los reportes de estado: "Bateria: 12.30V, SOC: 87%"."""
+        mv = self.read()
+        if self.mv is None:
+            return "Bateria: ERROR"
+        return "Bateria: {}V, SOC: {}%".format(format_mv(mv), self.soc)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import time
+from array import array
+
+# --- Códigos de evento (índices de EVENT_TEXT) ---
+SETUP_DONE = 0              # a: perfil, b: NI
+SETUP_ERROR = 1             # a: excepción
+RX_CALLBACK_UNAVAILABLE = 2
+STATE = 3                   # a: nombre del estado
+SEND_ERROR = 4              # a: excepción
+TX_NOACK = 5                # a: intento, b: bytes
+TX_ERROR = 6                # a: excepción
+RETRY_IN = 7                # a: ms
+SEND_FAILED = 8
+COORD_RETRY_ON = 9          # a: ms hasta el primer reintento
+SEND_OK = 10
+TX_RADIO = 11               # a: intento, b: bytes
+RADIO_NACK = 12             # a: excepción
+CONFIRM_FAILED = 13
+TX_ACK = 14                 # a: intento, b: bytes
+ACK_TIMEOUT = 15
+ACK_RECEIVED = 16           # a: bytes de la respuesta
+RX_MESSAGE = 17             # a: remitente, b: bytes
+RX_ERROR = 18               # a: excepción
+DUPLICATE = 19              # a: remitente
+UNKNOWN_COMMAND = 20        # a: remitente, b: payload
+COORD_RETRY = 21
+COORD_RETRY_OK = 22
+COORD_RETRY_FAILED = 23     # a: ms hasta el siguiente reintento
+LOOP_ERROR = 24             # a: excepción
+STARTUP_FAILED = 25
+WAKE_SENSOR = 26
+WAKE_TIMEOUT = 27
+WAKE_ERROR = 28             # a: excepción
+SENSOR_CLEARED = 29
+SENSOR_NOTIFY = 30
+SENSOR_HOLDOFF = 31         # a: segundos restantes
+RECONNECT = 32              # a: ms
+COMMAND_ERROR = 33          # a: excepción
+CAMERA_ON = 34
+CAMERA_OFF = 35
+CAMERA_TIMER_OFF = 36
+COMMAND = 37                # a: comando
+BUTTON = 38                 # a: botón
+CAMERA_NOTIFY_FAILED = 39   # a: fallos acumulados
+DEVICE_NEW = 40             # a: NI
+DEVICE_UPDATED = 41         # a: NI
+ESP32_ERROR = 42            # a: excepción
+FANOUT_PENDING = 43         # a: intento, b: destinos sin respuesta
+COORD_STARTED = 44
+OUTBOX_STORED = 45          # a: registros en el outbox, b: descartados
+OUTBOX_FLUSHED = 46         # a: registros entregados, b: pendientes
+TASK_ERROR = 47             # a: excepción (tarea del runtime asíncrono descartada)
+
+# Texto de cada código para el eco en consola; se formatea solo con la depuración activa
+EVENT_TEXT = (
+    "--- SETUP COMPLETO --- Perfil: {}, NI: {}",
+    "Error critico en inicializacion: {}",
+    "receive_callback no disponible: recepción por sondeo.",
+    "--- Estado: {} ---",
+    "Error al enviar mensaje: {}",
+    "Enviando sin ack (intento {}, {} bytes)",
+    "Error al transmitir/recibir: {}",
+    "Reintentando en {} ms...",
+    "Fallo al enviar mensaje tras varios reintentos.",
+    "Coordinador sin respuesta: primer reintento en {} ms.",
+    "Mensaje enviado correctamente.",
+    "Enviando con estado de radio (intento {}, {} bytes)",
+    "Entrega no confirmada por la radio: {}",
+    "Fallo al enviar y confirmar mensaje tras varios reintentos.",
+    "Enviando con ACK (intento {}, {} bytes)",
+    "No se recibió confirmacion en el tiempo esperado.",
+    "Recibido: {} bytes",
+    "Mensaje recibido de {}: {} bytes",
+    "Error al recibir mensaje: {}",
+    "Duplicado de {} descartado",
+    "Comando desconocido de {}: {}",
+    "Enviando reporte de reintento al coordinador...",
+    "Reintento exitoso: desactivando reintentos periódicos.",
+    "Reintento fallido: siguiente en {} ms.",
+    "Error inesperado en el bucle principal: {}",
+    "No se pudo contactar al coordinador en el arranque.",
+    "Despertado por el sensor.",
+    "Despertado por timeout de deep sleep.",
+    "Error al determinar la razón de wakeup: {}",
+    "Sensor ya no activado, volviendo a modo SLEEP/IDLE",
+    "Enviando notificación de sensor activado",
+    "Esperando para reenviar notificación de sensor: {} segundos restantes",
+    "Intentando reconectar en {} ms...",
+    "Error al procesar comando: {}",
+    "Cámara encendida.",
+    "Cámara apagada.",
+    "Cámara apagada por temporizador.",
+    "Comando {} recibido.",
+    "Boton {} presionado.",
+    "Fallo al notificar al dispositivo cámara. Contador de fallos: {}",
+    "Nuevo dispositivo registrado: {}",
+    "Dispositivo actualizado: {}",
+    "Error procesando comando ESP32: {}",
+    "Fan-out intento {}: {} sin respuesta",
+    "--- Coordinador iniciado. Esperando mensajes Zigbee y ESP32... ---",
+    "Reporte guardado en el outbox ({} pendientes, {} descartados).",
+    "Outbox: {} reportes entregados, {} pendientes.",
+    "Tarea terminada por error: {}",
+)
+
+LOG_SIZE = 64                   # Eventos que caben en el anillo
+
+
+def format_arg(value):
+    """
+    Argumento de un registro como texto sin ',', ';' ni ':' (separadores de LOGS).
+    Direcciones EUI-64 en hexadecimal; payloads como texto (hexadecimal si no son UTF-8).
+    """
+    if value is None:
+        return ""
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        data = bytes(value)
+        if len(data) != 8:
+            try:
+                value = data.decode('utf-8')
+            except UnicodeError:
+                value = None
+        if len(data) == 8 or value is None:
+            return ''.join('{:02x}'.format(b) for b in data)
+    elif isinstance(value, Exception):
+        value = "{}({})".format(type(value).__name__, value)
+    text = str(value)
+    for sep in ',;:':
+        text = text.replace(sep, ' ')
+    return text
+
+
+class EventLog:
+    """
+    Registro de eventos en un anillo de tamaño fijo: código, dos argumentos y ticks_ms.
+    Registrar no formatea nada: guarda el código y las referencias a los argumentos en
+    posiciones preasignadas (los argumentos deben ser valores que no se reescriben luego:
+    enteros, constantes, direcciones; nunca vistas de MessageWriter). El texto solo se
+    genera al pedir el registro con LOGS o para el eco en consola.
+    """
+
+    def __init__(self, size=LOG_SIZE):
+        self.size = size
+        self.codes = array('B', [0] * size)
+        self.ticks = array('L', [0] * size)
+        self.args = [None] * (2 * size)
+        self.pos = 0                             # Siguiente posición a escribir
+        self.total = 0                           # Eventos registrados desde el arranque
+
+    def add(self, code, a=None, b=None):
+        i = self.pos
+        self.codes[i] = code
+        self.ticks[i] = time.ticks_ms()
+        self.args[2 * i] = a
+        self.args[2 * i + 1] = b
+        self.pos = i + 1 if i + 1 < self.size else 0
+        self.total += 1
+        return i
+
+    def indexes(self):
+        """Posiciones de los eventos guardados, del más antiguo al más reciente."""
+        count = min(self.total, self.size)
+        start = self.pos - count
+        return [(start + k) % self.size for k in range(count)]
+
+    def text(self, i):
+        """Texto legible del evento en la posición i (eco en consola)."""
+        return EVENT_TEXT[self.codes[i]].format(format_arg(self.args[2 * i]), format_arg(self.args[2 * i + 1]))
+
+    def encode(self, i):
+        """Registro compacto "<ticks>,<código>[,<a>[,<b>]]"."""
+        a, b = self.args[2 * i], self.args[2 * i + 1]
+        record = "{},{}".format(self.ticks[i], self.codes[i])
+        if a is not None or b is not None:
+            record += "," + format_arg(a)
+        if b is not None:
+            record += "," + format_arg(b)
+        return record
+
+    def chunks(self, max_len):
+        """Registros separados por ';' en trozos de como mucho max_len caracteres (siempre al menos uno)."""
+        chunks = []
+        current = ""
+        for i in self.indexes():
+            record = self.encode(i)[:max_len]
+            if current and len(current) + 1 + len(record) > max_len:
+                chunks.append(current)
+                current = ""
+            current = current + ";" + record if current else record
+        chunks.append(current)
+        return chunks
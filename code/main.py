@@ -4,6 +4,9 @@ from machine import Pin, WDT, ADC
 import machine
 import time
 import xbee
+from at_cache import ATCache
+from tools import StateMachine, XBeeDevice, MessageWriter
+from battery import BatteryService
 
 # --- Configuración ---
 TARGET_NODE_ID = "XBEE_COOR"
@@ -15,6 +18,7 @@ CAMERA_DEVICE_64BIT_ADDR = b'\x00\x13\xA2\x00\x42\x3D\x8A\xAC' # Reemplaza con l
 
 DEVICE_ID = "XBEE_X"
 DEVICE_ID_NI = "NONE"
+DEVICE_ID_NI_BYTES = b"NONE"                # NI codificado una vez para MessageWriter
 
 
 # Periodos de tiempo (en milisegundos)
@@ -33,18 +37,18 @@ pin_sensor_3 = Pin('D3', Pin.IN, Pin.PULL_UP)
 pin_sensor_4 = Pin('D4', Pin.IN, Pin.PULL_UP)
 pin_sensor_5 = Pin('D8', Pin.IN, Pin.PULL_UP)
 adc_battery = ADC('D1')
+at = ATCache()  # AV y NI cacheados: evita un atcmd por lectura
+battery = BatteryService(adc_battery, at)
+writer = MessageWriter()  # Búfer reutilizado para los mensajes salientes (sin cadenas intermedias)
 pin_camera = Pin('D12', Pin.OUT, value=0)
 
-# ADC reference voltage
-AV_VALUES = {0: 1.25, 1: 2.5, 2: 3.3, None: 2.5}
-
-# --- Estados del Dispositivo ---
-STATE_STARTUP = 0
-STATE_SLEEP = 1
-STATE_REPORT_BATTERY = 2
-STATE_SENSOR_ACTIVE = 3
-STATE_SENSOR_TRIGGERED = 4
-STATE_ERROR = 5
+# --- Estados del Dispositivo (mismos índices que XBeeDevice) ---
+STATE_STARTUP = XBeeDevice.STATE_STARTUP
+STATE_SLEEP = XBeeDevice.STATE_SLEEP
+STATE_ERROR = XBeeDevice.STATE_ERROR
+STATE_REPORT_BATTERY = XBeeDevice.STATE_REPORT_BATTERY
+STATE_SENSOR_ACTIVE = XBeeDevice.STATE_SENSOR_ACTIVE
+STATE_SENSOR_TRIGGERED = XBeeDevice.STATE_SENSOR_TRIGGERED
 
 # --- Variables Globales ---
 device_state = STATE_STARTUP
@@ -58,36 +62,25 @@ contador_fallo_comunicacion = 0                        # Indica las veces que se
 # --- Funciones Auxiliares ---
 def get_battery_status(as_string=True):
     """
-    Lee el voltaje de la batería.
+    Batería medida por BatteryService (mediana, aritmética entera y caché).
     Si as_string es True, devuelve un texto formateado.
     Si as_string es False, devuelve solo el valor numérico del voltaje.
     """
-    try:
-        
-        # Obtener el voltaje de referencia configurado en el módulo.
-        try:
-            av = xbee.atcmd("AV")
-        except KeyError:
-            av = None # Por defecto para algunos módulos como el Cellular.
-        reference_v = AV_VALUES[av]
+    if as_string:
+        return battery.describe()
+    return battery.read() / 1000
 
-        # Leer el valor crudo del ADC (0-4095).
-        adc_raw_value = adc_battery.read()
-        
-        # Calcular el voltaje en el pin.
-        pin_voltage = (adc_raw_value / 4095.0) * reference_v
-        
-        # Aplicar el factor de escala del divisor de voltaje (12V / 3.3V).
-        battery_voltage = pin_voltage * (12.0 / 3.3) * 2.9 # Factor de corrección para divisor 12k+3.3k
-        
-        if as_string:
-            # Formatear el resultado a dos decimales.
-            return "Bateria: {:.2f}V".format(battery_voltage)
-        else:
-            return battery_voltage
-    except Exception as e:
-        print("Error al leer la bateria: {}".format(e))
-        return "Bateria: ERROR" if as_string else 0.0
+def build_report(data=None):
+    """
+    "NODO:<mV>/<%>:DATOS" escrito en 'writer' (sin datos: "Contador=N, Sensor=ON/OFF").
+    Devuelve la vista del búfer, que se reescribe con el siguiente mensaje.
+    """
+    w = writer.reset()
+    w.put(DEVICE_ID_NI_BYTES).put_byte(58).put_int(battery.read()).put_byte(47).put_int(battery.soc).put_byte(58)
+    if data is not None:
+        return w.put(data).view()
+    w.put(b"Contador=").put_int(contador_fallo_comunicacion)
+    return w.put(b", Sensor=").put(b"ON" if pin_sensor_general else b"OFF").view()
 
 def safe_send(target_addr, message, retries=3):
     """
@@ -97,7 +90,7 @@ def safe_send(target_addr, message, retries=3):
     global dog,xb,DEVICE_ID_NI
     for attempt in range(retries):
         try:
-            print("Enviando sin ack (intento {}/{}) '{}'".format(attempt + 1, retries, message))
+            print("Enviando sin ack (intento {}/{}) '{}'".format(attempt + 1, retries, bytes(message) if isinstance(message, memoryview) else message))
             xbee.transmit(target_addr, message)
             dog.feed()
             time.sleep_ms(100)
@@ -123,7 +116,7 @@ def safe_send_and_wait_ack(target_addr, message, retries=3):
     respuesta_recibida = False
     for attempt in range(retries):
         try:
-            print("Enviando con ACK (intento {}/{}) '{}'".format(attempt + 1, retries, message))
+            print("Enviando con ACK (intento {}/{}) '{}'".format(attempt + 1, retries, bytes(message) if isinstance(message, memoryview) else message))
             xbee.transmit(target_addr, message)
 
             # Esperar feedback
@@ -167,18 +160,13 @@ def send_report():
     """
     global contador_fallo_comunicacion, DEVICE_ID_NI
     try:
-        battery_voltage = get_battery_status(as_string=False)
-        status_data = "Contador={}, Sensor={}".format(
-            contador_fallo_comunicacion,
-            "ON" if pin_sensor_general else "OFF"
-            )
-        message = "{}:{:.2f}:{}".format(DEVICE_ID_NI, battery_voltage, status_data)
+        message = build_report()
         if safe_send_and_wait_ack(COORDINATOR_64BIT_ADDR, message):
             print("Reporte enviado correctamente.")
-            contador = 0  # Resetear el contador tras un envío exitoso
+            contador_fallo_comunicacion = 0  # Resetear el contador tras un envío exitoso
         else:
             print("Fallo al enviar el reporte.")
-            contador += 1  # Incrementar el contador de fallos
+            contador_fallo_comunicacion += 1  # Incrementar el contador de fallos
     except Exception as e:
         print("Error al enviar reporte: {}".format(e))
 
@@ -199,20 +187,67 @@ def check_and_process_incoming_messages():
     
     if payload == "REPORT":
         print("Solicitud de reporte recibida, enviando respuesta...")
-        battery_voltage = get_battery_status(as_string=False)
-        status_data = "Contador={}, Sensor={}".format(
-            contador,
-            "ON" if pin_sensor_general else "OFF"
-            )
-        response = "{}:{:.2f}:{}".format(DEVICE_ID_NI, battery_voltage, status_data)
+        response = build_report()
         safe_send(sender, response)
         return True
 
     return False
 
+# --- Estados (ticks de la máquina de estados) ---
+def state_startup():
+    message = build_report(b"Dispositivo iniciado.")
+    if safe_send_and_wait_ack(COORDINATOR_64BIT_ADDR, message):
+        return STATE_SLEEP
+    print("No se pudo contactar al coordinador en el arranque.")
+    return STATE_ERROR
+
+def state_sleep():
+    """Una vuelta de la espera: mensajes entrantes, sensor y pausa."""
+    if check_and_process_incoming_messages():
+        return None
+    check_pins_sensor()
+    if pin_sensor_general:
+        print("Sensor activado, cambiando a estado SENSOR_TRIGGERED")
+        return STATE_SENSOR_TRIGGERED
+    time.sleep_ms(SLEEP_DURATION_MS)
+    return None
+
+def state_sensor_triggered():
+    global last_sensor_notification_time, contador_fallo_comunicacion
+    check_pins_sensor()
+    if not pin_sensor_general:
+        # El sensor ya no está activado, volver a dormir
+        print("Sensor ya no activado, volviendo a modo SLEEP")
+        return STATE_SLEEP
+    current_time = time.ticks_ms()
+    # Comprobar si ha pasado suficiente tiempo desde la última notificación para no saturar la red a mensajes
+    if time.ticks_diff(current_time, last_sensor_notification_time) >= DEBOUNCE_TIME_MS:
+        print("Enviando notificación de sensor activado")
+        if safe_send_and_wait_ack(CAMERA_DEVICE_64BIT_ADDR, "SENSOR:ON"):
+            last_sensor_notification_time = current_time
+        else:
+            contador_fallo_comunicacion += 1
+            print("Fallo al notificar al dispositivo cámara. Contador de fallos: {}".format(contador_fallo_comunicacion))
+    else:
+        print("Esperando para reenviar notificación de sensor: {} segundos restantes".format(
+            (DEBOUNCE_TIME_MS - time.ticks_diff(current_time, last_sensor_notification_time)) // 1000))
+    time.sleep_ms(CHECK_SENSOR_INTERVAL_MS)  # Esperar antes de verificar de nuevo
+    return None
+
+def state_error():
+    print("Intentando reconectar en {} segundos...".format(STATE_ERROR_SLEEP_MS // 1000))
+    time.sleep_ms(STATE_ERROR_SLEEP_MS)
+    return STATE_STARTUP
+
 # --- Lógica Principal (Máquina de Estados) ---
 def main():
-    global device_state, camera_on_time, xb, dog, DEVICE_ID_NI, pin_sensor_general, last_sensor_notification_time, contador
+    global device_state, xb, dog, DEVICE_ID_NI, DEVICE_ID_NI_BYTES
+
+    fsm = StateMachine(XBeeDevice.STATE_NAMES, STATE_STARTUP)
+    fsm.add(STATE_STARTUP, tick=state_startup)
+    fsm.add(STATE_SLEEP, tick=state_sleep)
+    fsm.add(STATE_SENSOR_TRIGGERED, tick=state_sensor_triggered)
+    fsm.add(STATE_ERROR, tick=state_error)
 
     # Inicialización del Watchdog y XBee
     try:
@@ -221,84 +256,29 @@ def main():
         xb = xbee.XBee()
         
         print("XBee y Watchdog inicializados.")
-        print("XBee NI: {}".format(xbee.atcmd('NI')))
+        print("XBee NI: {}".format(at.get('NI')))
         print("Perfil: SENSOR REMOTO")
-        DEVICE_ID_NI = xbee.atcmd('NI') or DEVICE_ID
+        DEVICE_ID_NI = at.get('NI') or DEVICE_ID
+        DEVICE_ID_NI_BYTES = DEVICE_ID_NI.encode('utf-8')
         time.sleep_ms(5000) # Esperar para estabilizar
     except Exception as e:
         print("Error critico en inicializacion: {}".format(e))
-        device_state = STATE_ERROR
+        fsm.go(STATE_ERROR)
     
+    state = None
     while True:
-        
-        dog.feed()
-        
+        if dog:
+            dog.feed()
         try:
-
-            # --- Máquina de Estados ---
-            if device_state == STATE_STARTUP:
-                print("--- Estado: STARTUP ---")
-                battery_voltage = get_battery_status(as_string=False)
-                message = "{}:{:.2f}:Dispositivo iniciado.".format(DEVICE_ID_NI, battery_voltage)
-                if safe_send_and_wait_ack(COORDINATOR_64BIT_ADDR, message):
-                    device_state = STATE_SLEEP
-                else:
-                    print("No se pudo contactar al coordinador en el arranque.")
-                    device_state = STATE_ERROR
-
-            elif device_state == STATE_SLEEP:
-                print("--- Estado: SLEEP ---")
-                while(True):
-                    dog.feed()
-                    # Comprobar mensajes entrantes
-                    incoming_msg = xbee.receive()
-                    if incoming_msg:
-                        check_and_process_incoming_messages(incoming_msg)
-                        break
-
-                    # Comprobar si el sensor está activado
-                    check_pins_sensor()
-                    if pin_sensor_general:
-                        print("Sensor activado, cambiando a estado SENSOR_TRIGGERED")
-                        device_state = STATE_SENSOR_TRIGGERED
-                        break
-                    time.sleep_ms(SLEEP_DURATION_MS)
-            
-            elif device_state == STATE_SENSOR_TRIGGERED:
-                print("--- Estado: SENSOR_TRIGGERED ---")
-                check_pins_sensor()
-                if pin_sensor_general == 1:
-                    current_time = time.ticks_ms()
-                    # Comprobar si ha pasado suficiente tiempo desde la última notificación para no saturar la red a mensajes
-                    if time.ticks_diff(current_time, last_sensor_notification_time) >= DEBOUNCE_TIME_MS: 
-                        command_to_send = "SENSOR:ON"
-                        print("Enviando notificación de sensor activado")
-                        if safe_send_and_wait_ack(CAMERA_DEVICE_64BIT_ADDR, command_to_send):
-                            last_sensor_notification_time = current_time
-                        else:
-                            contador_fallo_comunicacion += 1
-                            print("Fallo al notificar al dispositivo cámara. Contador de fallos: {}".format(contador_fallo_comunicacion))
-
-                    else:
-                        print("Esperando para reenviar notificación de sensor: {} segundos restantes".format(
-                            (DEBOUNCE_TIME_MS - time.ticks_diff(current_time, last_sensor_notification_time)) // 1000))
-                    
-                    time.sleep_ms(CHECK_SENSOR_INTERVAL_MS)  # Esperar antes de verificar de nuevo
-                    
-                else:
-                    # El sensor ya no está activado, volver a dormir
-                    print("Sensor ya no activado, volviendo a modo SLEEP")
-                    device_state = STATE_SLEEP
-
-            elif device_state == STATE_ERROR:
-                print("--- Estado: ERROR ---")
-                print("Intentando reconectar en {} segundos...".format(STATE_ERROR_SLEEP_MS // 1000))
-                time.sleep_ms(STATE_ERROR_SLEEP_MS)
-                device_state = STATE_STARTUP 
-                
+            if fsm.state != state:
+                state = fsm.state
+                print("--- Estado: {} ---".format(XBeeDevice.STATE_NAMES[state]))
+            fsm.step()
+            device_state = fsm.state
         except Exception as e:
             print("Error inesperado en el bucle principal: {}".format(e))
             # Un error grave, se pone el dispositivo en estado de ERROR
+            fsm.go(STATE_ERROR)
             device_state = STATE_ERROR
             time.sleep_ms(10000) # Esperar antes de reintentar
 
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from array import array
+
+# --- Índices de los contadores ---
+RX_FRAMES = 0           # Tramas Zigbee recibidas
+TX_FRAMES = 1           # Tramas Zigbee transmitidas (incluye reintentos)
+TX_ERRORS = 2           # Fallos de xbee.transmit
+RETRIES = 3             # Reintentos de envío
+ACK_TIMEOUTS = 4        # Ventanas de ACK agotadas sin respuesta
+PARSE_ERRORS = 5        # Tramas que no se pudieron decodificar
+DUPLICATES = 6          # Duplicados descartados (re-confirmados)
+UNKNOWN_COMMANDS = 7    # Comandos sin manejador
+RX_BURST_HWM = 8        # Máximo de tramas drenadas en una iteración
+BATCH_HWM = 9           # Máximo de registros en una trama REPORTS
+MAILBOX_HWM = 10        # Máximo de comandos en un buzón
+RX_PENDING_HWM = 11     # Máximo de tramas apartadas durante una espera de ACK
+RX_PENDING_DROPS = 12   # Tramas apartadas descartadas por cola llena
+RX_QUEUE_HWM = 13       # Máximo de tramas en la cola de receive_callback
+RX_QUEUE_DROPS = 14     # Tramas sobrescritas en la cola de receive_callback llena
+SENSOR_EDGES = 15       # Activaciones del sensor detectadas (runtime asíncrono)
+
+COUNTER_NAMES = ("rx", "tx", "txerr", "retry", "ackto", "parse", "dup", "unk", "rxhwm", "batchhwm", "mboxhwm",
+                 "pendhwm", "penddrop", "rxqhwm", "rxqdrop", "edges")
+
+# Límites superiores (ms) de los cubos del histograma de RTT; el último cubo recoge el resto
+RTT_BUCKETS_MS = (20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class Metrics:
+    """
+    Contadores enteros e histograma de RTT preasignados en arrays.
+    Registrar es O(1) y no reserva memoria: solo se escribe en posiciones existentes.
+    """
+
+    def __init__(self, buckets=RTT_BUCKETS_MS):
+        self.counters = array('L', [0] * len(COUNTER_NAMES))
+        self.bounds = array('L', buckets)
+        self.rtt = array('L', [0] * (len(buckets) + 1))
+
+    def inc(self, index, n=1):
+        self.counters[index] += n
+
+    def high_water(self, index, value):
+        """Guarda 'value' si supera el máximo registrado."""
+        if value > self.counters[index]:
+            self.counters[index] = value
+
+    def observe_rtt(self, rtt_ms):
+        """Suma una muestra de RTT en su cubo (recorrido acotado por el número de cubos)."""
+        bounds = self.bounds
+        i = 0
+        n = len(bounds)
+        while i < n and rtt_ms > bounds[i]:
+            i += 1
+        self.rtt[i] += 1
+
+    def reset(self):
+        for i in range(len(self.counters)):
+            self.counters[i] = 0
+        for i in range(len(self.rtt)):
+            self.rtt[i] = 0
+
+    def dump(self):
+        """Volcado compacto: "rx=..,tx=..,...,rtt=c0/c1/.../cN" (cubos según RTT_BUCKETS_MS)."""
+        parts = ["{}={}".format(name, self.counters[i]) for i, name in enumerate(COUNTER_NAMES)]
+        parts.append("rtt=" + "/".join(str(c) for c in self.rtt))
+        return ",".join(parts)
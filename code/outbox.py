@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import time
+
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+
+OUTBOX_FILE = 'outbox.dat'                  # Reportes pendientes en flash
+OUTBOX_MAX = 16                             # Registros guardados como máximo
+
+
+class Outbox:
+    """
+    Reportes al coordinador que no se pudieron entregar, guardados en flash para enviarlos
+    agrupados (MSG_BATCH) en cuanto el coordinador vuelva a confirmar un envío.
+    - Registro: [ticks_ms, batería mV, SOC %, flags, datos].
+    - Acotado a 'size' registros. Lleno: se descarta el más antiguo cuyo texto se repite en
+      uno posterior (de los reportes periódicos basta la lectura más reciente) y, si todos
+      son distintos, el más antiguo. Los descartes se cuentan y viajan en el siguiente lote.
+    - El fichero solo se reescribe al cambiar el contenido, es decir, con el enlace caído o
+      al vaciarse. Tras un reinicio las antigüedades se reconstruyen con la de la última
+      escritura: no incluyen el tiempo que el nodo estuvo apagado.
+    """
+
+    def __init__(self, path=OUTBOX_FILE, size=OUTBOX_MAX):
+        self.path = path
+        self.size = size
+        self.records = []
+        self.dropped = 0                     # Registros descartados aún no comunicados
+        self.load()
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, battery_mv, soc, flags, data):
+        """Guarda un reporte no entregado (copia 'data': puede ser una vista de MessageWriter)."""
+        data = data.encode('utf-8') if isinstance(data, str) else bytes(data)
+        if len(self.records) >= self.size:
+            self.drop_one()
+        self.records.append([time.ticks_ms(), battery_mv, soc, flags, data])
+        self.save()
+
+    def drop_one(self):
+        records = self.records
+        victim = 0
+        for i in range(len(records) - 1):
+            data = records[i][4]
+            if any(later[4] == data for later in records[i + 1:]):
+                victim = i
+                break
+        del records[victim]
+        self.dropped += 1
+
+    def remove(self, count):
+        """Retira los 'count' registros más antiguos (entregados en un lote) y el contador de descartes."""
+        del self.records[:count]
+        self.dropped = 0
+        self.save()
+
+    # --- Flash ---
+    def load(self):
+        """Primera línea: "<descartados>"; después "<antigüedad ms> <mV> <%> <flags> <datos en hex>"."""
+        try:
+            with open(self.path) as f:
+                lines = f.read().split('\n')
+            now = time.ticks_ms()
+            records = []
+            for line in lines[1:]:
+                if line:
+                    age, mv, soc, flags, data = line.split(' ')
+                    records.append([time.ticks_add(now, -int(age)), int(mv), int(soc), int(flags),
+                                    binascii.unhexlify(data)])
+            self.dropped = int(lines[0])
+            self.records = records[-self.size:]
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def save(self):
+        now = time.ticks_ms()
+        try:
+            with open(self.path, 'w') as f:
+                f.write("{}\n".format(self.dropped))
+                for stamp, mv, soc, flags, data in self.records:
+                    f.write("{} {} {} {} {}\n".format(time.ticks_diff(now, stamp), mv, soc, flags,
+                                                     binascii.hexlify(data).decode()))
+            return True
+        except OSError:
+            return False
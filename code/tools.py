@@ -2,25 +2,639 @@
 import time
 import sys
 import xbee
+from array import array
 from machine import ADC, Pin, WDT
+from at_cache import ATCache
+from battery import BatteryService, SOC_UNKNOWN, battery_field
+import metrics
+from metrics import Metrics
+import eventlog
+from eventlog import EventLog
+from outbox import Outbox, OUTBOX_FILE, OUTBOX_MAX
+
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+
+
+# --- Trama binaria de reporte ---
+# v1: | marca+versión (B) | tipo (B) | handle (H) | batería mV (H) | flags (B) | contador (B) | datos... |
+# v2: igual que v1 con el estado de carga en % (B) tras el contador (0xFF: desconocido).
+# El nibble alto 0xB nunca es un byte inicial UTF-8 válido, así que el coordinador
+# distingue la trama binaria del formato de texto "NODO:BAT:DATOS" con un solo byte.
+# Flags y contador ocupan los mismos bytes en ambas versiones (FRAME_HEADER_LEN es la cabecera mínima).
+FRAME_MARKER = 0xB0
+FRAME_VERSION = 2
+FRAME_HEADER_FMT = ">BBHHBB"
+FRAME_HEADER_LEN = 8
+FRAME_HEADER_V2_FMT = ">BBHHBBB"
+FRAME_HEADER_V2_LEN = 9
+
+# Tipos de mensaje
+MSG_REPORT = 1                      # Reporte de estado / evento
+MSG_HELLO = 2                       # Arranque: los datos llevan el NI para asociarlo al handle
+MSG_BATCH = 3                       # Lote de reportes no entregados (outbox), ver parse_batch/decode_batch
+
+# Flags de estado
+FLAG_SENSOR = 0x01                  # Sensor activado
+FLAG_CAMERA = 0x02                  # Cámara encendida
+FLAG_MANUAL = 0x04                  # Cámara en modo manual
+FLAG_SLEEPY = 0x08                  # El nodo duerme (deep sleep): el coordinador le guarda los comandos en el buzón
+SLEEPY_MARK = b"/S"                 # Lo mismo en los reportes de texto: campo de batería "<mV>/<%>/S"
+AWAKE_MARK = b"/A"                  # Nodo siempre despierto en los reportes de texto: "<mV>/<%>/A"
+FLAG_NO_REPLY = 0x80                # El remitente no espera respuesta de aplicación (ver DELIVERY_*)
+
+
+def encode_report_frame(msg_type, handle, battery_mv, flags=0, counter=0, data=b'', soc=SOC_UNKNOWN):
+    """Empaqueta un reporte en formato binario (v2)."""
+    battery_mv = min(max(int(battery_mv), 0), 0xFFFF)
+    header = struct.pack(FRAME_HEADER_V2_FMT, FRAME_MARKER | FRAME_VERSION, msg_type,
+                         handle & 0xFFFF, battery_mv, flags & 0xFF, counter & 0xFF, soc & 0xFF)
+    return header + data
+
+
+def decode_report_frame(payload):
+    """
+    Desempaqueta una trama binaria de reporte v1 o v2.
+    Devuelve (tipo, handle, bateria_mv, flags, contador, datos, soc) o None si no es válida.
+    En v1 soc es SOC_UNKNOWN.
+    """
+    if len(payload) < FRAME_HEADER_LEN:
+        return None
+    if payload[0] == FRAME_MARKER | FRAME_VERSION and len(payload) >= FRAME_HEADER_V2_LEN:
+        marker, msg_type, handle, battery_mv, flags, counter, soc = struct.unpack_from(FRAME_HEADER_V2_FMT, payload)
+        return msg_type, handle, battery_mv, flags, counter, bytes(payload[FRAME_HEADER_V2_LEN:]), soc
+    if payload[0] == FRAME_MARKER | 1:
+        marker, msg_type, handle, battery_mv, flags, counter = struct.unpack_from(FRAME_HEADER_FMT, payload)
+        return msg_type, handle, battery_mv, flags, counter, bytes(payload[FRAME_HEADER_LEN:]), SOC_UNKNOWN
+    return None
+
+
+# --- Lotes del outbox (MSG_BATCH) ---
+# Texto: los datos del reporte son "BATCH:<descartados>|<antigüedad s>,<mV>,<%>,<flags>,<datos>|..."
+# Binario: datos de la trama MSG_BATCH = descartados (B) y por registro BATCH_RECORD_FMT + datos.
+BATCH_PREFIX = b"BATCH:"
+BATCH_RECORD_FMT = ">IHBBB"         # antigüedad s, mV, %, flags, longitud de los datos
+BATCH_RECORD_LEN = 9
+
+
+def parse_batch(text):
+    """(descartados, [(antigüedad s, mV, %, flags, datos), ...]) del lote de texto "BATCH:..."."""
+    fields = text[len(BATCH_PREFIX):].split('|')
+    records = []
+    for record in fields[1:]:
+        age_s, mv, soc, flags, data = record.split(',', 4)
+        records.append((int(age_s), int(mv), int(soc), int(flags), data))
+    return int(fields[0]), records
+
+
+def decode_batch(data):
+    """Como parse_batch para los datos de una trama binaria MSG_BATCH. ValueError si están truncados."""
+    if not data:
+        raise ValueError("lote vacío")
+    records = []
+    pos = 1
+    while pos < len(data):
+        if pos + BATCH_RECORD_LEN > len(data):
+            raise ValueError("registro truncado")
+        age_s, mv, soc, flags, size = struct.unpack_from(BATCH_RECORD_FMT, data, pos)
+        pos += BATCH_RECORD_LEN
+        records.append((age_s, mv, soc, flags, bytes(data[pos:pos + size]).decode('utf-8')))
+        pos += size
+    return data[0], records
+
+
+# --- Números de secuencia ---
+# Texto: sobre "<seq>#mensaje" (seq decimal 0..65535). Binario: byte contador de la cabecera.
+# El primer mensaje tras el arranque lleva seq 0, que reinicia la ventana del receptor;
+# después la secuencia recorre 1..módulo-1 sin volver a pasar por 0.
+SEQ_MODULUS = 1 << 16
+COUNTER_MODULUS = 1 << 8
+NO_REPLY_SEPARATOR = b'!'           # "<seq>!mensaje": como "<seq>#" pero sin respuesta de aplicación
+
+# --- Modos de entrega ---
+# APP: el destinatario contesta con un mensaje ("OK", "TEL:ON:OK" o los datos pedidos).
+# RADIO: basta el estado de transmisión de xbee.transmit, que solo vuelve sin error cuando
+#        el destino ha confirmado la trama a nivel APS; no hay respuesta de aplicación.
+# NOACK: sin ACK ni reintentos de radio (tx_options), para reportes periódicos idempotentes.
+DELIVERY_APP = 0
+DELIVERY_RADIO = 1
+DELIVERY_NOACK = 2
+TX_OPT_DISABLE_ACK = 0x01           # Opción de transmisión Zigbee: desactivar ACK y reintentos APS
+
+
+def next_sequence(seq, modulus):
+    """Siguiente número de secuencia tras 'seq' (None = primer mensaje tras el arranque)."""
+    return 0 if seq is None else seq % (modulus - 1) + 1
+
+
+def split_sequence(payload):
+    """
+    Separa el sobre de texto "<seq>#mensaje" (o "<seq>!mensaje").
+    Devuelve (seq, mensaje); seq es None si no hay sobre.
+    """
+    sep = payload.find(b'#', 0, 6)
+    if sep <= 0:
+        sep = payload.find(NO_REPLY_SEPARATOR, 0, 6)
+        if sep <= 0:
+            return None, payload
+    try:
+        return int(payload[:sep]), payload[sep + 1:]
+    except ValueError:
+        return None, payload
+
+
+def declares_sleepy(payload):
+    """
+    Lo que el reporte dice del sueño del nodo: FLAG_SLEEPY en las tramas binarias (True/False)
+    o SLEEPY_MARK / AWAKE_MARK en el campo de batería de las de texto (True/False; None si no
+    lleva ninguna: un nodo con firmware anterior no lo declara).
+    """
+    if payload and payload[0] & 0xF0 == FRAME_MARKER:
+        return bool(payload[6] & FLAG_SLEEPY) if len(payload) >= FRAME_HEADER_LEN else None
+    end = payload.find(b':', payload.find(b':') + 1)
+    mark = payload[end - 2:end] if end > 0 else b''
+    if mark == SLEEPY_MARK:
+        return True
+    if mark == AWAKE_MARK:
+        return False
+    return None
+
+
+def wants_reply(payload):
+    """False si el remitente envió el mensaje sin esperar respuesta ("<seq>!" o FLAG_NO_REPLY)."""
+    if payload and payload[0] & 0xF0 == FRAME_MARKER:
+        return len(payload) < FRAME_HEADER_LEN or not payload[6] & FLAG_NO_REPLY
+    sep = payload.find(NO_REPLY_SEPARATOR, 0, 6)
+    if sep <= 0 or payload.find(b'#', 0, sep) >= 0:
+        return True
+    try:
+        int(payload[:sep])
+        return False
+    except ValueError:
+        return True
+
+
+def is_reply(payload):
+    """
+    True si el payload es a su vez una respuesta: "OK", "OK|...", "<comando>:OK", "<comando>:ERROR",
+    UNKNOWN o el estado "<NI>: ..." de REQ_REPORT. Los reportes ("NI:BAT:DATOS"), los comandos
+    y las tramas binarias no lo son.
+    """
+    if payload and payload[0] & 0xF0 == FRAME_MARKER:
+        return False
+    sep = payload.find(b':')
+    return (payload == b'OK' or payload[:3] == b'OK|' or payload.endswith(b':OK')
+            or payload.endswith(b':ERROR') or payload.startswith(b'UNKNOWN')
+            or sep > 0 and payload[sep + 1:sep + 2] == b' ')
+
+
+# --- Mensajes sin reservas de memoria ---
+MESSAGE_MAX_LEN = 128               # Bytes de un MessageWriter (sobre de secuencia incluido)
+
+
+class MessageWriter:
+    """
+    Construye mensajes de texto (o tramas binarias) en un bytearray reutilizable, sin las
+    cadenas intermedias de str.format: cada campo se copia byte a byte y los enteros se
+    escriben cifra a cifra. Los HEADROOM primeros bytes quedan libres para que add_sequence
+    anteponga "<seq>#" sin mover el cuerpo.
+    El mensaje se transmite como memoryview del búfer. Se guardan las VIEW_CACHE últimas
+    vistas por (inicio, fin): en régimen estable los mensajes repiten forma y no se reserva
+    memoria, y la caché no crece con cada longitud distinta.
+    Lo que no cabe en el búfer se descarta y marca 'truncated' (un payload demasiado largo,
+    como el eco de un BATCAL con muchas cifras, no debe lanzar IndexError en un manejador).
+    El búfer se reescribe con el siguiente mensaje: quien quiera conservarlo debe copiarlo.
+    """
+    HEADROOM = 6                                        # "65535#" como máximo
+    VIEW_CACHE = 8                                      # Vistas guardadas como máximo
+
+    def __init__(self, size=MESSAGE_MAX_LEN):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.views = {}
+        self.start = self.pos = self.HEADROOM
+        self.truncated = False                          # Se descartaron bytes que no cabían
+
+    def reset(self):
+        self.start = self.pos = self.HEADROOM
+        self.truncated = False
+        return self
+
+    def put(self, data):
+        """Añade bytes. Un str se codifica antes (reserva memoria: en los caminos frecuentes, bytes)."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        buf = self.buf
+        pos = self.pos
+        size = len(data)
+        if pos + size > len(buf):
+            size = len(buf) - pos
+            self.truncated = True
+        for i in range(size):
+            buf[pos + i] = data[i]
+        self.pos = pos + size
+        return self
+
+    def put_byte(self, value):
+        if self.pos < len(self.buf):
+            self.buf[self.pos] = value
+            self.pos += 1
+        else:
+            self.truncated = True
+        return self
+
+    def put_int(self, value):
+        """Entero en decimal: cifras de menor a mayor peso y después se invierten en su sitio."""
+        buf = self.buf
+        digits = 1 if value >= 0 else 2
+        rest = abs(value)
+        while rest >= 10:
+            rest //= 10
+            digits += 1
+        if self.pos + digits > len(buf):                # Sin sitio para el número entero: se omite
+            self.truncated = True
+            return self
+        if value < 0:
+            self.put_byte(45)                           # '-'
+            value = -value
+        first = pos = self.pos
+        while True:
+            buf[pos] = 48 + value % 10
+            pos += 1
+            value //= 10
+            if not value:
+                break
+        self.pos = pos
+        pos -= 1
+        while first < pos:
+            buf[first], buf[pos] = buf[pos], buf[first]
+            first += 1
+            pos -= 1
+        return self
+
+    def put_millis(self, value):
+        """Milésimas con dos decimales: 12345 -> "12.34" (como battery.format_mv)."""
+        self.put_int(value // 1000)
+        cents = value % 1000 // 10
+        return self.put_byte(46).put_byte(48 + cents // 10).put_byte(48 + cents % 10)
+
+    def put_bool(self, value):
+        return self.put(b'True' if value else b'False')
+
+    def sequenced(self, seq, separator):
+        """Antepone "<seq><separador>" (separador: código del byte) y devuelve la vista del mensaje."""
+        buf = self.buf
+        start = self.HEADROOM - 1
+        buf[start] = separator
+        while True:
+            start -= 1
+            buf[start] = 48 + seq % 10
+            seq //= 10
+            if not seq:
+                break
+        self.start = start
+        return self.view()
+
+    def view(self):
+        """memoryview del mensaje actual (cacheada por posición: no reserva memoria al repetirse)."""
+        key = self.start * len(self.buf) + self.pos
+        view = self.views.get(key)
+        if view is None:
+            views = self.views
+            if len(views) >= self.VIEW_CACHE:
+                del views[next(iter(views))]            # La más antigua
+            view = views[key] = self.mv[self.start:self.pos]
+        return view
+
+
+TEXT_MESSAGES = (str, MessageWriter)   # Mensajes a los que add_sequence antepone "<seq>#"
+
+
+class DuplicateFilter:
+    """
+    Supresión de duplicados por remitente con memoria fija: última secuencia aceptada y
+    mapa de bits de las WINDOW anteriores, por separado para cada espacio de secuencia
+    (contador binario de 8 bits y sobre de texto de 16 bits: sus números no se comparan),
+    y la última respuesta enviada, para volver a confirmar un duplicado sin reprocesarlo.
+    Como mucho 'max_senders' entradas de cada tipo.
+    """
+    WINDOW = 32
+
+    def __init__(self, max_senders=64):
+        self.max_senders = max_senders
+        self.entries = {}  # (remitente, módulo) -> [última seq, mapa de bits (bit 0 = última)]
+        self.replies = {}  # remitente -> última respuesta
+        self.accepted = 0
+        self.duplicates = 0
+
+    def accept(self, sender, seq, modulus):
+        """
+        Registra 'seq' de 'sender'. Devuelve False si ya se había recibido.
+        Un reinicio del remitente (vuelve a seq 0) solo se reconoce fuera de la ventana: dentro
+        de ella, un seq 0 ya aceptado es un reintento tardío (p. ej. del HELLO) y se descarta.
+        """
+        key = (sender, modulus)
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.entries) >= self.max_senders:
+                del self.entries[next(iter(self.entries))]
+            self.entries[key] = [seq, 1]
+            self.accepted += 1
+            return True
+        last, bitmap = entry[0], entry[1]
+        ahead = (seq - last) % modulus
+        if ahead and ahead < modulus // 2:
+            # Más reciente que la última: desplazar la ventana
+            entry[0] = seq
+            entry[1] = ((bitmap << ahead) | 1) & 0xFFFFFFFF if ahead < self.WINDOW else 1
+            self.accepted += 1
+            return True
+        age = (last - seq) % modulus
+        if age >= self.WINDOW:
+            # Fuera de la ventana: el remitente se ha reiniciado; empezar de nuevo
+            entry[0] = seq
+            entry[1] = 1
+            self.accepted += 1
+            return True
+        if bitmap & (1 << age):
+            self.duplicates += 1
+            return False
+        entry[1] = bitmap | (1 << age)
+        self.accepted += 1
+        return True
+
+    def set_reply(self, sender, reply):
+        if isinstance(reply, memoryview):
+            reply = bytes(reply)         # Vista de un MessageWriter: el búfer se reutilizará
+        if sender not in self.replies and len(self.replies) >= self.max_senders:
+            del self.replies[next(iter(self.replies))]
+        self.replies[sender] = reply
+
+    def get_reply(self, sender):
+        return self.replies.get(sender)
+
+
+class RttEstimator:
+    """
+    Plazo de ACK adaptativo por destino (estimador de Jacobson/Karels, como en TCP).
+    Cada destino guarda [srtt*8, rttvar*4, backoff] en enteros: el plazo es srtt + 4*rttvar,
+    acotado a [min_ms, max_ms] y duplicado por cada ACK agotado hasta la siguiente muestra
+    válida (sin muestras se usa initial_ms). Solo se muestrean los ACK de primeros intentos (regla de Karn): el de un
+    reintento no se sabe a qué copia responde. Como mucho 'max_destinations' destinos.
+    """
+    MAX_BACKOFF = 4                 # Duplicaciones máximas del plazo
+
+    def __init__(self, initial_ms, min_ms, max_ms, max_destinations=16):
+        self.initial_ms = initial_ms
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.max_destinations = max_destinations
+        self.entries = {}  # destino -> [srtt*8 (-1 sin muestras), rttvar*4, backoff]
+
+    def _entry(self, dest):
+        entry = self.entries.get(dest)
+        if entry is None:
+            if len(self.entries) >= self.max_destinations:
+                del self.entries[next(iter(self.entries))]
+            entry = self.entries[dest] = [-1, 0, 0]
+        return entry
+
+    def sample(self, dest, rtt_ms):
+        """Nueva medida de RTT de un primer intento confirmado."""
+        entry = self._entry(dest)
+        if entry[0] < 0:
+            entry[0] = rtt_ms << 3                  # srtt = R
+            entry[1] = rtt_ms << 1                  # rttvar = R/2
+        else:
+            err = rtt_ms - (entry[0] >> 3)
+            entry[0] += err                         # srtt += err/8
+            entry[1] += (err if err >= 0 else -err) - (entry[1] >> 2)  # rttvar += (|err| - rttvar)/4
+        entry[2] = 0
+
+    def on_timeout(self, dest):
+        """
+        ACK agotado: el siguiente plazo se duplica hasta que llegue una muestra válida.
+        Sin muestras el plazo inicial ya es el conservador y no se duplica.
+        """
+        entry = self.entries.get(dest)
+        if entry is not None and entry[0] >= 0 and entry[2] < self.MAX_BACKOFF:
+            entry[2] += 1
+
+    def timeout(self, dest):
+        """Plazo de espera del ACK de 'dest' en ms."""
+        entry = self.entries.get(dest)
+        if entry is None:
+            return self.initial_ms
+        rto = self.initial_ms if entry[0] < 0 else (entry[0] >> 3) + entry[1]
+        rto = min(max(rto, self.min_ms), self.max_ms)
+        return min(rto << entry[2], self.max_ms)
+
+
+def backoff_delay(attempt, base_ms, max_ms, rand16):
+    """
+    Espera antes del reintento 'attempt' (1, 2, ...): base*2^(attempt-1) con tope max_ms,
+    la mitad fija y la otra mitad aleatoria (rand16 en 0..65535) para que los nodos que
+    han colisionado no vuelvan a transmitir a la vez.
+    """
+    limit = min(base_ms << (attempt - 1), max_ms)
+    half = limit >> 1
+    return half + (rand16 * (limit - half + 1) >> 16)
+
+
+class TimerWheel:
+    """
+    Rueda de temporizadores (hashed timing wheel) sobre ticks_ms.
+    Programar y cancelar son O(1) y avanzar solo recorre las ranuras transcurridas,
+    de modo que comprobar vencimientos cuesta O(vencidos) y no depende del total.
+    Solo usa diferencias de ticks, por lo que soporta el desbordamiento de ticks_ms.
+    """
+
+    def __init__(self, slot_ms=1000, slots=64):
+        self.slot_ms = slot_ms
+        self.slots = [{} for _ in range(slots)]
+        self.cursor = 0
+        self.last_tick = time.ticks_ms()
+        self.where = {}  # clave -> ranura donde está programada
+
+    def schedule(self, key, delay_ms):
+        """Programa (o reprograma) 'key' para vencer dentro de 'delay_ms'."""
+        self.cancel(key)
+        n = len(self.slots)
+        steps = max(1, (delay_ms + self.slot_ms - 1) // self.slot_ms)
+        index = (self.cursor + steps) % n
+        self.slots[index][key] = (steps - 1) // n  # Vueltas completas antes de vencer
+        self.where[key] = index
+
+    def cancel(self, key):
+        index = self.where.pop(key, None)
+        if index is not None:
+            del self.slots[index][key]
+
+    def advance(self, now=None):
+        """Avanza la rueda hasta 'now' y devuelve la lista de claves vencidas."""
+        if now is None:
+            now = time.ticks_ms()
+        expired = []
+        n = len(self.slots)
+        while time.ticks_diff(now, self.last_tick) >= self.slot_ms:
+            self.last_tick = time.ticks_add(self.last_tick, self.slot_ms)
+            self.cursor = (self.cursor + 1) % n
+            bucket = self.slots[self.cursor]
+            if not bucket:
+                continue
+            for key in list(bucket):
+                rounds = bucket[key]
+                if rounds:
+                    bucket[key] = rounds - 1
+                else:
+                    del bucket[key]
+                    del self.where[key]
+                    expired.append(key)
+        return expired
+
+
+class StateMachine:
+    """
+    Máquina de estados por tabla. Los estados son índices 0..n-1 y cada uno tiene manejadores
+    opcionales tick/enter/exit guardados en listas, así que despachar es indexar (O(1)).
+    tick() devuelve el estado siguiente o None para seguir en el actual. Una transición
+    puede tener guarda: si guard() devuelve False no se produce.
+    Instrumentación en arrays preasignados: visitas y ms acumulados por estado, y número de
+    transiciones y ms dentro de exit+enter por cada par (origen, destino).
+    """
+
+    def __init__(self, names, initial=0):
+        n = len(names)
+        self.names = names
+        self.ticks = [None] * n
+        self.enters = [None] * n
+        self.exits = [None] * n
+        self.guards = {}                 # origen * n + destino -> guarda
+        self.visits = array('L', [0] * n)
+        self.state_ms = array('L', [0] * n)
+        self.trans_count = array('L', [0] * (n * n))
+        self.trans_ms = array('L', [0] * (n * n))
+        self.state = initial
+        self.visits[initial] = 1
+        self.entered = time.ticks_ms()
+
+    def add(self, state, tick=None, enter=None, exit=None):
+        self.ticks[state] = tick
+        self.enters[state] = enter
+        self.exits[state] = exit
+
+    def guard(self, src, dst, fn):
+        """La transición src -> dst solo ocurre si fn() es verdadero."""
+        self.guards[src * len(self.names) + dst] = fn
+
+    def step(self):
+        """Ejecuta el tick del estado actual y la transición que pida."""
+        tick = self.ticks[self.state]
+        if tick is not None:
+            nxt = tick()
+            if nxt is not None:
+                self.go(nxt)
+
+    def go(self, dst):
+        """Transición al estado dst (exit, enter e instrumentación). False si la guarda la impide."""
+        src = self.state
+        key = src * len(self.names) + dst
+        guard = self.guards.get(key)
+        if guard is not None and not guard():
+            return False
+        start = time.ticks_ms()
+        self.state_ms[src] += time.ticks_diff(start, self.entered)
+        if self.exits[src] is not None:
+            self.exits[src]()
+        self.state = dst
+        self.visits[dst] += 1
+        if self.enters[dst] is not None:
+            self.enters[dst]()
+        self.entered = time.ticks_ms()
+        self.trans_count[key] += 1
+        self.trans_ms[key] += time.ticks_diff(self.entered, start)
+        return True
+
+    def dump(self):
+        """Volcado "ESTADO=visitas/ms,...,ORIGEN>DESTINO=veces/ms" (solo estados y transiciones usados)."""
+        names = self.names
+        n = len(names)
+        now_ms = time.ticks_diff(time.ticks_ms(), self.entered)
+        parts = []
+        for i in range(n):
+            if self.visits[i]:
+                ms = self.state_ms[i] + (now_ms if i == self.state else 0)
+                parts.append("{}={}/{}".format(names[i], self.visits[i], ms))
+        for key in range(n * n):
+            if self.trans_count[key]:
+                parts.append("{}>{}={}/{}".format(names[key // n], names[key % n],
+                                                  self.trans_count[key], self.trans_ms[key]))
+        return ",".join(parts)
+
+
+class FrameQueue:
+    """
+    Cola circular de tramas con los huecos reservados de antemano, para xbee.receive_callback.
+    push() solo escribe en un hueco existente, así que el callback no hace crecer listas;
+    con la cola llena se sobrescribe la trama más antigua.
+    """
+
+    def __init__(self, size):
+        self.slots = [None] * size
+        self.head = 0                # Hueco de la trama más antigua
+        self.count = 0
+        self.drops = 0
+
+    def push(self, frame):
+        """Encola 'frame'. Devuelve False si hubo que descartar la más antigua."""
+        size = len(self.slots)
+        if self.count == size:
+            self.slots[self.head] = frame
+            self.head = (self.head + 1) % size
+            self.drops += 1
+            return False
+        self.slots[(self.head + self.count) % size] = frame
+        self.count += 1
+        return True
+
+    def pop(self):
+        """Trama más antigua, o None si la cola está vacía."""
+        if not self.count:
+            return None
+        frame = self.slots[self.head]
+        self.slots[self.head] = None
+        self.head = (self.head + 1) % len(self.slots)
+        self.count -= 1
+        return frame
 
 
 class XBeeDevice:
     """Clase base para todos los perfiles de dispositivos XBee."""
-    AV_VALUES = {0: 1.25, 1: 2.5, 2: 3.3, None: 2.5}
     
     # --- Estados del Dispositivo ---
+    # Un único juego de índices para todos los perfiles (StateMachine y write_status_report)
     STATE_STARTUP = 0                           # Estado de arranque
     STATE_SLEEP = 1                             # Estado de sleep
     STATE_IDLE = 2                              # Estado genérico para espera activa
     STATE_ERROR = 3                             # Estado de error crítico
+    STATE_REPORT_BATTERY = 4                    # Envío del reporte periódico
+    STATE_SENSOR_ACTIVE = 5                     # Sensor activo (reservado)
+    STATE_SENSOR_TRIGGERED = 6                  # Sensor activado: notificar y vigilar
+    STATE_SEND_COMMAND = 7                      # Envío de una orden (telemando)
+    STATE_NAMES = ("STARTUP", "SLEEP", "IDLE", "ERROR", "REPORT", "SENSOR_ACTIVE", "SENSOR", "SEND_COMMAND")
 
     
     # --- Periodos de tiempo (en segundos) ---
     ESTABILIZATION_TIME_MS = 5000                       # Tiempo de estabilización tras wakeup
     SLEEP_DURATION_MS = 100                             # Tiempo de espera en modo sleep       
-    RETRY_DELAY_MS = 1000                               # Tiempo de espera entre reintentos de envio
-    HEARING_INTERVAL_MS = 3000                          # Tiempo escuchando ACK tras envio
+    RETRY_DELAY_MS = 1000                               # Tiempo de espera entre reintentos de envio (primer reintento)
+    RETRY_DELAY_MAX_MS = 8000                           # Tope de la espera exponencial entre reintentos
+    HEARING_INTERVAL_MS = 3000                          # Tiempo escuchando ACK tras envio (hasta tener RTT del destino)
+    ACK_TIMEOUT_MIN_MS = 300                            # Plazo mínimo de ACK estimado a partir del RTT
+    ACK_TIMEOUT_MAX_MS = 12000                          # Plazo máximo de ACK (destinos dormidos a varios saltos)
+    RTT_DESTINATIONS = 8                                # Destinos con RTT estimado
     WATCHDOG_TIMEOUT_MS = 120000                        # Tiempo de timeout del watchdog
     STATE_ERROR_SLEEP_MS = 5000                         # Segundos en estado de error
     DEBOUNCE_BOTTON_TIME_MS = 4000                      # Tiempo para resetear último comando tras inactividad
@@ -28,16 +642,58 @@ class XBeeDevice:
     CHECK_SENSOR_INTERVAL_MS = 1000                     # Intervalo para comprobar el estado del sensor una vez activado
     CAMERA_ON_DURATION_MS = 60000                       # Duración en milisegundos que la cámara permanece encendida tras activación por sensor
     DEEP_SLEEP_DURATION_MS = 20000                      # Duración del deep sleep en milisegundos (24 Horas = 86400000 milisegundos)
-    COORDINATOR_RETRY_INTERVAL_MS = 43200000            # Intervalo para reintentos al coordinador (12 horas)
+    COORDINATOR_RETRY_MIN_MS = 10000                    # Primer reintento al coordinador tras perder el enlace
+    COORDINATOR_RETRY_INTERVAL_MS = 43200000            # Tope del backoff de reintentos al coordinador (12 horas)
+    COORDINATOR_RETRY_MAX_STEPS = 13                    # Duplicaciones a partir de las que se aplica el tope
+
+    # --- Formato de reporte ---
+    BINARY_REPORTS = False                              # True: trama binaria compacta, False: texto "NODO:BAT:DATOS"
+
+    # --- Modo de entrega por tipo de mensaje (send_as) ---
+    # Por defecto todo con respuesta de aplicación; cada perfil relaja lo que no la necesita.
+    # Los reportes de nodos dormidos deben ser APP: el ACK trae los comandos del buzón.
+    DELIVERY = {
+        'HELLO': DELIVERY_APP,                          # Confirma que el coordinador está operativo
+        'REPORT': DELIVERY_APP,                         # Reporte periódico
+        'COMMAND': DELIVERY_APP,                        # Orden a otro nodo sin datos de vuelta (TEL:ON, SENSOR:ON)
+        'REQUEST': DELIVERY_APP,                        # Petición cuya respuesta trae datos: siempre APP
+        'BATCH': DELIVERY_APP,                          # Lotes del outbox y sondeos de reintento: siempre confirmados
+    }
+
+    # --- Registro de eventos y depuración ---
+    DEBUG = False                                       # True: eco en consola de cada evento (se formatea al registrarlo)
+    LOG_SIZE = eventlog.LOG_SIZE                        # Eventos guardados en el anillo (LOGS)
+    LOGS_CHUNK_BYTES = 56                               # Registros por trama de LOGS (con la cabecera, < 84 bytes de payload)
+
+    # --- Outbox de reportes no entregados ---
+    OUTBOX_FILE = OUTBOX_FILE                           # Fichero en flash con los reportes pendientes
+    OUTBOX_SIZE = OUTBOX_MAX                            # Reportes guardados como máximo
+    OUTBOX_FRAME_BYTES = 72                             # Tamaño máximo de un lote (más "<seq>#", < 84 bytes)
+
+    # --- Comandos recibidos por Zigbee ---
+    # Prefijo (bytes, texto antes del primer ':') u opcode binario (int >= 0x80, primer byte)
+    # -> nombre del método manejador(sender, payload, args). Cada perfil declara su tabla.
+    COMMANDS = {}
+    UNKNOWN_COMMAND_REPLY = "UNKNOWN COMMAND RECEIVED"
+    UNKNOWN_REPLY_INTERVAL_MS = 10000                   # Como máximo una respuesta a comandos desconocidos por intervalo
+
+    # --- Recepción ---
+    RX_PENDING_MAX = 4                                  # Tramas apartadas durante una espera de ACK (se descarta la más antigua)
+    RX_CALLBACK = False                                 # True: xbee.receive_callback deja las tramas en rx_queue al llegar
+    RX_QUEUE_SIZE = 8                                   # Huecos de rx_queue (se sobrescribe la trama más antigua)
+    RX_WAIT_SLICE_MS = 2                                # Porción de sueño al esperar en rx_queue
 
     def __init__(self, device_id="XBEE_DEVICE", wdt_timeout=60000, battery_pin='D1', battery_scaling_factor=2.9, pin_camera='D12', xbee_instance=None):
         self.device_id = device_id
         self.device_node_id = "NONE"
+        self.node_id_bytes = b"NONE"                 # NI codificado una vez para MessageWriter
         self.wdt_timeout = wdt_timeout
         self.adc_battery = ADC(battery_pin)
         self.battery_scaling_factor = battery_scaling_factor
         self.wdt = None
         self.xbee_ = xbee_instance
+        self.at = ATCache(xbee_instance)             # Parámetros AT cacheados (AV, NI, SL, AI...)
+        self.battery = BatteryService(self.adc_battery, self.at, battery_scaling_factor)
         self.device_state = self.STATE_STARTUP
         self.contador_fallo_comunicacion = 0
         self.coordinator_addr = b'\x00\x13\xA2\x00\x42\x3D\x8B\x99' # Dirección por defecto, puede ser sobreescrita
@@ -49,28 +705,80 @@ class XBeeDevice:
         self.pin_sensor_2 = Pin('D2', Pin.IN, Pin.PULL_UP)
         self.pin_sensor_3 = Pin('D3', Pin.IN, Pin.PULL_UP)
         self.pin_sensor_4 = Pin('D4', Pin.IN, Pin.PULL_UP)
-        self.adc_battery = ADC(battery_pin)
         self.pin_camera = Pin(pin_camera, Pin.OUT, value=0)
 
         # Variables específicas de dispositivos con cámara
         self.camera_on_time = 0
         self.manual_camera = False  # Flag para anular el temporizador de la cámara
+        self.camera_remote = False                   # Notificar SENSOR:ON a la cámara remota
+        self.local_camera = False                    # Encender la cámara propia al activarse el sensor
+        self.deep_sleep = False                      # Reposo en STATE_SLEEP (deep sleep) en lugar de STATE_IDLE
+        self.last_sensor_notification_time = 0       # Tiempo de la última notificación de sensor
         self.coordinator_retry_active = False
         self.last_coordinator_retry_time = 0
+        self.coordinator_retry_count = 0             # Reintentos fallidos seguidos (exponente del backoff)
+        self.coordinator_retry_delay_ms = self.COORDINATOR_RETRY_MIN_MS
+        self.outbox = Outbox(self.OUTBOX_FILE, self.OUTBOX_SIZE)
+        self.outbox_flushing = False                 # Evita vaciar el outbox desde sus propios envíos
+
+        # Identificación compacta para las tramas binarias
+        self.node_handle = 0
+        self.report_counter = None                   # None: el primer reporte lleva contador 0
+
+        # Secuencias por destino y duplicados por remitente
+        self.tx_seq = {}
+        self.dup_filter = DuplicateFilter()
+        self.metrics = Metrics()                     # Contadores de red y protocolo (METRICS)
+        self.reply_target = None                     # Remitente del mensaje que se está procesando
+        self.reply_wanted = True                     # El mensaje en proceso espera respuesta de aplicación
+        self.rx_pending = []                         # Tramas recibidas esperando un ACK, para el bucle principal
+        self.rx_queue = None                         # FrameQueue llenada por receive_callback (None: sondeo de xbee.receive)
+        self.fsm = None                              # StateMachine de run_machine (tiempos por estado en METRICS)
+        self.events = EventLog(self.LOG_SIZE)        # Anillo de eventos (LOGS)
+        self.tx_writer = MessageWriter()             # Reportes propios (retransmitidos hasta el ACK)
+        self.reply_writer = MessageWriter()          # Respuestas a comandos recibidos
+
+        # Plazos de ACK por destino y generador para el jitter de los reintentos
+        self.rtt = RttEstimator(self.HEARING_INTERVAL_MS, self.ACK_TIMEOUT_MIN_MS,
+                                self.ACK_TIMEOUT_MAX_MS, self.RTT_DESTINATIONS)
+        self.rand_state = (time.ticks_ms() & 0xFFFF) | 1
+
+        self.debug = self.DEBUG
+
+        # Tabla de comandos enlazada a los métodos de la instancia
+        self.command_handlers = self.bind_commands(self.COMMANDS)
+        self.last_unknown_reply = None
+
+    def log(self, code, a=None, b=None):
+        """
+        Registra el evento 'code' (eventlog) con hasta dos argumentos en el anillo, sin
+        formatear nada. Solo con la depuración activa se genera el texto y se escribe.
+        """
+        i = self.events.add(code, a, b)
+        if self.debug:
+            self.debug_write(self.events.text(i))
+
+    def debug_write(self, text):
+        """Destino de los mensajes de depuración. Los perfiles que usan stdout como protocolo lo redefinen."""
+        print(text)
 
     def setup(self):
         """Inicializa hardware como WDT y XBee. Se llama al inicio de run()."""
         try:
             self.wdt = WDT(timeout=self.wdt_timeout)
             self.feed_watchdog()
-            self.device_node_id = self.xbee_.atcmd('NI') or self.device_id
-            print("--- SETUP COMPLETO ---")
-            print("Perfil: {}".format(self.__class__.__name__))
-            print("Device NI: {}".format(self.device_node_id))
+            self.device_node_id = self.at.get('NI') or self.device_id
+            self.node_id_bytes = self.device_node_id.encode('utf-8')
+            self.node_handle = self.get_node_handle()
+            self.rand_state = ((self.node_handle ^ time.ticks_ms()) & 0xFFFF) | 1  # Distinto en cada nodo
+            # setup() se repite en cada reintento de STATE_ERROR: la cola y el callback se conservan
+            if self.RX_CALLBACK and self.rx_queue is None and not self.watch_receive():
+                self.log(eventlog.RX_CALLBACK_UNAVAILABLE)
+            self.log(eventlog.SETUP_DONE, self.__class__.__name__, self.device_node_id)
             time.sleep_ms(self.ESTABILIZATION_TIME_MS)  # Espera para estabilizar XBee
             return True
         except Exception as e:
-            print("Error critico en inicializacion: {}".format(e))
+            self.log(eventlog.SETUP_ERROR, e)
             self.device_state = self.STATE_ERROR
             return False
         
@@ -78,37 +786,106 @@ class XBeeDevice:
         if self.wdt:
             self.wdt.feed()
 
+    def random16(self):
+        """Entero pseudoaleatorio de 16 bits (xorshift de 16 bits: sin módulo random ni enteros grandes)."""
+        x = self.rand_state
+        x ^= (x << 7) & 0xFFFF
+        x ^= x >> 9
+        x ^= (x << 8) & 0xFFFF
+        self.rand_state = x
+        return x
+
+    def retry_delay(self, attempt):
+        """Espera antes del reintento 'attempt' con backoff exponencial y jitter."""
+        return backoff_delay(attempt, self.RETRY_DELAY_MS, self.RETRY_DELAY_MAX_MS, self.random16())
+
+    def get_node_handle(self):
+        """Handle de 16 bits derivado de los dos últimos bytes del número de serie (SL)."""
+        try:
+            sl = self.at.get('SL')
+            return (sl[-2] << 8) | sl[-1]
+        except Exception:
+            return 0
+
+    def get_report_flags(self):
+        """Flags de estado que acompañan a los reportes binarios."""
+        flags = 0
+        if self.pin_sensor_general:
+            flags |= FLAG_SENSOR
+        if self.pin_camera.value():
+            flags |= FLAG_CAMERA
+        if self.manual_camera:
+            flags |= FLAG_MANUAL
+        if self.deep_sleep:
+            flags |= FLAG_SLEEPY
+        return flags
+
+    def build_report(self, data, msg_type=MSG_REPORT, writer=None):
+        """
+        Construye un reporte para el coordinador en el formato configurado, dentro de 'writer'
+        (por defecto tx_writer) y sin reservar memoria si 'data' es bytes.
+        Texto: devuelve el MessageWriter ("NODO:<mV>/<%>/S:DATOS", "/A" si no duerme); send_as le
+        antepone la secuencia.
+        Binario: devuelve la vista de la trama. MSG_HELLO lleva el NI para asociar el handle.
+        """
+        battery_mv = self.battery.read()
+        soc = self.battery.soc
+        self.report_counter = next_sequence(self.report_counter, COUNTER_MODULUS)
+        w = (writer or self.tx_writer).reset()
+        if not self.BINARY_REPORTS:
+            w.put(self.node_id_bytes).put_byte(58).put_int(battery_mv).put_byte(47).put_int(soc)
+            w.put(SLEEPY_MARK if self.deep_sleep else AWAKE_MARK)
+            return w.put_byte(58).put(data)
+        if msg_type == MSG_HELLO:
+            data = self.node_id_bytes
+        struct.pack_into(FRAME_HEADER_V2_FMT, w.buf, w.pos, FRAME_MARKER | FRAME_VERSION, msg_type,
+                         self.node_handle & 0xFFFF, min(battery_mv, 0xFFFF), self.get_report_flags(),
+                         self.report_counter, soc)
+        w.pos += FRAME_HEADER_V2_LEN
+        return w.put(data).view()
+
     def get_battery_status(self, as_string=True):
+        """
+        Batería según BatteryService (medida cacheada). as_string: "Bateria: 12.30V, SOC: 87%";
+        si no, voltios como hasta ahora. Los reportes usan battery.read() (mV enteros).
+        """
         self.feed_watchdog()
+        if as_string:
+            return self.battery.describe()
+        return self.battery.read() / 1000
+
+    def battery_field(self):
+        """Campo de batería "<mV>/<%>" para los mensajes de texto que no pasan por build_report."""
+        return battery_field(self.battery.read(), self.battery.soc)
+
+    def on_battery_cal(self, sender, payload, args):
+        """BATCAL:<mV>: calibra la medida con la tensión real de la batería y la guarda en flash."""
         try:
-            try:
-                av = self.xbee_.atcmd("AV")
-            except KeyError:
-                av = None
-            reference_v = self.AV_VALUES.get(av, 2.5)
-            adc_raw_value = self.adc_battery.read()
-            pin_voltage = (adc_raw_value / 4095.0) * reference_v
-            battery_voltage = pin_voltage * (12.0 / 3.3) * 2.9
-            if as_string:
-                return "Bateria: {:.2f}V".format(battery_voltage)
-            return battery_voltage
-        except Exception as e:
-            self.feed_watchdog()
-            print("Error leyendo batería: {}".format(e))
-            return "Bateria: ERROR" if as_string else 0.0
+            actual_mv = int(args)
+        except ValueError:
+            self.on_unknown_command(sender, payload)
+            return
+        if self.battery.calibrate(actual_mv):
+            self.reply_ok(sender, payload)
+        else:
+            self.safe_send(sender, payload + b':ERROR')
 
     def send_message(self, target_addr, message):
         """
         Envía un mensaje sin esperar confirmación.
         """
         self.feed_watchdog()
+        if target_addr == self.reply_target:
+            self.dup_filter.set_reply(target_addr, message)
         try:
+            self.metrics.inc(metrics.TX_FRAMES)
             xbee.transmit(target_addr, message)
             self.feed_watchdog()
             return True
         except Exception as e:
             self.feed_watchdog()
-            print("Error al enviar mensaje: {}".format(e))
+            self.metrics.inc(metrics.TX_ERRORS)
+            self.log(eventlog.SEND_ERROR, e)
             self.contador_fallo_comunicacion += 1
             return False
 
@@ -118,106 +895,651 @@ class XBeeDevice:
         Reintenta hasta 'retries' veces si hay error en el envío.
         """
         self.feed_watchdog()
+        if target_addr == self.reply_target:
+            self.dup_filter.set_reply(target_addr, message)
         for attempt in range(retries):
             try:
-                print("Enviando sin ack (intento {}/{}) '{}'".format(attempt + 1, retries, message))
+                self.log(eventlog.TX_NOACK, attempt + 1, len(message))
+                self.metrics.inc(metrics.TX_FRAMES)
                 xbee.transmit(target_addr, message)
                 self.feed_watchdog()
                 time.sleep_ms(self.SLEEP_DURATION_MS)
                 return True
             except Exception as e:
                 self.feed_watchdog()
-                print("Error al transmitir/recibir: {}".format(e))
+                self.metrics.inc(metrics.TX_ERRORS)
+                self.log(eventlog.TX_ERROR, e)
                 if attempt < retries - 1:
-                    print("Reintentando en {} segundos...".format(self.RETRY_DELAY_MS / 1000))
-                    time.sleep_ms(self.RETRY_DELAY_MS)
+                    self.metrics.inc(metrics.RETRIES)
+                    delay_ms = self.retry_delay(attempt + 1)
+                    self.log(eventlog.RETRY_IN, delay_ms)
+                    time.sleep_ms(delay_ms)
                 else:
-                    print("Fallo al enviar mensaje tras varios reintentos.")
+                    self.log(eventlog.SEND_FAILED)
                     self.contador_fallo_comunicacion += 1
-                    if target_addr == self.coordinator_addr and not self.coordinator_retry_active:
-                        self.coordinator_retry_active = True
-                        self.last_coordinator_retry_time = time.ticks_ms()
-                        print("Activando reintentos periódicos al coordinador cada 12 horas.")
+                    if target_addr == self.coordinator_addr:
+                        self.coordinator_unreachable()
                     return False
-        print("Mensaje enviado correctamente.")
+        self.log(eventlog.SEND_OK)
         return True
 
-    def safe_send_and_wait_ack(self, target_addr, message, retries=3):
+    def send_as(self, kind, target_addr, message):
         """
-        Envía un mensaje y espera un ACK del destinatario.
-        Reintenta hasta 'retries' veces si no recibe confirmación.
+        Envía 'message' con el modo de entrega que DELIVERY asigna a 'kind' ('REPORT', 'COMMAND'...).
+        Devuelve True si el destino lo confirmó (en NOACK, si la radio aceptó la trama).
+        """
+        mode = self.DELIVERY.get(kind, DELIVERY_APP)
+        if mode == DELIVERY_APP:
+            delivered = self.safe_send_and_wait_ack(target_addr, message)
+        else:
+            delivered = self.send_confirmed(target_addr, message, mode == DELIVERY_RADIO)
+        if delivered and mode != DELIVERY_NOACK and target_addr == self.coordinator_addr:
+            self.coordinator_reachable()
+            self.flush_outbox()
+        return delivered
+
+    def send_report(self, data, kind='REPORT'):
+        """
+        build_report + send_as al coordinador. Si no se entrega, el reporte (con la batería y
+        los flags de este momento) queda en el outbox para el siguiente lote.
+        """
+        if self.send_as(kind, self.coordinator_addr, self.build_report(data)):
+            return True
+        self.store_report(data)
+        return False
+
+    def store_report(self, data):
+        self.outbox.add(self.battery.read(), self.battery.soc, self.get_report_flags(), data)
+        self.log(eventlog.OUTBOX_STORED, len(self.outbox), self.outbox.dropped)
+
+    def build_batch(self):
+        """
+        Lote con los registros más antiguos del outbox que quepan en OUTBOX_FRAME_BYTES, en
+        tx_writer y precedido de la cabecera de reporte con la batería actual.
+        Texto: "NODO:<mV>/<%>:BATCH:<descartados>|<antigüedad s>,<mV>,<%>,<flags>,<datos>|..."
+        Binario: trama MSG_BATCH con descartados (B) y BATCH_RECORD_FMT + datos por registro.
+        Devuelve (mensaje, registros incluidos); al menos uno, con los datos recortados si hace falta.
+        """
+        now = time.ticks_ms()
+        dropped = min(self.outbox.dropped, 0xFF)
+        binary = self.BINARY_REPORTS
+        if binary:
+            self.build_report(b'', MSG_BATCH)
+        else:
+            self.build_report(BATCH_PREFIX)
+        w = self.tx_writer
+        if binary:
+            w.put_byte(dropped)
+        else:
+            w.put_int(dropped)
+        limit = w.HEADROOM + self.OUTBOX_FRAME_BYTES
+        count = 0
+        for stamp, battery_mv, soc, flags, data in self.outbox.records:
+            age_s = max(time.ticks_diff(now, stamp), 0) // 1000
+            start = w.pos
+            if binary:
+                w.pos += BATCH_RECORD_LEN                       # Cabecera del registro, al final (longitud)
+            else:
+                w.put_byte(124).put_int(age_s).put_byte(44).put_int(battery_mv).put_byte(44)
+                w.put_int(soc).put_byte(44).put_int(flags).put_byte(44)
+            size = min(len(data), max(limit - w.pos, 0))
+            if count and size < len(data):
+                w.pos = start                                   # No cabe entero: al siguiente lote
+                break
+            for i in range(size):
+                byte = data[i]
+                w.put_byte(47 if byte == 124 and not binary else byte)   # '|' separa registros de texto
+            if binary:
+                struct.pack_into(BATCH_RECORD_FMT, w.buf, start, age_s, battery_mv, soc, flags, size)
+            count += 1
+        return (w.view() if binary else w), count
+
+    def flush_outbox(self):
+        """
+        Envía el outbox al coordinador en lotes mientras los confirme. Se llama tras cada envío
+        confirmado por el coordinador. Devuelve True si el outbox queda vacío.
+        """
+        if self.outbox_flushing or not len(self.outbox):
+            return not len(self.outbox)
+        self.outbox_flushing = True
+        try:
+            while len(self.outbox):
+                message, count = self.build_batch()
+                if not self.send_as('BATCH', self.coordinator_addr, message):
+                    return False
+                self.outbox.remove(count)
+                self.log(eventlog.OUTBOX_FLUSHED, count, len(self.outbox))
+            return True
+        finally:
+            self.outbox_flushing = False
+
+    def coordinator_reachable(self):
+        """El coordinador ha confirmado un envío: fin de los reintentos y del backoff."""
+        self.coordinator_retry_count = 0
+        if self.coordinator_retry_active:
+            self.coordinator_retry_active = False
+            self.contador_fallo_comunicacion = 0
+            self.log(eventlog.COORD_RETRY_OK)
+
+    def coordinator_unreachable(self):
+        """Primer envío fallido al coordinador: activa los reintentos con backoff exponencial."""
+        if not self.coordinator_retry_active:
+            self.coordinator_retry_active = True
+            self.coordinator_retry_count = 0
+            self.schedule_coordinator_retry()
+            self.log(eventlog.COORD_RETRY_ON, self.coordinator_retry_delay_ms)
+
+    def schedule_coordinator_retry(self):
+        """
+        Siguiente reintento al coordinador: backoff exponencial con jitter desde
+        COORDINATOR_RETRY_MIN_MS (segundos) hasta COORDINATOR_RETRY_INTERVAL_MS (12 h).
+        """
+        self.coordinator_retry_count = min(self.coordinator_retry_count + 1, self.COORDINATOR_RETRY_MAX_STEPS)
+        self.coordinator_retry_delay_ms = backoff_delay(self.coordinator_retry_count, self.COORDINATOR_RETRY_MIN_MS,
+                                                        self.COORDINATOR_RETRY_INTERVAL_MS, self.random16())
+        self.last_coordinator_retry_time = time.ticks_ms()
+
+    def send_confirmed(self, target_addr, message, acked=True, retries=3):
+        """
+        Envío sin respuesta de aplicación: el mensaje va marcado como tal ("<seq>!" o FLAG_NO_REPLY)
+        y la entrega la confirma el estado de transmisión (xbee.transmit lanza OSError si el
+        destino no confirma). Con acked=False se desactivan el ACK y los reintentos de radio.
+        """
+        self.feed_watchdog()
+        if isinstance(message, TEXT_MESSAGES):
+            message = self.add_sequence(target_addr, message, reply=False)
+        elif message and message[0] & 0xF0 == FRAME_MARKER and len(message) >= FRAME_HEADER_LEN:
+            if not isinstance(message, memoryview):
+                message = bytearray(message)
+            message[6] |= FLAG_NO_REPLY
+        options = 0 if acked else TX_OPT_DISABLE_ACK
+        attempts = retries if acked else 1
+        for attempt in range(attempts):
+            try:
+                if attempt:
+                    self.metrics.inc(metrics.RETRIES)
+                self.metrics.inc(metrics.TX_FRAMES)
+                self.log(eventlog.TX_RADIO, attempt + 1, len(message))
+                xbee.transmit(target_addr, message, tx_options=options)
+                return True
+            except Exception as e:
+                self.feed_watchdog()
+                self.metrics.inc(metrics.TX_ERRORS)
+                self.log(eventlog.RADIO_NACK, e)
+                if attempt < attempts - 1:
+                    time.sleep_ms(self.retry_delay(attempt + 1))
+        self.on_send_failed(target_addr)
+        return False
+
+    def on_send_failed(self, target_addr):
+        """Contabiliza un envío fallido; con el coordinador activa los reintentos con backoff."""
+        self.contador_fallo_comunicacion += 1
+        self.log(eventlog.CONFIRM_FAILED)
+        if target_addr == self.coordinator_addr:
+            self.coordinator_unreachable()
+
+    def reply_ok(self, sender, payload):
+        """Eco "<comando>:OK" al remitente, salvo que enviara el comando sin esperar respuesta."""
+        if self.reply_wanted:
+            self.safe_send(sender, self.reply_writer.reset().put(payload).put(b':OK').view())
+
+    def safe_send_and_wait_ack(self, target_addr, message, retries=3, accept=is_reply):
+        """
+        Envía un mensaje y espera un ACK del destinatario: una respuesta suya que acepte 'accept'
+        (por defecto cualquiera, is_reply); sus reportes, comandos u otras respuestas que lleguen
+        mientras tanto se apartan para el bucle principal.
+        Reintenta hasta 'retries' veces si no recibe confirmación. El plazo de ACK sale del
+        RTT estimado para el destino y entre intentos se espera con backoff y jitter,
+        escuchando por si llega tarde el ACK del intento anterior.
         """
         self.feed_watchdog()
-        respuesta_recibida = False
+        if isinstance(message, TEXT_MESSAGES):
+            # Los reintentos repiten la secuencia: el receptor descarta las copias
+            message = self.add_sequence(target_addr, message)
+        match = lambda frame: frame['sender_eui64'] == target_addr and accept(frame['payload'])  # noqa: E731
         for attempt in range(retries):
+            receivedg = None
             try:
-                print("Enviando con ACK (intento {}/{}) '{}'".format(attempt + 1, retries, message))
+                self.log(eventlog.TX_ACK, attempt + 1, len(message))
+                if attempt:
+                    self.metrics.inc(metrics.RETRIES)
+                self.metrics.inc(metrics.TX_FRAMES)
                 xbee.transmit(target_addr, message)
                 
-                # Esperar feedback
+                # Esperar feedback (las tramas de otros remitentes quedan en rx_pending)
                 start_wait = time.ticks_ms()
-
-                while time.ticks_diff(time.ticks_ms(), start_wait) < (self.HEARING_INTERVAL_MS):
-                    self.feed_watchdog()
-                    receivedg = xbee.receive()
-                    if receivedg and receivedg['sender_eui64'] == target_addr:
-                        payload = receivedg['payload'].decode('utf-8')
-                        print("Recibido: '{}'".format(payload))
-                        respuesta_recibida = True
-                        return True
-                    time.sleep_ms(self.SLEEP_DURATION_MS)
-                if not respuesta_recibida:
-                    print("No se recibió confirmacion en el tiempo esperado.")
+                receivedg = self.wait_frame(match, self.rtt.timeout(target_addr))
+                if not receivedg:
+                    self.metrics.inc(metrics.ACK_TIMEOUTS)
+                    self.rtt.on_timeout(target_addr)
+                    self.log(eventlog.ACK_TIMEOUT)
+                    if attempt < retries - 1:
+                        delay_ms = self.retry_delay(attempt + 1)
+                        self.log(eventlog.RETRY_IN, delay_ms)
+                        receivedg = self.wait_frame(match, delay_ms)
+                if receivedg:
+                    payload = receivedg['payload']
+                    rtt_ms = time.ticks_diff(time.ticks_ms(), start_wait)
+                    self.metrics.observe_rtt(rtt_ms)
+                    if not attempt:
+                        self.rtt.sample(target_addr, rtt_ms)    # Karn: solo si hubo una única copia
+                    self.log(eventlog.ACK_RECEIVED, len(payload))
+                    if payload[:3] == b'OK|':
+                        # Comandos guardados para este dispositivo en el buzón del coordinador
+                        for command in payload[3:].split(b'|'):
+                            self.dispatch_command(target_addr, command)
+                    return True
 
             except Exception as e:
                 self.feed_watchdog()
-                print("Error al transmitir/recibir: {}".format(e))
-
-            if attempt < retries - 1:
-                self.feed_watchdog()
-                print("Reintentando en {} segundos...".format(self.RETRY_DELAY_MS / 1000))
-                time.sleep_ms(self.RETRY_DELAY_MS)
-        self.contador_fallo_comunicacion += 1
-        print("Fallo al enviar y confirmar mensaje tras varios reintentos.")
-        if target_addr == self.coordinator_addr and not self.coordinator_retry_active:
-            self.coordinator_retry_active = True
-            self.last_coordinator_retry_time = time.ticks_ms()
-            print("Activando reintentos periódicos al coordinador cada 12 horas.")
+                self.metrics.inc(metrics.TX_ERRORS)
+                self.log(eventlog.TX_ERROR, e)
+                if attempt < retries - 1:
+                    time.sleep_ms(self.retry_delay(attempt + 1))
+        self.on_send_failed(target_addr)
         return False
     
+    def watch_receive(self):
+        """
+        Registra on_receive como callback de recepción sobre una FrameQueue preasignada.
+        Devuelve False si el firmware no lo permite (se sigue sondeando xbee.receive).
+        """
+        queue = FrameQueue(self.RX_QUEUE_SIZE)
+        try:
+            xbee.receive_callback(self.on_receive)
+        except Exception:
+            return False
+        self.rx_queue = queue
+        return True
+
+    def on_receive(self, frame):
+        """Callback de recepción: solo encola y cuenta (sin reservar memoria)."""
+        self.metrics.inc(metrics.RX_FRAMES)
+        if not self.rx_queue.push(frame):
+            self.metrics.inc(metrics.RX_QUEUE_DROPS)
+        self.metrics.high_water(metrics.RX_QUEUE_HWM, self.rx_queue.count)
+
+    def radio_receive(self):
+        """Siguiente trama de la radio: de rx_queue con receive_callback o de xbee.receive."""
+        queue = self.rx_queue
+        if queue is not None:
+            return queue.pop()
+        frame = xbee.receive()
+        if frame:
+            self.metrics.inc(metrics.RX_FRAMES)
+        return frame
+
+    def wait_rx(self, timeout_ms):
+        """
+        Duerme hasta timeout_ms. Con receive_callback vuelve en cuanto hay una trama en
+        rx_queue (el callback se ejecuta durante sleep_ms); sondeando, duerme el plazo entero.
+        """
+        queue = self.rx_queue
+        if queue is None:
+            time.sleep_ms(timeout_ms)
+            return
+        start = time.ticks_ms()
+        while not queue.count and time.ticks_diff(time.ticks_ms(), start) < timeout_ms:
+            time.sleep_ms(self.RX_WAIT_SLICE_MS)
+
+    def receive_frame(self):
+        """
+        Siguiente trama para el bucle principal: primero las apartadas durante las esperas
+        de ACK (en orden de llegada) y después la cola de la radio. None si no hay ninguna.
+        """
+        if self.rx_pending:
+            return self.rx_pending.pop(0)
+        return self.radio_receive()
+
+    def wait_frame(self, match, timeout_ms):
+        """
+        Espera hasta timeout_ms una trama de la radio con match(trama) verdadero y la devuelve
+        (None si no llega). Las demás se apartan en rx_pending en lugar de perderse.
+        Las ya apartadas no se comparan: llegaron antes de lo que se está esperando.
+        """
+        start = time.ticks_ms()
+        while True:
+            remaining = timeout_ms - time.ticks_diff(time.ticks_ms(), start)
+            if remaining <= 0:
+                break
+            self.feed_watchdog()
+            frame = self.radio_receive()
+            if not frame:
+                self.wait_rx(min(remaining, self.SLEEP_DURATION_MS))
+                continue
+            if match(frame):
+                return frame
+            self.queue_frame(frame)
+        return None
+
+    def queue_frame(self, frame):
+        """Aparta una trama para el bucle principal; con la cola llena se descarta la más antigua."""
+        pending = self.rx_pending
+        if len(pending) >= self.RX_PENDING_MAX:
+            pending.pop(0)
+            self.metrics.inc(metrics.RX_PENDING_DROPS)
+        pending.append(frame)
+        self.metrics.high_water(metrics.RX_PENDING_HWM, len(pending))
+
     def check_received_messages(self):
         """
         Revisa si han llegado mensajes y los devuelve.
         """
         try:
-            receivedg = xbee.receive()
+            receivedg = self.receive_frame()
             self.feed_watchdog()
             if receivedg:
                 payload = receivedg['payload'].decode('utf-8')
                 sender = receivedg['sender_eui64']
-                print("Mensaje recibido de {}: '{}'".format(sender, payload))
+                self.log(eventlog.RX_MESSAGE, sender, len(payload))
                 return sender, payload
             return None, None
         except Exception as e:
             self.feed_watchdog()
-            print("Error al recibir mensaje: {}".format(e))
+            self.log(eventlog.RX_ERROR, e)
             return None, None
 
+    def bind_commands(self, table):
+        """Convierte una tabla {clave: 'nombre_metodo'} en {clave: método enlazado}."""
+        return {key: getattr(self, name) for key, name in table.items()}
+
+    def dispatch_command(self, sender, payload, requested=False):
+        """
+        Ejecuta el manejador registrado para 'payload' con una única búsqueda en el diccionario.
+        La clave es el primer byte si es un opcode binario (>= 0x80) o el texto antes del primer ':'.
+        requested: el llamante ya quitó el sobre "<seq>#" de un mensaje que espera respuesta.
+        Devuelve True si se ejecutó un comando.
+        """
+        if not payload:
+            return False
+        reply_wanted = wants_reply(payload)
+        seq, payload = split_sequence(payload)
+        if seq is not None and not self.dup_filter.accept(sender, seq, SEQ_MODULUS):
+            if reply_wanted:
+                self.resend_reply(sender)
+            return False
+        if payload and payload[0] < 0x80 and payload[-1] <= 0x20:
+            payload = payload.rstrip()          # Solo texto: en un opcode binario es un argumento
+        if not payload:
+            return False
+        if payload[:3] == b'OK|':
+            # Comandos del buzón adjuntos a un ACK que llega al bucle principal (envío sin espera)
+            for command in payload[3:].split(b'|'):
+                self.dispatch_command(sender, command)
+            return True
+        first = payload[0]
+        if first >= 0x80:
+            handler = self.command_handlers.get(first)
+            args = payload[1:]
+        else:
+            sep = payload.find(b':')
+            if sep < 0:
+                handler = self.command_handlers.get(payload)
+                args = b''
+            else:
+                handler = self.command_handlers.get(payload[:sep])
+                args = payload[sep + 1:]
+        if handler is None:
+            # Solo piden respuesta los mensajes con sobre "<seq>#" o binarios sin FLAG_NO_REPLY
+            self.reply_wanted = reply_wanted and (requested or seq is not None or first >= 0x80)
+            try:
+                self.on_unknown_command(sender, payload)
+            finally:
+                self.reply_wanted = True
+            return False
+        self.reply_target = sender
+        self.reply_wanted = reply_wanted
+        try:
+            handler(sender, payload, args)
+        finally:
+            self.reply_target = None
+            self.reply_wanted = True
+        return True
+
+    def add_sequence(self, target_addr, message, reply=True):
+        """
+        Antepone el sobre "<seq>#" ("<seq>!" si no se espera respuesta) con la siguiente secuencia
+        hacia 'target_addr'. Un MessageWriter lo escribe en su hueco inicial y devuelve la vista.
+        """
+        seq = next_sequence(self.tx_seq.get(target_addr), SEQ_MODULUS)
+        self.tx_seq[target_addr] = seq
+        if isinstance(message, MessageWriter):
+            return message.sequenced(seq, 35 if reply else 33)      # '#' / '!'
+        return "{}{}{}".format(seq, '#' if reply else '!', message)
+
+    def resend_reply(self, sender):
+        """Duplicado: repite la última respuesta enviada a 'sender' sin volver a procesar el mensaje."""
+        reply = self.dup_filter.get_reply(sender)
+        self.metrics.inc(metrics.DUPLICATES)
+        self.log(eventlog.DUPLICATE, sender)
+        if reply is not None:
+            self.send_message(sender, reply)
+
+    def on_unknown_command(self, sender, payload):
+        """
+        Cuenta los comandos desconocidos. Solo responde si el remitente esperaba respuesta y el
+        mensaje no es otra respuesta (ACK tardío, UNKNOWN de otro nodo: contestar crearía un
+        bucle), y como mucho una vez por UNKNOWN_REPLY_INTERVAL_MS.
+        """
+        self.metrics.inc(metrics.UNKNOWN_COMMANDS)
+        if not self.reply_wanted or is_reply(payload):
+            return
+        now = time.ticks_ms()
+        if self.last_unknown_reply is not None and time.ticks_diff(now, self.last_unknown_reply) < self.UNKNOWN_REPLY_INTERVAL_MS:
+            return
+        self.last_unknown_reply = now
+        self.log(eventlog.UNKNOWN_COMMAND, sender, payload)
+        self.send_message(sender, self.UNKNOWN_COMMAND_REPLY)
+
+    def check_and_process_incoming_messages(self):
+        """
+        Revisa si hay mensajes entrantes y los despacha según COMMANDS.
+        Devuelve True si se procesó un comando, False en caso contrario.
+        """
+        self.feed_watchdog()
+        try:
+            received = self.receive_frame()
+        except Exception as e:
+            self.feed_watchdog()
+            self.log(eventlog.RX_ERROR, e)
+            return False
+        if not received:
+            return False
+        return self.dispatch_command(received['sender_eui64'], received['payload'])
+
+    def on_metrics(self, sender, payload, args):
+        """METRICS: responde con el volcado de contadores ("METRICS:rx=..,tx=..,...") y de tiempos por estado."""
+        if not args:
+            dump = self.metrics.dump()
+            if self.fsm is not None:
+                dump += "," + self.fsm.dump()
+            self.safe_send(sender, "METRICS:" + dump)
+
+    def on_logs(self, sender, payload, args):
+        """
+        LOGS: envía el anillo de eventos, del más antiguo al más reciente, en tramas
+        "LOGS:p<n>/<total>,<ticks_ms actual>:<ticks>,<código>,<a>,<b>;...". La 'p' evita que
+        el coordinador tome "<n>/<total>" por el campo de batería "<mV>/<%>" de un reporte.
+        """
+        if args:
+            return                                      # Trozo de LOGS de otro nodo (lo trata el coordinador)
+        for part in self.log_parts():
+            self.safe_send(sender, "LOGS:" + part)
+
+    def log_parts(self):
+        """Trozos "p<n>/<total>,<ticks_ms actual>:<registros>" del anillo de eventos (ver on_logs)."""
+        chunks = self.events.chunks(self.LOGS_CHUNK_BYTES)
+        now = time.ticks_ms()
+        return ["p{}/{},{}:{}".format(n + 1, len(chunks), now, chunk) for n, chunk in enumerate(chunks)]
+
+    def camera_is_on(self):
+        return self.pin_camera.value() != 0
+
+    def write_status_report(self, w):
+        """Estado con el que se responde a REQ_REPORT: "Estado: 2, Camara: OFF, Bateria: 12.30V, SOC: 87%, Manual: False"."""
+        w.put(b"Estado: ").put_int(self.device_state)
+        w.put(b", Camara: ").put(b"ON" if self.camera_is_on() else b"OFF")
+        battery_mv = self.battery.read()
+        if self.battery.mv is None:
+            w.put(b", Bateria: ERROR")
+        else:
+            w.put(b", Bateria: ").put_millis(battery_mv).put(b"V, SOC: ").put_int(self.battery.soc).put_byte(37)
+        return w.put(b", Manual: ").put_bool(self.manual_camera)
+
+    def on_req_report(self, sender, payload, args):
+        """REQ_REPORT: responde al solicitante con el estado del dispositivo (en reply_writer)."""
+        w = self.reply_writer.reset().put(self.node_id_bytes).put(b": ")
+        self.safe_send(sender, self.write_status_report(w).view())
+        if sender == self.coordinator_addr:
+            self.contador_fallo_comunicacion = 0
+
     def check_coordinator_retry(self):
         """
         Background check for coordinator retries. Call this in the main loop of subclasses.
-        Sends a report every 12 hours if retries are active, until success.
+        While retries are active, probes the coordinator when the backoff delay expires: with the
+        outbox's first batch if it holds reports, with a generic report otherwise.
         """
         if self.coordinator_retry_active:
             current_time = time.ticks_ms()
-            if time.ticks_diff(current_time, self.last_coordinator_retry_time) >= self.COORDINATOR_RETRY_INTERVAL_MS:
-                battery_voltage = self.get_battery_status(as_string=False)
-                message = "{}:{:.2f}:Reporte de reintento.".format(self.device_node_id, battery_voltage)
-                print("Enviando reporte de reintento al coordinador...")
-                if self.safe_send_and_wait_ack(self.coordinator_addr, message):
-                    self.coordinator_retry_active = False
-                    self.contador_fallo_comunicacion = 0  # Reset on success
-                    print("Reintento exitoso: desactivando reintentos periódicos.")
+            if time.ticks_diff(current_time, self.last_coordinator_retry_time) >= self.coordinator_retry_delay_ms:
+                self.log(eventlog.COORD_RETRY)
+                if len(self.outbox):
+                    delivered = self.flush_outbox()
+                else:
+                    delivered = self.send_as('BATCH', self.coordinator_addr, self.build_report(b"Reporte de reintento."))
+                if not delivered and self.coordinator_retry_active:
+                    self.schedule_coordinator_retry()
+                    self.log(eventlog.COORD_RETRY_FAILED, self.coordinator_retry_delay_ms)
+
+    # --- Máquina de estados común (run_machine) ---
+    def run(self):
+        """Bucle principal por defecto de los perfiles. Telemando y coordinador tienen el suyo."""
+        self.run_machine()
+
+    def check_pins_sensor(self):
+        """Actualiza pin_sensor_general. Los perfiles con sensor lo redefinen."""
+        self.feed_watchdog()
+
+    def rest_state(self):
+        """Estado de reposo: SLEEP con deep sleep, IDLE en caso contrario."""
+        return self.STATE_SLEEP if self.deep_sleep else self.STATE_IDLE
+
+    def build_state_machine(self):
+        """
+        Tabla de estados del perfil. Los perfiles redefinen los ticks (state_*) o añaden
+        estados y guardas con fsm.add()/fsm.guard() sobre la máquina que devuelve este método.
+        """
+        fsm = StateMachine(self.STATE_NAMES, self.STATE_STARTUP)
+        fsm.add(self.STATE_STARTUP, tick=self.state_startup)
+        fsm.add(self.STATE_SLEEP, tick=self.state_sleep)
+        fsm.add(self.STATE_IDLE, tick=self.state_idle)
+        fsm.add(self.STATE_REPORT_BATTERY, tick=self.state_report_battery)
+        fsm.add(self.STATE_SENSOR_TRIGGERED, tick=self.state_sensor_triggered)
+        fsm.add(self.STATE_ERROR, tick=self.state_error)
+        # Tras un error solo se vuelve a arrancar con la radio asociada a la red
+        fsm.guard(self.STATE_ERROR, self.STATE_STARTUP, self.is_associated)
+        return fsm
+
+    def is_associated(self):
+        ai = self.at.get('AI')
+        return ai == 0 or ai is None
+
+    def run_machine(self):
+        """
+        Bucle principal de los perfiles sobre StateMachine. Los manejadores de COMMANDS pueden
+        seguir cambiando device_state: el cambio se aplica como una transición más.
+        """
+        fsm = self.fsm = self.build_state_machine()
+        self.setup()
+        state = None
+        while True:
+            self.feed_watchdog()
+            try:
+                if self.device_state != fsm.state and not fsm.go(self.device_state):
+                    self.device_state = fsm.state
+                if fsm.state != state:
+                    state = fsm.state
+                    self.log(eventlog.STATE, self.STATE_NAMES[state])
+                fsm.step()
+                self.device_state = fsm.state
+                self.check_coordinator_retry()  # Background check for coordinator retries
+            except Exception as e:
+                self.feed_watchdog()
+                self.log(eventlog.LOOP_ERROR, e)
+                fsm.go(self.STATE_ERROR)
+                self.device_state = self.STATE_ERROR
+                time.sleep_ms(self.STATE_ERROR_SLEEP_MS)
+
+    def state_startup(self):
+        self.feed_watchdog()
+        message = self.build_report(b"Dispositivo iniciado.", MSG_HELLO)
+        if self.send_as('HELLO', self.coordinator_addr, message):
+            return self.rest_state()
+        self.log(eventlog.STARTUP_FAILED)
+        return self.STATE_ERROR
+
+    def state_idle(self):
+        """Una vuelta de la espera activa: sensor, mensajes y pausa hasta la siguiente trama."""
+        self.check_pins_sensor()
+        if self.pin_sensor_general:
+            return self.STATE_SENSOR_TRIGGERED
+        if not self.check_and_process_incoming_messages():
+            self.wait_rx(self.SLEEP_DURATION_MS)  # Pequeña pausa para no saturar CPU (vuelve antes si llega una trama)
+        return None
+
+    def state_sleep(self):
+        self.feed_watchdog()
+        try:
+            self.xbee_.sleep_now(self.DEEP_SLEEP_DURATION_MS, True)
+            self.battery.invalidate()  # Medida nueva al despertar
+            if self.xbee_.wake_reason() is xbee.PIN_WAKE:
+                self.log(eventlog.WAKE_SENSOR)
+                return self.STATE_SENSOR_TRIGGERED
+            self.log(eventlog.WAKE_TIMEOUT)
+            return self.STATE_REPORT_BATTERY
+        except Exception as e:
+            self.log(eventlog.WAKE_ERROR, e)
+            return self.STATE_SENSOR_TRIGGERED
+
+    def state_report_battery(self):
+        self.feed_watchdog()
+        if self.send_report(b"Reporte periodico."):
+            self.contador_fallo_comunicacion = 0
+        else:
+            self.contador_fallo_comunicacion += 1
+        return self.rest_state()
+
+    def state_sensor_triggered(self):
+        """Mientras el sensor siga activo: notificación a la cámara (con debounce) y cámara local."""
+        self.check_pins_sensor()
+        if not self.pin_sensor_general:
+            if self.local_camera and self.pin_camera.value() == 1:
+                self.turn_off_camera()
+            self.log(eventlog.SENSOR_CLEARED)
+            return self.rest_state()
+        current_time = time.ticks_ms()
+        # Comprobar si ha pasado suficiente tiempo desde la última notificación para no saturar la red a mensajes
+        if self.camera_remote:
+            elapsed = time.ticks_diff(current_time, self.last_sensor_notification_time)
+            if elapsed >= self.DEBOUNCE_SENSOR_TIME_MS:
+                self.log(eventlog.SENSOR_NOTIFY)
+                if self.send_as('COMMAND', self.remote_camera_addr, "SENSOR:ON"):
+                    self.last_sensor_notification_time = current_time
                 else:
-                    self.last_coordinator_retry_time = current_time
-                    print("Reintento fallido: programando siguiente en 12 horas.")
\ No newline at end of file
+                    self.contador_fallo_comunicacion += 1
+            else:
+                self.log(eventlog.SENSOR_HOLDOFF, (self.DEBOUNCE_SENSOR_TIME_MS - elapsed) // 1000)
+        if self.local_camera and time.ticks_diff(current_time, self.camera_on_time) >= self.CAMERA_ON_DURATION_MS:
+            self.turn_on_camera()  # Activar cámara localmente
+            self.camera_on_time = current_time
+        time.sleep_ms(self.CHECK_SENSOR_INTERVAL_MS)  # Esperar antes de verificar de nuevo
+        return None
+
+    def state_error(self):
+        self.feed_watchdog()
+        self.log(eventlog.RECONNECT, self.STATE_ERROR_SLEEP_MS)
+        time.sleep_ms(self.STATE_ERROR_SLEEP_MS)
+        if not self.setup():
+            return None
+        self.feed_watchdog()
+        return self.STATE_STARTUP